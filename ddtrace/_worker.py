@@ -14,6 +14,8 @@ class PeriodicWorkerThread(object):
     This class can be used to instantiate a worker thread that will run its `run_periodic` function every `interval`
     seconds.
 
+    The worker can be woken up with `wake` to run `run_periodic` before the end of the current interval.
+
     The method `on_shutdown` will be called on worker shutdown. The worker will be shutdown when the program exits and
     can be waited for with the `exit_timeout` parameter.
 
@@ -33,6 +35,7 @@ class PeriodicWorkerThread(object):
         self._thread = threading.Thread(target=self._target, name=name)
         self._thread.daemon = daemon
         self._stop = threading.Event()
+        self._wake = threading.Event()
         self.started = False
         self.interval = interval
         self.exit_timeout = exit_timeout
@@ -60,6 +63,11 @@ class PeriodicWorkerThread(object):
         """Stop the worker."""
         _LOG.debug("Stopping %s thread", self._thread.name)
         self._stop.set()
+        self._wake.set()
+
+    def wake(self):
+        """Wake the worker up to run `run_periodic` without waiting for the end of the interval."""
+        self._wake.set()
 
     def is_alive(self):
         return self._thread.is_alive()
@@ -68,7 +76,12 @@ class PeriodicWorkerThread(object):
         return self._thread.join(timeout)
 
     def _target(self):
-        while not self._stop.wait(self.interval):
+        while True:
+            self._wake.wait(self.interval)
+            if self._stop.is_set():
+                break
+            # Clear before running so that wake-ups requested while running are not missed
+            self._wake.clear()
             self.run_periodic()
         self._on_shutdown()
 
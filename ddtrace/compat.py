@@ -1,3 +1,4 @@
+import functools
 import platform
 import random
 import re
@@ -112,6 +113,41 @@ else:
     main_thread = threading.main_thread()
 
 
+def bounded_cache(maxsize=128):
+    """Cache the results of a function of hashable positional arguments.
+
+    The cache is cleared when it holds ``maxsize`` results: this is cheaper than tracking the least recently used
+    results, and the caches are expected to hold all the results most of the time.
+    """
+
+    def decorator(f):
+        cache = {}
+
+        @functools.wraps(f)
+        def wrapper(*args):
+            try:
+                return cache[args]
+            except KeyError:
+                pass
+            result = f(*args)
+            if len(cache) >= maxsize:
+                cache.clear()
+            cache[args] = result
+            return result
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator
+
+
+try:
+    from functools import lru_cache
+except ImportError:
+    # DEV: Python 2 has no `lru_cache`
+    lru_cache = bounded_cache
+
+
 if PYTHON_VERSION_INFO[0:2] >= (3, 4):
     from asyncio import iscoroutinefunction
 
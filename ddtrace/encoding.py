@@ -1,6 +1,7 @@
 import json
 
 from .internal._encoding import MsgpackEncoder
+from .internal._encoding import SpanJSONEncoder
 from .internal.logger import get_logger
 
 
@@ -51,6 +52,14 @@ class _EncoderBase(object):
 class JSONEncoder(_EncoderBase):
     content_type = "application/json"
 
+    _span_encoder = SpanJSONEncoder()
+
+    def encode_traces(self, traces):
+        return self._span_encoder.encode_traces(traces)
+
+    def encode_trace(self, trace):
+        return self._span_encoder.encode_trace(trace)
+
     @staticmethod
     def encode(obj):
         return json.dumps(obj)
@@ -68,26 +77,16 @@ class JSONEncoderV2(JSONEncoder):
 
     content_type = "application/json"
 
-    def encode_traces(self, traces):
-        normalized_traces = [[JSONEncoderV2._convert_span(span) for span in trace] for trace in traces]
-        return self.encode({"traces": normalized_traces})
+    _span_encoder = SpanJSONEncoder(hex_ids=True)
 
-    def encode_trace(self, trace):
-        return self.encode([JSONEncoderV2._convert_span(span) for span in trace])
+    def encode_traces(self, traces):
+        return '{"traces": ' + self._span_encoder.encode_traces(traces) + "}"
 
     @staticmethod
     def join_encoded(objs):
         """Join a list of encoded objects together as a json array"""
         return '{"traces":[' + ",".join(objs) + "]}"
 
-    @staticmethod
-    def _convert_span(span):
-        sp = span.to_dict()
-        sp["trace_id"] = JSONEncoderV2._encode_id_to_hex(sp.get("trace_id"))
-        sp["parent_id"] = JSONEncoderV2._encode_id_to_hex(sp.get("parent_id"))
-        sp["span_id"] = JSONEncoderV2._encode_id_to_hex(sp.get("span_id"))
-        return sp
-
     @staticmethod
     def _encode_id_to_hex(dd_id):
         if not dd_id:
@@ -0,0 +1,343 @@
+"""Compiled core of :class:`ddtrace.context.Context`.
+
+The methods of :class:`ContextBase` only manipulate lists and the attributes
+of the spans, which are compiled too, and never run Python code while the
+state of the context is inconsistent. They cannot be interrupted by another
+thread since they hold the GIL for their whole duration, so the context does
+not need a lock of its own.
+
+The finished spans are tracked in a list as they are closed so that deciding
+whether to flush the trace, partially or not, takes constant time.
+
+The memory retained by the finished spans can be bounded too. Their size is
+estimated when they are closed, and once the finished spans of a trace exceed
+the hard cap, the spans closed afterwards are summarized instead of retained:
+their count, errors and durations are aggregated per name and resource, and the
+summaries are flushed along with the trace as one span each.
+"""
+from cpython cimport PyDict_Next
+from cpython cimport PyObject
+
+from ..constants import ORIGIN_KEY
+from ..constants import SAMPLING_PRIORITY_KEY
+
+
+# The number of spans a summary span stands for
+SUMMARY_SPAN_COUNT_KEY = "_dd.summary.span_count"
+# The number of errors among them
+SUMMARY_ERROR_COUNT_KEY = "_dd.summary.error_count"
+# The duration of the longest of them, in nanoseconds
+SUMMARY_MAX_DURATION_KEY = "_dd.summary.max_duration"
+
+# Rough memory footprint of the objects retained for a span, its tags and its metrics
+DEF _SPAN_SIZE = 600
+DEF _TAG_SIZE = 130
+DEF _METRIC_SIZE = 110
+
+
+cdef Py_ssize_t _span_size(span) except -1:
+    """Return an estimate of the memory retained by a finished span."""
+    cdef Py_ssize_t size = _SPAN_SIZE
+    cdef Py_ssize_t pos = 0
+    cdef PyObject* key
+    cdef PyObject* value
+
+    meta = span.meta
+    if type(meta) is dict:
+        while PyDict_Next(meta, &pos, &key, &value):
+            size += _TAG_SIZE + _str_size(<object>key) + _str_size(<object>value)
+    metrics = span.metrics
+    if type(metrics) is dict:
+        pos = 0
+        while PyDict_Next(metrics, &pos, &key, &value):
+            size += _METRIC_SIZE + _str_size(<object>key)
+    return size
+
+
+cdef inline Py_ssize_t _str_size(obj):
+    if isinstance(obj, (bytes, unicode)):
+        return len(obj)
+    return 0
+
+
+cdef class _SpanSummary(object):
+    """The aggregate of the spans with the same name, service and resource summarized in a trace."""
+
+    cdef public object name
+    cdef public object service
+    cdef public object resource
+    cdef public object span_type
+    cdef public object start_ns
+    cdef public long long count
+    cdef public long long errors
+    cdef public long long duration_ns
+    cdef public long long max_duration_ns
+
+    def __init__(self, span):
+        self.name = span.name
+        self.service = span.service
+        self.resource = span.resource
+        self.span_type = span._span_type
+        self.start_ns = span.start_ns
+
+    cdef add(self, span):
+        cdef long long duration_ns = span.duration_ns or 0
+
+        self.count += 1
+        if span.error:
+            self.errors += 1
+        self.duration_ns += duration_ns
+        if duration_ns > self.max_duration_ns:
+            self.max_duration_ns = duration_ns
+        if span.start_ns is not None and (self.start_ns is None or span.start_ns < self.start_ns):
+            self.start_ns = span.start_ns
+
+    def to_span(self, root):
+        """Return a span, child of ``root``, standing for the summarized spans."""
+        from ..span import Span
+
+        span = Span(
+            None,
+            self.name,
+            service=self.service,
+            resource=self.resource,
+            span_type=self.span_type,
+            trace_id=root.trace_id,
+            parent_id=root.span_id,
+            _check_pid=False,
+        )
+        span.start_ns = self.start_ns
+        span.duration_ns = self.duration_ns
+        span.sampled = root.sampled
+        span.metrics[SUMMARY_SPAN_COUNT_KEY] = self.count
+        span.metrics[SUMMARY_ERROR_COUNT_KEY] = self.errors
+        span.metrics[SUMMARY_MAX_DURATION_KEY] = self.max_duration_ns
+        return span
+
+
+cdef class ContextBase(object):
+
+    cdef public list _trace
+    # The spans of `_trace` closed since the last flush, in the order they were closed
+    cdef public list _finished
+    cdef public object _current_span
+    cdef public object _parent_trace_id
+    cdef public object _parent_span_id
+    cdef public object _sampling_priority
+    # Whether the sampling decision waits for the resource and the tags of the root span
+    cdef public bint _sampling_deferred
+    # Whether the trace is dropped, instead of sent to the agent, if it is rejected
+    cdef public bint _drop_rejected
+    cdef public object dd_origin
+    # The decisions made by the tracer for the child spans of the trace
+    cdef public object _span_defaults
+    # The summaries of the spans closed after the finished spans exceeded the hard cap, by name, service and resource
+    cdef public dict _summaries
+    # The estimated size of the spans in `_finished`
+    cdef public Py_ssize_t _finished_bytes
+    cdef bint _flush_partial
+    cdef Py_ssize_t _flush_min_spans
+    cdef Py_ssize_t _flush_min_bytes
+    cdef Py_ssize_t _max_bytes
+    cdef object __weakref__
+
+    def __init__(self, trace_id=None, span_id=None, sampling_priority=None, dd_origin=None):
+        """
+        Initialize a new thread-safe ``Context``.
+
+        :param int trace_id: trace_id of parent span
+        :param int span_id: span_id of parent span
+        """
+        self._trace = []
+        self._finished = []
+        self._current_span = None
+
+        self._parent_trace_id = trace_id
+        self._parent_span_id = span_id
+        self._sampling_priority = sampling_priority
+        self._sampling_deferred = False
+        self._drop_rejected = False
+        self.dd_origin = dd_origin
+        self._span_defaults = None
+        self._summaries = {}
+        self._finished_bytes = 0
+
+        # DEV: Read once since they are class attributes of `ddtrace.context.Context`
+        self._flush_partial = self._partial_flush_enabled
+        self._flush_min_spans = self._partial_flush_min_spans
+        self._flush_min_bytes = self._partial_flush_min_bytes
+        self._max_bytes = self._trace_max_bytes
+
+    def clone(self):
+        """
+        Partially clones the current context.
+        It copies everything EXCEPT the registered and finished spans.
+        """
+        # The clone keeps the sampling decision of the trace, so it must be made now
+        self._sample_deferred()
+        # DEV: Take a consistent snapshot before calling the constructor, which may run Python code
+        trace_id = self._parent_trace_id
+        span_id = self._parent_span_id
+        sampling_priority = self._sampling_priority
+        current_span = self._current_span
+
+        new_ctx = type(self)(
+            trace_id=trace_id,
+            span_id=span_id,
+            sampling_priority=sampling_priority,
+        )
+        new_ctx._current_span = current_span
+        return new_ctx
+
+    def get_current_root_span(self):
+        """
+        Return the root span of the context or None if it does not exist.
+        """
+        return self._trace[0] if self._trace else None
+
+    def get_current_span(self):
+        """
+        Return the last active span that corresponds to the last inserted
+        item in the trace list. This cannot be considered as the current active
+        span in asynchronous environments, because some spans can be closed
+        earlier while child spans still need to finish their traced execution.
+        """
+        return self._current_span
+
+    cdef _set_current_span(self, span):
+        # Set current span internally.
+        self._current_span = span
+        if span is not None:
+            self._parent_trace_id = span.trace_id
+            self._parent_span_id = span.span_id
+        else:
+            self._parent_span_id = None
+
+    def add_span(self, span):
+        """
+        Add a span to the context trace list, keeping it as the last active span.
+        """
+        self._set_current_span(span)
+
+        self._trace.append(span)
+        span._context = self
+
+    def _sample_deferred(self):
+        """
+        Make the sampling decision of the trace if it was deferred, with the
+        resource and the tags of the root span known so far.
+        """
+        cdef list trace = self._trace
+        if self._sampling_deferred and trace:
+            self._sampling_deferred = False
+            root = trace[0]
+            root.tracer._sample(root, self)
+
+    def close_span(self, span):
+        """
+        Mark a span as a finished, and return the spans to flush with whether
+        they are sampled, or ``(None, None)`` if there is nothing to flush yet.
+        """
+        cdef list trace = self._trace
+        cdef list finished = self._finished
+        cdef bint partial = False
+        cdef bint drop_rejected
+        cdef Py_ssize_t size = 0
+        cdef _SpanSummary summary
+        cdef dict summaries = None
+
+        if self._sampling_deferred and trace and span is trace[0]:
+            # The resource and the tags of the root span are final
+            # DEV: Before updating the state, sampling runs Python code
+            self._sample_deferred()
+
+        if self._flush_min_bytes > 0 or self._max_bytes > 0:
+            size = _span_size(span)
+
+        if self._max_bytes > 0 and self._finished_bytes + size > self._max_bytes and trace and span is not trace[0]:
+            # Summarize the span instead of retaining it
+            key = (span.name, span.service, span.resource)
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = _SpanSummary(span)
+            summary.add(span)
+            # DEV: The spans are usually closed in the reverse order they were opened
+            if trace[-1] is span:
+                trace.pop()
+            else:
+                trace.remove(span)
+        else:
+            finished.append(span)
+            self._finished_bytes += size
+
+        # Safe-guard: prevent the last current span from being set to the parent
+        # of any span but the top-level span.
+        # The situation this avoids is when a parent closes before a child
+        # and the child is the last to close in the trace. When this happens
+        # the current_span would otherwise be set to the child's parent which
+        # has already closed. The context will be reset but the current_span
+        # will still point to that child's parent which would cause subsequent
+        # spans to be parented incorrectly.
+        if len(finished) != len(trace) or span is trace[0]:
+            self._set_current_span(span._parent)
+
+        if len(finished) == len(trace):
+            sampled = self._is_sampled()
+            sampling_priority = self._sampling_priority
+
+            # clean the current state
+            self._trace = []
+            self._finished = []
+            self._parent_trace_id = None
+            self._parent_span_id = None
+            self._sampling_priority = None
+            self._sampling_deferred = False
+            self._span_defaults = None
+            drop_rejected = self._drop_rejected
+            self._drop_rejected = False
+        elif self._flush_partial and (
+            len(finished) >= self._flush_min_spans
+            or (self._flush_min_bytes > 0 and self._finished_bytes >= self._flush_min_bytes)
+        ):
+            # partial flush when enabled and we have more than the minimal required spans
+            sampled = self._is_sampled()
+            sampling_priority = self._sampling_priority
+            drop_rejected = self._drop_rejected
+
+            # Any open spans will remain as `self._trace`
+            # Any finished spans will get returned to be flushed
+            self._trace = [t for t in trace if t.duration_ns is None]
+            self._finished = []
+            partial = True
+        else:
+            return None, None
+
+        # Drop the trace on the final sampling decision, which may have changed since the trace started
+        if drop_rejected and sampling_priority is not None and sampling_priority <= 0:
+            sampled = False
+
+        self._finished_bytes = 0
+        if self._summaries:
+            summaries = self._summaries
+            self._summaries = {}
+
+        # DEV: The context is consistent again, the following may run Python code
+        # attach the sampling priority to the context root span
+        if sampled and sampling_priority is not None and trace:
+            trace[0].set_metric(SAMPLING_PRIORITY_KEY, sampling_priority)
+        origin = self.dd_origin
+        # attach the origin to the root span tag
+        if sampled and origin is not None and trace:
+            trace[0].meta[ORIGIN_KEY] = str(origin)
+
+        # A partial flush returns the finished spans only
+        if partial:
+            trace, root = finished, trace[0]
+        elif trace:
+            root = trace[0]
+        if summaries is not None and trace:
+            trace.extend(summary.to_span(root) for summary in summaries.values())
+        return trace, sampled
+
+    cdef bint _is_sampled(self):
+        return any(span.sampled for span in self._trace)
@@ -1,8 +1,13 @@
 from cpython cimport *
 from cpython.bytearray cimport PyByteArray_Check
+from json import dumps as json_dumps
+from json.encoder import encode_basestring_ascii
 import struct
+import threading
 
 from ..span import Span
+from .buffer import BufferFull
+from .buffer import BufferItemTooLarge
 
 
 cdef extern from "Python.h":
@@ -24,6 +29,7 @@ cdef extern from "pack.h":
     int msgpack_pack_map(msgpack_packer* pk, size_t l)
     int msgpack_pack_raw(msgpack_packer* pk, size_t l)
     int msgpack_pack_raw_body(msgpack_packer* pk, char* body, size_t l)
+    int msgpack_pack_bin(msgpack_packer* pk, size_t l)
     int msgpack_pack_unicode(msgpack_packer* pk, object o, long long limit)
 
 cdef extern from "buff_converter.h":
@@ -32,6 +38,16 @@ cdef extern from "buff_converter.h":
 
 cdef long long ITEM_LIMIT = (2**32)-1
 
+# Maximum size of a msgpack array header (0xdd followed by a 32-bit length)
+DEF ARRAY_HEADER_SIZE = 5
+
+# Initial size of the packer buffers, large enough for most traces. Buffers grow geometrically from there.
+DEF INITIAL_BUFFER_SIZE = 64 * 1024
+
+# Packer buffers that grew larger than this while encoding a large trace are shrunk back to their initial size once
+# the trace is encoded, so that a single outlier does not pin memory.
+DEF MAX_RETAINED_BUFFER_SIZE = 1024 * 1024
+
 
 cdef inline int PyBytesLike_Check(object o):
     return PyBytes_Check(o) or PyByteArray_Check(o)
@@ -61,6 +77,8 @@ cdef class Packer(object):
     :param callable default:
         Convert user type to builtin type that Packer supports.
         See also simplejson's document.
+
+    ``bytes`` are packed as raw strings, like the strings of the traces on Python 2, ``bytearray`` as binary data.
     """
     cdef msgpack_packer pk
     cdef object _default
@@ -68,14 +86,43 @@ cdef class Packer(object):
     cdef const char *encoding
     cdef const char *unicode_errors
 
-    def __cinit__(self):
-        cdef int buf_size = 1024*1024
+    def __cinit__(self, *args, **kwargs):
+        cdef size_t buf_size = INITIAL_BUFFER_SIZE
         self.pk.buf = <char*> PyMem_Malloc(buf_size)
         if self.pk.buf == NULL:
             raise MemoryError("Unable to allocate internal buffer.")
         self.pk.buf_size = buf_size
         self.pk.length = 0
 
+    cdef int _shrink(self) except -1:
+        """Shrink the internal buffer back to its initial size if it grew too large.
+
+        The buffer must not hold more data than its initial size.
+        """
+        cdef char *buf
+        if self.pk.buf_size > MAX_RETAINED_BUFFER_SIZE:
+            buf = <char*> PyMem_Realloc(self.pk.buf, INITIAL_BUFFER_SIZE)
+            if buf == NULL:
+                raise MemoryError("Unable to shrink internal buffer.")
+            self.pk.buf = buf
+            self.pk.buf_size = INITIAL_BUFFER_SIZE
+        return 0
+
+    cdef char *_detach(self, size_t buf_size) except NULL:
+        """Detach the internal buffer and replace it with a new one of ``buf_size`` bytes.
+
+        The caller becomes responsible for freeing the returned buffer.
+        """
+        cdef char *new_buf = <char*> PyMem_Malloc(buf_size)
+        cdef char *buf
+        if new_buf == NULL:
+            raise MemoryError("Unable to allocate internal buffer.")
+        buf = self.pk.buf
+        self.pk.buf = new_buf
+        self.pk.buf_size = buf_size
+        self.pk.length = 0
+        return buf
+
     def __init__(self, default=None):
         if default is not None:
             if not PyCallable_Check(default):
@@ -131,6 +178,14 @@ cdef class Packer(object):
             elif PyFloat_Check(o):
                 dval = o
                 ret = msgpack_pack_double(&self.pk, dval)
+            elif PyByteArray_Check(o):
+                L = len(o)
+                if L > ITEM_LIMIT:
+                    PyErr_Format(ValueError, b"%.200s object is too large", Py_TYPE(o).tp_name)
+                rawval = o
+                ret = msgpack_pack_bin(&self.pk, L)
+                if ret == 0:
+                    ret = msgpack_pack_raw_body(&self.pk, rawval, L)
             elif PyBytesLike_Check(o):
                 L = len(o)
                 if L > ITEM_LIMIT:
@@ -269,6 +324,7 @@ cdef class Packer(object):
             ret = self._pack(obj)
         except:
             self.pk.length = 0
+            self._shrink()
             raise
         if ret:  # should not happen.
             raise RuntimeError("internal error")
@@ -276,6 +332,7 @@ cdef class Packer(object):
         # Reset the buffer.
         buf = PyBytes_FromStringAndSize(self.pk.buf, self.pk.length)
         self.pk.length = 0
+        self._shrink()
         return buf
 
     def bytes(self):
@@ -290,6 +347,20 @@ cdef class Packer(object):
 cdef class MsgpackEncoder(object):
     content_type = "application/msgpack"
 
+    # Packers are reused across calls, one per thread, rather than allocating a new buffer for every trace.
+    cdef object _local
+
+    def __cinit__(self):
+        self._local = threading.local()
+
+    cdef Packer _packer(self):
+        cdef Packer packer
+        try:
+            return self._local.packer
+        except AttributeError:
+            packer = self._local.packer = Packer()
+            return packer
+
     cpdef _decode(self, data):
         import msgpack
         if msgpack.version[:2] < (0, 6):
@@ -297,10 +368,10 @@ cdef class MsgpackEncoder(object):
         return msgpack.unpackb(data, raw=True)
 
     cpdef encode_trace(self, list trace):
-        return Packer().pack(trace)
+        return self._packer().pack(trace)
 
     cpdef encode_traces(self, traces):
-        return Packer().pack(traces)
+        return self._packer().pack(traces)
 
     cpdef join_encoded(self, objs):
         """Join a list of encoded objects together as a msgpack array"""
@@ -314,3 +385,795 @@ cdef class MsgpackEncoder(object):
             return struct.pack(">BH", 0xdc, count) + buf
         else:
             return struct.pack(">BI", 0xdd, count) + buf
+
+
+cdef class EncodedPayload(object):
+    """Payload of encoded traces returned by :meth:`BufferedEncoder.encode`.
+
+    The payload owns the memory the traces were packed into and exposes it through the buffer protocol, so that it can
+    be written to a socket without being copied.
+    """
+    cdef char *buf
+    cdef Py_ssize_t offset
+    cdef Py_ssize_t length
+    cdef readonly size_t count
+
+    def __dealloc__(self):
+        PyMem_Free(self.buf)
+        self.buf = NULL
+
+    def __len__(self):
+        return self.length
+
+    def __getbuffer__(self, Py_buffer *buffer, int flags):
+        PyBuffer_FillInfo(buffer, self, <void*>(self.buf + self.offset), self.length, 1, flags)
+
+    def __releasebuffer__(self, Py_buffer *buffer):
+        pass
+
+    def getvalue(self):
+        """Return a copy of the payload as bytes."""
+        return PyBytes_FromStringAndSize(self.buf + self.offset, self.length)
+
+
+cdef class _SizeBudget(object):
+    """Byte budget shared by the encoders buffering the traces of a payload.
+
+    Reservations only involve C code, so they are atomic under the GIL and do not need a lock.
+    """
+
+    cdef size_t max_size
+    cdef size_t used
+
+    cdef inline bint reserve(self, size_t size):
+        if self.used + size > self.max_size:
+            return False
+        self.used += size
+        return True
+
+    cdef inline void release(self, size_t size):
+        self.used -= size
+
+
+cdef _SizeBudget _new_budget(size_t max_size):
+    cdef _SizeBudget budget = _SizeBudget.__new__(_SizeBudget)
+    budget.max_size = max_size
+    budget.used = 0
+    return budget
+
+
+cdef class BufferedEncoder(object):
+    """Thread-safe msgpack encoder that buffers traces into a single payload.
+
+    Traces are packed in place into one growable buffer as they are put in the encoder. :meth:`encode` then hands the
+    buffer over to the returned payload, prefixed with the msgpack array header, without copying it.
+
+    :param max_size: The maximum size (in bytes) of the encoded traces in the buffer.
+    :param max_item_size: The maximum size of any encoded trace. It is necessary to have an item limit as traces
+        cannot be divided across trace payloads.
+    """
+    content_type = "application/msgpack"
+
+    cdef readonly size_t max_size
+    cdef readonly size_t max_item_size
+    cdef size_t _count
+    cdef size_t _offset
+    cdef size_t _reserved
+    cdef _SizeBudget _budget
+    cdef Packer _packer
+    cdef object _lock
+
+    def __cinit__(self, size_t max_size, size_t max_item_size):
+        self.max_size = max_size
+        self.max_item_size = max_item_size
+        self._count = 0
+        self._reserved = 0
+        self._budget = _new_budget(max_size)
+        self._lock = threading.Lock()
+        self._packer = Packer()
+        # Reserve room for the array header, which is only known when the payload is encoded.
+        self._packer.pk.length = ARRAY_HEADER_SIZE
+
+    def __len__(self):
+        """Return the number of traces in the buffer."""
+        return self._count
+
+    @property
+    def size(self):
+        """Return the size in bytes of the encoded traces in the buffer."""
+        return self._reserved
+
+    cdef size_t _size(self):
+        return self._packer.pk.length - ARRAY_HEADER_SIZE
+
+    cdef int _pack_trace(self, list trace) except -1:
+        return self._packer._pack(trace)
+
+    cdef void _checkpoint(self):
+        """Save the state of the buffer before packing a trace."""
+        self._offset = self._packer.pk.length
+
+    cdef void _rollback(self):
+        """Restore the state of the buffer saved by the last checkpoint."""
+        self._packer.pk.length = self._offset
+
+    cdef void _release(self):
+        """Clear the trace count and give the space used by the traces back to the budget."""
+        self._budget.release(self._reserved)
+        self._reserved = 0
+        self._count = 0
+
+    cpdef put(self, list trace):
+        """Encode a trace (i.e. a list of spans) and add it to the buffer.
+
+        :raises BufferItemTooLarge: if the encoded trace is larger than ``max_item_size`` or ``max_size``.
+        :raises BufferFull: if the encoded trace does not fit in the buffer.
+        """
+        cdef size_t size
+        cdef size_t item_len
+
+        with self._lock:
+            size = self._size()
+            self._checkpoint()
+            try:
+                self._pack_trace(trace)
+            except Exception:
+                self._rollback()
+                raise
+
+            item_len = self._size() - size
+            if item_len > self.max_item_size or item_len > self.max_size:
+                self._rollback()
+                raise BufferItemTooLarge(item_len)
+
+            if not self._budget.reserve(item_len):
+                self._rollback()
+                raise BufferFull(item_len)
+
+            self._reserved += item_len
+            self._count += 1
+
+    cpdef encode(self):
+        """Return the payload of all the traces in the buffer, or ``None`` if the buffer is empty.
+
+        The buffer is cleared in the process.
+        """
+        cdef EncodedPayload payload
+        cdef char *buf
+        cdef size_t length
+        cdef size_t count
+        cdef Py_ssize_t offset
+
+        with self._lock:
+            count = self._count
+            if count == 0:
+                return None
+
+            length = self._packer.pk.length
+            # Size the next buffer after this payload: traffic is usually steady between two flushes, and a burst
+            # only pins memory until the next flush.
+            buf = self._packer._detach(min(max(length, INITIAL_BUFFER_SIZE), self.max_size + ARRAY_HEADER_SIZE))
+            self._packer.pk.length = ARRAY_HEADER_SIZE
+            self._release()
+
+        # Write the array header right before the first trace.
+        if count <= 0xf:
+            offset = ARRAY_HEADER_SIZE - 1
+            buf[offset] = <char>(0x90 + count)
+        elif count <= 0xffff:
+            offset = ARRAY_HEADER_SIZE - 3
+            buf[offset] = <char>0xdc
+            buf[offset + 1] = <char>(count >> 8)
+            buf[offset + 2] = <char>count
+        else:
+            offset = 0
+            buf[0] = <char>0xdd
+            buf[1] = <char>(count >> 24)
+            buf[2] = <char>(count >> 16)
+            buf[3] = <char>(count >> 8)
+            buf[4] = <char>count
+
+        payload = EncodedPayload.__new__(EncodedPayload)
+        payload.buf = buf
+        payload.offset = offset
+        payload.length = length - offset
+        payload.count = count
+        return payload
+
+
+cdef class BufferedEncoderV05(BufferedEncoder):
+    """Buffered encoder for the v0.5 trace API.
+
+    The v0.5 payload is a two-item array: a table of all the strings used in the payload, and the traces. Spans are
+    encoded as arrays of fixed length and reference their strings by their index in the table, so that the strings
+    repeated across spans (services, names, resources, tag names...) are only encoded once per payload.
+
+    Since the size of the string table is only known when the payload is encoded, the traces are copied once after the
+    string table into the payload.
+    """
+
+    cdef dict _string_table
+    cdef list _strings
+    cdef Packer _table_packer
+    cdef size_t _n_strings
+    cdef size_t _table_offset
+
+    def __cinit__(self, size_t max_size, size_t max_item_size):
+        self._table_packer = Packer()
+        self._reset_table()
+
+    cdef int _reset_table(self) except -1:
+        self._string_table = {}
+        self._strings = []
+        self._table_packer.pk.length = 0
+        # The empty string is always the first entry of the table.
+        self._intern("")
+        return 0
+
+    cdef size_t _size(self):
+        return self._packer.pk.length - ARRAY_HEADER_SIZE + self._table_packer.pk.length
+
+    cdef void _checkpoint(self):
+        BufferedEncoder._checkpoint(self)
+        self._n_strings = len(self._strings)
+        self._table_offset = self._table_packer.pk.length
+
+    cdef void _rollback(self):
+        BufferedEncoder._rollback(self)
+        for s in self._strings[self._n_strings:]:
+            del self._string_table[s]
+        del self._strings[self._n_strings:]
+        self._table_packer.pk.length = self._table_offset
+
+    cdef size_t _intern(self, object s) except? -1:
+        cdef size_t index
+        cdef PyObject *found
+
+        if s is None:
+            return 0
+
+        found = PyDict_GetItem(self._string_table, s)
+        if found != NULL:
+            return <object>found
+
+        if not PyUnicode_Check(s) and not PyBytesLike_Check(s):
+            # The string table must only contain strings.
+            return self._intern(str(s))
+
+        index = len(self._strings)
+        self._table_packer._pack(s)
+        self._string_table[s] = index
+        self._strings.append(s)
+        return index
+
+    cdef inline int _pack_string(self, object s) except -1:
+        return msgpack_pack_unsigned_long_long(&self._packer.pk, self._intern(s))
+
+    cdef int _pack_trace(self, list trace) except -1:
+        cdef msgpack_packer *pk = &self._packer.pk
+        cdef int ret
+        cdef Py_ssize_t L = len(trace)
+
+        if L > ITEM_LIMIT:
+            raise ValueError("list is too large")
+
+        ret = msgpack_pack_array(pk, L)
+        if ret != 0: return ret
+
+        for span in trace:
+            ret = self._pack_span(span)
+            if ret != 0: return ret
+        return 0
+
+    cdef int _pack_span(self, object span) except -1:
+        cdef msgpack_packer *pk = &self._packer.pk
+        cdef int ret
+        cdef dict d
+
+        if not isinstance(span, Span):
+            PyErr_Format(TypeError, b"can not serialize '%.200s' object", Py_TYPE(span).tp_name)
+
+        ret = msgpack_pack_array(pk, 12)
+        if ret != 0: return ret
+
+        ret = self._pack_string(span.service)
+        if ret != 0: return ret
+        ret = self._pack_string(span.name)
+        if ret != 0: return ret
+        ret = self._pack_string(span.resource)
+        if ret != 0: return ret
+
+        ret = self._packer._pack(span.trace_id or 0)
+        if ret != 0: return ret
+        ret = self._packer._pack(span.span_id or 0)
+        if ret != 0: return ret
+        ret = self._packer._pack(span.parent_id or 0)
+        if ret != 0: return ret
+        ret = self._packer._pack(span.start_ns or 0)
+        if ret != 0: return ret
+        ret = self._packer._pack(span.duration_ns or 0)
+        if ret != 0: return ret
+        ret = msgpack_pack_int(pk, 1 if span.error else 0)
+        if ret != 0: return ret
+
+        d = span.meta
+        ret = msgpack_pack_map(pk, len(d))
+        if ret != 0: return ret
+        for k, v in d.items():
+            ret = self._pack_string(k)
+            if ret != 0: return ret
+            ret = self._pack_string(v)
+            if ret != 0: return ret
+
+        d = span.metrics
+        ret = msgpack_pack_map(pk, len(d))
+        if ret != 0: return ret
+        for k, v in d.items():
+            ret = self._pack_string(k)
+            if ret != 0: return ret
+            ret = self._packer._pack(v)
+            if ret != 0: return ret
+
+        return self._pack_string(span.span_type)
+
+    cpdef encode(self):
+        """Return the payload of all the traces in the buffer, or ``None`` if the buffer is empty.
+
+        The buffer is cleared in the process.
+        """
+        cdef EncodedPayload payload
+        cdef msgpack_packer pk
+        cdef size_t count
+        cdef size_t traces_length
+        cdef size_t table_length
+
+        with self._lock:
+            count = self._count
+            if count == 0:
+                return None
+
+            table_length = self._table_packer.pk.length
+            traces_length = self._packer.pk.length - ARRAY_HEADER_SIZE
+
+            pk.buf_size = 1 + ARRAY_HEADER_SIZE + table_length + ARRAY_HEADER_SIZE + traces_length
+            pk.buf = <char*> PyMem_Malloc(pk.buf_size)
+            if pk.buf == NULL:
+                raise MemoryError("Unable to allocate payload buffer.")
+            pk.length = 0
+
+            if (
+                msgpack_pack_array(&pk, 2) != 0
+                or msgpack_pack_array(&pk, len(self._strings)) != 0
+                or msgpack_pack_raw_body(&pk, self._table_packer.pk.buf, table_length) != 0
+                or msgpack_pack_array(&pk, count) != 0
+                or msgpack_pack_raw_body(&pk, self._packer.pk.buf + ARRAY_HEADER_SIZE, traces_length) != 0
+            ):
+                PyMem_Free(pk.buf)
+                raise RuntimeError("internal error")
+
+            self._packer.pk.length = ARRAY_HEADER_SIZE
+            self._packer._shrink()
+            self._table_packer._shrink()
+            self._reset_table()
+            self._release()
+
+        payload = EncodedPayload.__new__(EncodedPayload)
+        payload.buf = pk.buf
+        payload.offset = 0
+        payload.length = pk.length
+        payload.count = count
+        return payload
+
+
+cdef class ShardedEncoder(object):
+    """Buffered msgpack encoder split in shards to reduce the contention between threads writing traces.
+
+    Each thread is assigned one of the :class:`BufferedEncoder` shards the first time it puts a trace, and then packs
+    its traces into that shard only. Threads contend on the lock of a shard only when they share it or when the
+    payload is encoded. The shards share a single byte budget, so that the limits are the same as with a single
+    :class:`BufferedEncoder`.
+
+    :meth:`encode` drains all the shards and merges their traces into a single payload.
+
+    :param max_size: The maximum size (in bytes) of the encoded traces in all the shards.
+    :param max_item_size: The maximum size of any encoded trace.
+    :param shards: The number of shards.
+    """
+    content_type = BufferedEncoder.content_type
+
+    cdef readonly size_t max_size
+    cdef readonly size_t max_item_size
+    cdef tuple _shards
+    cdef size_t _next_shard
+    cdef object _local
+    cdef _SizeBudget _budget
+
+    def __cinit__(self, size_t max_size, size_t max_item_size, size_t shards=8):
+        cdef BufferedEncoder shard
+
+        if shards == 0:
+            raise ValueError("shards must be greater than 0")
+
+        self.max_size = max_size
+        self.max_item_size = max_item_size
+        self._budget = _new_budget(max_size)
+        self._shards = tuple(BufferedEncoder(max_size, max_item_size) for _ in range(shards))
+        for shard in self._shards:
+            shard._budget = self._budget
+        self._next_shard = 0
+        self._local = threading.local()
+
+    def __len__(self):
+        """Return the number of traces in the buffer."""
+        cdef BufferedEncoder shard
+        cdef size_t count = 0
+        for shard in self._shards:
+            count += shard._count
+        return count
+
+    @property
+    def size(self):
+        """Return the size in bytes of the encoded traces in the buffer."""
+        return self._budget.used
+
+    cdef BufferedEncoder _shard(self):
+        """Return the shard of the current thread."""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = self._shards[self._next_shard % len(self._shards)]
+            self._next_shard += 1
+            return shard
+
+    cpdef put(self, list trace):
+        """Encode a trace (i.e. a list of spans) and add it to the buffer.
+
+        :raises BufferItemTooLarge: if the encoded trace is larger than ``max_item_size`` or ``max_size``.
+        :raises BufferFull: if the encoded trace does not fit in the buffer.
+        """
+        self._shard().put(trace)
+
+    cpdef encode(self):
+        """Return the payload of all the traces in the buffer, or ``None`` if the buffer is empty.
+
+        The buffer is cleared in the process.
+        """
+        cdef EncodedPayload payload
+        cdef EncodedPayload merged
+        cdef list payloads = []
+        cdef size_t count = 0
+        cdef size_t length = 0
+        cdef size_t traces_length
+        cdef msgpack_packer pk
+
+        for shard in self._shards:
+            payload = shard.encode()
+            if payload is not None:
+                payloads.append(payload)
+                count += payload.count
+                length += payload.offset + payload.length - ARRAY_HEADER_SIZE
+
+        if not payloads:
+            return None
+
+        if len(payloads) == 1:
+            # The common case when there is only one thread writing traces does not need any copy.
+            return payloads[0]
+
+        pk.buf_size = ARRAY_HEADER_SIZE + length
+        pk.buf = <char*> PyMem_Malloc(pk.buf_size)
+        if pk.buf == NULL:
+            raise MemoryError("Unable to allocate payload buffer.")
+        pk.length = 0
+
+        if msgpack_pack_array(&pk, count) != 0:
+            PyMem_Free(pk.buf)
+            raise RuntimeError("internal error")
+
+        for payload in payloads:
+            traces_length = payload.offset + payload.length - ARRAY_HEADER_SIZE
+            if msgpack_pack_raw_body(&pk, payload.buf + ARRAY_HEADER_SIZE, traces_length) != 0:
+                PyMem_Free(pk.buf)
+                raise RuntimeError("internal error")
+
+        merged = EncodedPayload.__new__(EncodedPayload)
+        merged.buf = pk.buf
+        merged.offset = 0
+        merged.length = pk.length
+        merged.count = count
+        return merged
+
+
+
+cdef extern from *:
+    """
+    #if PY_MAJOR_VERSION >= 3
+    #define dd_unicode_utf8(o, l) PyUnicode_AsUTF8AndSize(o, l)
+    #else
+    #define dd_unicode_utf8(o, l) (PyErr_SetString(PyExc_TypeError, "unsupported"), (const char *)NULL)
+    #endif
+    """
+    const char *dd_unicode_utf8(object o, Py_ssize_t *l) except NULL
+
+cdef extern from "stdio.h":
+    int snprintf(char *buf, size_t size, const char *fmt, ...)
+
+cdef const char *HEX_DIGITS = "0123456789abcdef"
+
+
+cdef inline int _json_write(msgpack_packer *pk, const char *s, size_t l) except -1:
+    if msgpack_pack_raw_body(pk, <char *>s, l) != 0:
+        raise MemoryError("Unable to grow internal buffer.")
+    return 0
+
+
+cdef int _json_write_ascii(msgpack_packer *pk, object s) except -1:
+    """Write the ASCII ``str`` returned by a Python JSON encoder."""
+    cdef const char *buf
+    cdef Py_ssize_t l
+    if PyBytes_Check(s):
+        return _json_write(pk, PyBytes_AS_STRING(s), PyBytes_GET_SIZE(s))
+    buf = dd_unicode_utf8(s, &l)
+    return _json_write(pk, buf, l)
+
+
+cdef int _json_write_escape(msgpack_packer *pk, unsigned int cp) except -1:
+    cdef char buf[6]
+    buf[0] = b"\\"
+    buf[1] = b"u"
+    buf[2] = HEX_DIGITS[(cp >> 12) & 0xF]
+    buf[3] = HEX_DIGITS[(cp >> 8) & 0xF]
+    buf[4] = HEX_DIGITS[(cp >> 4) & 0xF]
+    buf[5] = HEX_DIGITS[cp & 0xF]
+    return _json_write(pk, buf, 6)
+
+
+cdef int _json_write_string(msgpack_packer *pk, object s) except -1:
+    """Write a JSON string, escaped like ``json.dumps`` does with ``ensure_ascii``."""
+    cdef const char *buf
+    cdef Py_ssize_t l
+    cdef Py_ssize_t i = 0
+    cdef Py_ssize_t start = 0
+    cdef unsigned char c
+    cdef unsigned int cp
+
+    if s is None:
+        return _json_write(pk, "null", 4)
+    if PY_MAJOR_VERSION < 3 or not PyUnicode_CheckExact(s):
+        if PyUnicode_CheckExact(s) or PyBytes_CheckExact(s):
+            return _json_write_ascii(pk, encode_basestring_ascii(s))
+        return _json_write_ascii(pk, json_dumps(s))
+
+    try:
+        buf = dd_unicode_utf8(s, &l)
+    except UnicodeEncodeError:
+        # Lone surrogates cannot be encoded in UTF-8
+        return _json_write_ascii(pk, encode_basestring_ascii(s))
+
+    _json_write(pk, "\"", 1)
+    while i < l:
+        c = <unsigned char>buf[i]
+        if 0x20 <= c < 0x7F and c != b'"' and c != b"\\":
+            i += 1
+            continue
+
+        _json_write(pk, buf + start, i - start)
+        if c == b'"':
+            _json_write(pk, "\\\"", 2)
+        elif c == b"\\":
+            _json_write(pk, "\\\\", 2)
+        elif c == b"\n":
+            _json_write(pk, "\\n", 2)
+        elif c == b"\r":
+            _json_write(pk, "\\r", 2)
+        elif c == b"\t":
+            _json_write(pk, "\\t", 2)
+        elif c == b"\b":
+            _json_write(pk, "\\b", 2)
+        elif c == b"\f":
+            _json_write(pk, "\\f", 2)
+        elif c < 0x80:
+            _json_write_escape(pk, c)
+        else:
+            # Decode the UTF-8 sequence, which Python guarantees to be valid
+            if c < 0xE0:
+                cp = ((c & 0x1F) << 6) | (buf[i + 1] & 0x3F)
+                i += 1
+            elif c < 0xF0:
+                cp = ((c & 0x0F) << 12) | ((buf[i + 1] & 0x3F) << 6) | (buf[i + 2] & 0x3F)
+                i += 2
+            else:
+                cp = (
+                    ((c & 0x07) << 18) | ((buf[i + 1] & 0x3F) << 12) | ((buf[i + 2] & 0x3F) << 6) | (buf[i + 3] & 0x3F)
+                )
+                i += 3
+            if cp >= 0x10000:
+                # Encode as a surrogate pair
+                cp -= 0x10000
+                _json_write_escape(pk, 0xD800 | (cp >> 10))
+                _json_write_escape(pk, 0xDC00 | (cp & 0x3FF))
+            else:
+                _json_write_escape(pk, cp)
+        i += 1
+        start = i
+    _json_write(pk, buf + start, l - start)
+    return _json_write(pk, "\"", 1)
+
+
+cdef int _json_write_number(msgpack_packer *pk, object n) except -1:
+    cdef char buf[32]
+    cdef int l
+    cdef double f
+
+    if n is None:
+        return _json_write(pk, "null", 4)
+    if PyInt_CheckExact(n) or PyLong_CheckExact(n):
+        try:
+            if n >= 0:
+                l = snprintf(buf, sizeof(buf), "%llu", PyLong_AsUnsignedLongLong(n))
+            else:
+                l = snprintf(buf, sizeof(buf), "%lld", PyLong_AsLongLong(n))
+        except OverflowError:
+            return _json_write_ascii(pk, PyObject_Repr(n))
+        return _json_write(pk, buf, l)
+    if PyFloat_CheckExact(n):
+        # Same representation of the special values as json.dumps
+        f = n
+        if f != f:
+            return _json_write(pk, "NaN", 3)
+        if f == float("inf"):
+            return _json_write(pk, "Infinity", 8)
+        if f == float("-inf"):
+            return _json_write(pk, "-Infinity", 9)
+        return _json_write_ascii(pk, PyObject_Repr(n))
+    return _json_write_ascii(pk, json_dumps(n))
+
+
+cdef int _json_write_id(msgpack_packer *pk, object dd_id, bint hex_ids) except -1:
+    cdef char buf[32]
+    cdef int l
+    if not hex_ids:
+        return _json_write_number(pk, dd_id)
+    if not dd_id:
+        return _json_write(pk, '"0000000000000000"', 18)
+    try:
+        l = snprintf(buf, sizeof(buf), '"%016llX"', PyLong_AsUnsignedLongLong(int(dd_id)))
+    except OverflowError:
+        return _json_write_ascii(pk, '"%0.16X"' % int(dd_id))
+    return _json_write(pk, buf, l)
+
+
+cdef int _json_write_dict(msgpack_packer *pk, dict d, bint str_values) except -1:
+    cdef size_t length = pk.length
+    cdef bint first = True
+
+    _json_write(pk, "{", 1)
+    for k, v in d.items():
+        if not PyUnicode_CheckExact(k) or PY_MAJOR_VERSION < 3:
+            # Leave the conversion of the other types of keys, or the error, to json.dumps
+            pk.length = length
+            return _json_write_ascii(pk, json_dumps(d))
+        if not first:
+            _json_write(pk, ", ", 2)
+        first = False
+        _json_write_string(pk, k)
+        _json_write(pk, ": ", 2)
+        if str_values:
+            _json_write_string(pk, v)
+        else:
+            _json_write_number(pk, v)
+    return _json_write(pk, "}", 1)
+
+
+cdef int _json_write_span(msgpack_packer *pk, object span, bint hex_ids) except -1:
+    _json_write(pk, '{"trace_id": ', 13)
+    _json_write_id(pk, span.trace_id, hex_ids)
+    _json_write(pk, ', "parent_id": ', 15)
+    _json_write_id(pk, span.parent_id, hex_ids)
+    _json_write(pk, ', "span_id": ', 13)
+    _json_write_id(pk, span.span_id, hex_ids)
+    _json_write(pk, ', "service": ', 13)
+    _json_write_string(pk, span.service)
+    _json_write(pk, ', "resource": ', 14)
+    _json_write_string(pk, span.resource)
+    _json_write(pk, ', "name": ', 10)
+    _json_write_string(pk, span.name)
+    _json_write(pk, ', "error": ', 11)
+    error = span.error
+    # A common mistake is to set the error field to a boolean instead of an int
+    _json_write_number(pk, 1 if error and type(error) is bool else error)
+
+    value = span.start_ns
+    if value:
+        _json_write(pk, ', "start": ', 11)
+        _json_write_number(pk, value)
+    value = span.duration_ns
+    if value:
+        _json_write(pk, ', "duration": ', 14)
+        _json_write_number(pk, value)
+    value = span.meta
+    if value:
+        _json_write(pk, ', "meta": ', 10)
+        _json_write_dict(pk, value, True)
+    value = span.metrics
+    if value:
+        _json_write(pk, ', "metrics": ', 13)
+        _json_write_dict(pk, value, False)
+    value = span.span_type
+    if value:
+        _json_write(pk, ', "type": ', 10)
+        _json_write_string(pk, value)
+    return _json_write(pk, "}", 1)
+
+
+cdef int _json_write_trace(msgpack_packer *pk, object trace, bint hex_ids) except -1:
+    cdef bint first = True
+    _json_write(pk, "[", 1)
+    for span in trace:
+        if not first:
+            _json_write(pk, ", ", 2)
+        first = False
+        _json_write_span(pk, span, hex_ids)
+    return _json_write(pk, "]", 1)
+
+
+cdef class SpanJSONEncoder(object):
+    """JSON encoder of traces.
+
+    Spans are written from their attributes into a buffer, without building their :meth:`ddtrace.span.Span.to_dict`
+    representation first. The result is the same as the ``json.dumps`` of that representation.
+
+    :param hex_ids: Whether to encode the trace, span and parent ids as hexadecimal strings.
+    """
+
+    cdef readonly bint hex_ids
+    # Packers are only used for their buffer, one per thread.
+    cdef object _local
+
+    def __cinit__(self, bint hex_ids=False):
+        self.hex_ids = hex_ids
+        self._local = threading.local()
+
+    cdef Packer _packer(self):
+        cdef Packer packer
+        try:
+            return self._local.packer
+        except AttributeError:
+            packer = self._local.packer = Packer()
+            return packer
+
+    cdef object _getvalue(self, Packer packer):
+        try:
+            if PY_MAJOR_VERSION < 3:
+                return PyBytes_FromStringAndSize(packer.pk.buf, packer.pk.length)
+            return PyUnicode_DecodeASCII(packer.pk.buf, packer.pk.length, NULL)
+        finally:
+            packer.pk.length = 0
+            packer._shrink()
+
+    cpdef encode_trace(self, object trace):
+        """Encode a trace (i.e. a list of spans) as a JSON array of spans."""
+        cdef Packer packer = self._packer()
+        try:
+            _json_write_trace(&packer.pk, trace, self.hex_ids)
+        except Exception:
+            packer.pk.length = 0
+            raise
+        return self._getvalue(packer)
+
+    cpdef encode_traces(self, object traces):
+        """Encode a list of traces as a JSON array of traces."""
+        cdef Packer packer = self._packer()
+        cdef bint first = True
+        try:
+            _json_write(&packer.pk, "[", 1)
+            for trace in traces:
+                if not first:
+                    _json_write(&packer.pk, ", ", 2)
+                first = False
+                _json_write_trace(&packer.pk, trace, self.hex_ids)
+            _json_write(&packer.pk, "]", 1)
+        except Exception:
+            packer.pk.length = 0
+            raise
+        return self._getvalue(packer)
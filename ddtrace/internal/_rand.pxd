@@ -0,0 +1,3 @@
+cpdef _getstate()
+cpdef seed()
+cpdef rand64bits(check_pid=*)
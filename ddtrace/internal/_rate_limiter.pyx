@@ -0,0 +1,133 @@
+"""Compiled core of :class:`ddtrace.internal.rate_limiter.RateLimiter`.
+
+``is_allowed`` used to take a lock, read the clock twice and call a few Python
+methods on every sampled trace. The decision now reads the clock once and then
+only updates C attributes of the limiter: it cannot be interrupted by another
+thread since it holds the GIL for its whole duration, so the limiter does not
+need a lock and concurrent threads never wait on each other.
+
+The effective rate is not computed for each decision either, only the number of
+requests allowed and seen in the current window are counted, and the rate of
+the previous window is recorded when a new window starts.
+"""
+from .. import compat
+
+
+cdef class RateLimiterBase(object):
+
+    cdef readonly object rate_limit
+    cdef public double tokens
+    cdef public double max_tokens
+    cdef public double last_update
+    cdef public double current_window
+    cdef public long long tokens_allowed
+    cdef public long long tokens_total
+    cdef double _rate_limit
+    cdef double _prev_window_rate
+    cdef bint _has_prev_window
+
+    def __init__(self, rate_limit):
+        """
+        Constructor for RateLimiter
+
+        :param rate_limit: The rate limit to apply for number of requests per second.
+            rate limit > 0 max number of requests to allow per second,
+            rate limit == 0 to disallow all requests,
+            rate limit < 0 to allow all requests
+        :type rate_limit: :obj:`int`
+        """
+        self.rate_limit = rate_limit
+        self._rate_limit = rate_limit
+        self.tokens = rate_limit
+        self.max_tokens = rate_limit
+
+        self.last_update = compat.monotonic()
+
+        self.current_window = 0
+        self.tokens_allowed = 0
+        self.tokens_total = 0
+        self._has_prev_window = False
+
+    def is_allowed(self):
+        """
+        Check whether the current request is allowed or not
+
+        This method will also reduce the number of available tokens by 1
+
+        :returns: Whether the current request is allowed or not
+        :rtype: :obj:`bool`
+        """
+        cdef double now = compat.monotonic()
+        cdef double elapsed
+        cdef bint allowed
+
+        # DEV: No Python code runs from here, the decision is atomic
+
+        # Rate limit of 0 blocks everything
+        if self._rate_limit == 0:
+            allowed = False
+
+        # Negative rate limit disables rate limiting
+        elif self._rate_limit < 0:
+            allowed = True
+
+        else:
+            # Add more available tokens based on how much time has passed, but do not exceed the max
+            # DEV: Another thread may have read a later time before this one updated the limiter
+            elapsed = now - self.last_update
+            if elapsed > 0:
+                self.last_update = now
+                if self.tokens < self.max_tokens:
+                    self.tokens = min(self.max_tokens, self.tokens + elapsed * self._rate_limit)
+
+            allowed = self.tokens >= 1
+            if allowed:
+                self.tokens -= 1
+
+        # No tokens have been seen yet, start a new window
+        if not self.current_window:
+            self.current_window = now
+
+        # If more than 1 second has past since last window, reset
+        elif now - self.current_window >= 1.0:
+            # Store previous window's rate to average with current for `.effective_rate`
+            self._prev_window_rate = self._current_window_rate()
+            self._has_prev_window = True
+            self.tokens_allowed = 0
+            self.tokens_total = 0
+            self.current_window = now
+
+        # Keep track of total tokens seen vs allowed
+        if allowed:
+            self.tokens_allowed += 1
+        self.tokens_total += 1
+
+        return allowed
+
+    cdef double _current_window_rate(self):
+        # No tokens have been seen, effectively 100% sample rate
+        # DEV: This is to avoid division by zero error
+        if not self.tokens_total:
+            return 1.0
+
+        # Get rate of tokens allowed
+        return <double>self.tokens_allowed / self.tokens_total
+
+    @property
+    def prev_window_rate(self):
+        """The effective rate of the previous window, or ``None`` during the first window."""
+        return self._prev_window_rate if self._has_prev_window else None
+
+    @property
+    def effective_rate(self):
+        """
+        Return the effective sample rate of this rate limiter
+
+        :returns: Effective sample rate value 0.0 <= rate <= 1.0
+        :rtype: :obj:`float``
+        """
+        # If we have not had a previous window yet, return current rate
+        if not self._has_prev_window:
+            return self._current_window_rate()
+
+        return (self._current_window_rate() + self._prev_window_rate) / 2.0
@@ -0,0 +1,293 @@
+"""Compiled core of :class:`ddtrace.span.Span`.
+
+The attributes of the span, its constructor and the methods called the most by
+the integrations (``set_tag``, ``set_metric`` and ``finish``) are implemented
+here. ``ddtrace.span.Span`` extends :class:`SpanBase` with the rest of the
+public API.
+
+``set_tag`` used to compare the key with each of the tags that need a special
+treatment. Those tags are now classified once, in a table that maps them to
+the kind of processing they require, so that an ordinary tag costs a single
+dictionary lookup.
+"""
+from cpython cimport PyDict_GetItem
+from libc.math cimport isinf
+from libc.math cimport isnan
+
+from ._rand cimport rand64bits
+from .. import compat
+from ..compat import time_ns
+from ..constants import MANUAL_DROP_KEY
+from ..constants import MANUAL_KEEP_KEY
+from ..constants import NUMERIC_TAGS
+from ..constants import SERVICE_KEY
+from ..constants import SERVICE_VERSION_KEY
+from ..constants import SPAN_MEASURED_KEY
+from ..constants import VERSION_KEY
+from ..ext import SpanTypes
+from ..ext import http
+from ..ext import net
+from ..ext import priority
+from .logger import get_logger
+
+
+# DEV: Use the logger of the public module so that the logging configuration of the users still applies
+log = get_logger("ddtrace.span")
+
+
+# The kinds of tags that `set_tag` processes differently
+cdef enum:
+    _TAG_DEFAULT = 0
+    # Forced to a string, it *has* to be in `meta` for the metrics calculated in the trace agent
+    _TAG_STRING
+    # Converted to an integer if possible
+    # DEV: Some integrations parse these values from strings, but don't call `int(value)` themselves
+    _TAG_INTEGER
+    # Set as a metric, converted to a float if needed
+    _TAG_NUMERIC
+    _TAG_MANUAL_KEEP
+    _TAG_MANUAL_DROP
+    _TAG_SERVICE
+    _TAG_SERVICE_VERSION
+    _TAG_MEASURED
+
+
+cdef dict _TAG_KINDS = {
+    http.STATUS_CODE: _TAG_STRING,
+    net.TARGET_PORT: _TAG_INTEGER,
+    MANUAL_KEEP_KEY: _TAG_MANUAL_KEEP,
+    MANUAL_DROP_KEY: _TAG_MANUAL_DROP,
+    SERVICE_KEY: _TAG_SERVICE,
+    SERVICE_VERSION_KEY: _TAG_SERVICE_VERSION,
+    SPAN_MEASURED_KEY: _TAG_MEASURED,
+}
+_TAG_KINDS.update((key, _TAG_NUMERIC) for key in NUMERIC_TAGS)
+
+# Integers up to this value are set as metrics, larger ones cannot be represented exactly as a float
+cdef object _MAX_METRIC_INTEGER = 2 ** 53
+
+
+cdef inline bint _is_integer(object value):
+    # Same as `ddtrace.compat.is_integer`
+    return isinstance(value, (int, long)) and not isinstance(value, bool)
+
+
+cdef class SpanBase(object):
+
+    # Public span attributes
+    cdef public object service
+    cdef public object name
+    cdef public object resource
+    cdef public object span_id
+    cdef public object trace_id
+    cdef public object parent_id
+    cdef public object meta
+    cdef public object error
+    cdef public object metrics
+    cdef public object _span_type
+    cdef public object start_ns
+    cdef public object duration_ns
+    cdef public object tracer
+    # Sampler attributes
+    cdef public object sampled
+    # Internal attributes
+    cdef public object _context
+    cdef public object _parent
+    cdef public object _ignored_exceptions
+    cdef object __weakref__
+
+    def __init__(
+        self,
+        tracer,
+        name,
+        service=None,
+        resource=None,
+        span_type=None,
+        trace_id=None,
+        span_id=None,
+        parent_id=None,
+        start=None,
+        context=None,
+        _check_pid=True,
+    ):
+        """
+        Create a new span. Call `finish` once the traced operation is over.
+
+        :param ddtrace.Tracer tracer: the tracer that will submit this span when
+            finished.
+        :param str name: the name of the traced operation.
+
+        :param str service: the service name
+        :param str resource: the resource name
+        :param str span_type: the span type
+
+        :param int trace_id: the id of this trace's root span.
+        :param int parent_id: the id of this span's direct parent span.
+        :param int span_id: the id of this span.
+
+        :param int start: the start time of request as a unix epoch in seconds
+        :param object context: the Context of the span.
+        """
+        # required span info
+        self.name = name
+        self.service = service
+        self.resource = resource or name
+        self._span_type = span_type.value if isinstance(span_type, SpanTypes) else span_type
+
+        # tags / metadata
+        self.meta = {}
+        self.error = 0
+        self.metrics = {}
+
+        # timing
+        self.start_ns = time_ns() if start is None else int(start * 1e9)
+        self.duration_ns = None
+
+        # tracing
+        self.trace_id = trace_id or rand64bits(_check_pid)
+        self.span_id = span_id or rand64bits(_check_pid)
+        self.parent_id = parent_id
+        self.tracer = tracer
+
+        # sampling
+        self.sampled = True
+
+        self._context = context
+        self._parent = None
+        self._ignored_exceptions = None
+
+    def finish(self, finish_time=None):
+        """Mark the end time of the span and submit it to the tracer.
+        If the span has already been finished don't do anything
+
+        :param int finish_time: The end time of the span in seconds.
+                                Defaults to now.
+        """
+        if self.duration_ns is not None:
+            return
+
+        ft = time_ns() if finish_time is None else int(finish_time * 1e9)
+        # be defensive so we don't die if start isn't set
+        self.duration_ns = ft - (self.start_ns or ft)
+
+        if self._context:
+            trace, sampled = self._context.close_span(self)
+            if self.tracer and trace and sampled:
+                self.tracer.write(trace)
+
+    def set_tag(self, key, value=None):
+        """Set a tag key/value pair on the span.
+
+        Keys must be strings, values must be ``stringify``-able.
+
+        :param key: Key to use for the tag
+        :type key: str
+        :param value: Value to assign for the tag
+        :type value: ``stringify``-able value
+        """
+        cdef int kind
+        cdef bint val_is_an_int
+
+        if not isinstance(key, basestring):
+            log.warning("Ignoring tag pair %s:%s. Key must be a string.", key, value)
+            return
+
+        found = PyDict_GetItem(_TAG_KINDS, key)
+        kind = _TAG_DEFAULT if found == NULL else <object>found
+
+        if kind == _TAG_STRING:
+            value = str(value)
+
+        # Determine once up front
+        val_is_an_int = _is_integer(value)
+
+        if kind == _TAG_INTEGER and not val_is_an_int:
+            try:
+                value = int(value)
+                val_is_an_int = True
+            except (ValueError, TypeError):
+                pass
+
+        # Set integers that are less than equal to 2^53 as metrics
+        if val_is_an_int and abs(value) <= _MAX_METRIC_INTEGER:
+            self._set_metric(key, value)
+            return
+
+        # All floats should be set as a metric
+        elif isinstance(value, float):
+            self._set_metric(key, value)
+            return
+
+        elif kind != _TAG_DEFAULT:
+            if kind == _TAG_NUMERIC:
+                try:
+                    # DEV: `_set_metric` will try to cast to `float()` for us
+                    self._set_metric(key, value)
+                except (TypeError, ValueError):
+                    log.warning("error setting numeric metric %s:%s", key, value)
+                return
+            elif kind == _TAG_MANUAL_KEEP:
+                self._context.sampling_priority = priority.USER_KEEP
+                return
+            elif kind == _TAG_MANUAL_DROP:
+                self._context.sampling_priority = priority.USER_REJECT
+                return
+            elif kind == _TAG_SERVICE:
+                self.service = value
+            elif kind == _TAG_SERVICE_VERSION:
+                # Also set the `version` tag to the same value
+                # DEV: Note that we do no return, we want to set both
+                self.set_tag(VERSION_KEY, value)
+            elif kind == _TAG_MEASURED:
+                # Set `_dd.measured` tag as a metric
+                # DEV: `_set_metric` will ensure it is an integer 0 or 1
+                if value is None:
+                    value = 1
+                self._set_metric(key, value)
+                return
+
+        try:
+            self.meta[key] = value if type(value) is unicode else compat.stringify(value)
+            if key in self.metrics:
+                del self.metrics[key]
+        except Exception:
+            log.warning("error setting tag %s, ignoring it", key, exc_info=True)
+
+    def set_metric(self, key, value):
+        self._set_metric(key, value)
+
+    cdef _set_metric(self, key, value):
+        # This method sets a numeric tag value for the given key. It acts
+        # like `set_meta()` and it simply add a tag without further processing.
+        cdef double number
+
+        # Enforce a specific connstant for `_dd.measured`
+        if key == SPAN_MEASURED_KEY:
+            try:
+                value = int(bool(value))
+            except (ValueError, TypeError):
+                log.warning("failed to convert %r tag to an integer from %r", key, value)
+                return
+
+        # FIXME[matt] we could push this check to serialization time as well.
+        # only permit types that are commonly serializable (don't use
+        # isinstance so that we convert unserializable types like numpy
+        # numbers)
+        if type(value) is not float and type(value) is not int and type(value) is not long:
+            try:
+                value = float(value)
+            except (ValueError, TypeError):
+                log.debug("ignoring not number metric %s:%s", key, value)
+                return
+
+        # don't allow nan or inf
+        # DEV: integers are always real numbers
+        if type(value) is float:
+            number = value
+            if isnan(number) or isinf(number):
+                log.debug("ignoring not real metric %s:%s", key, value)
+                return
+
+        if key in self.meta:
+            del self.meta[key]
+        self.metrics[key] = value
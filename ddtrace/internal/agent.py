@@ -1,11 +1,21 @@
+import contextlib
+import errno
 import os
+import select
+import threading
+import weakref
 
 from ddtrace import compat
 from ddtrace.utils.formats import get_env
 
+from . import forksafe
+from .logger import get_logger
 from .uds import UDSHTTPConnection
 
 
+log = get_logger(__name__)
+
+
 DEFAULT_HOSTNAME = "localhost"
 DEFAULT_TRACE_PORT = 8126
 DEFAULT_STATS_PORT = 8125
@@ -53,3 +63,164 @@ def get_connection(url, timeout=DEFAULT_TIMEOUT):
         raise ValueError("Unknown agent protocol %s" % parsed.scheme)
 
     return conn
+
+
+def _is_connection_dropped(conn):
+    """Return whether an idle connection has been closed by the remote end.
+
+    An idle keep-alive socket should never be readable: if it is, the peer either closed it or sent data we do not
+    expect. In both cases the connection cannot be reused.
+    """
+    sock = conn.sock
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, IOError, ValueError):
+        return True
+    return bool(readable)
+
+
+def _is_connection_reset(error):
+    """Return whether a request failed because the remote end closed the connection before replying."""
+    # DEV: `http.client.RemoteDisconnected` is a `BadStatusLine`
+    if isinstance(error, compat.httplib.BadStatusLine):
+        return True
+    return isinstance(error, (OSError, IOError)) and error.errno in (errno.ECONNRESET, errno.EPIPE)
+
+
+# Pools are kept in a weak set so that they can be reset in the child after a fork without the fork hook keeping them
+# alive.
+_POOLS = weakref.WeakSet()
+
+
+class ConnectionPool(object):
+    """A pool of persistent HTTP/1.1 connections to a single agent URL.
+
+    Connections are handed out by :meth:`connection` and put back in the pool once the request is done, so that
+    subsequent requests reuse the same socket instead of paying for a new TCP (or UDS) connection each time. Idle
+    connections that have been closed by the agent are discarded and replaced transparently.
+
+    The pool is reset in child processes after a fork so that parent and child never share a socket.
+    """
+
+    def __init__(self, url, timeout=DEFAULT_TIMEOUT, maxsize=1):
+        """Create a new connection pool.
+
+        :param url: The URL to connect to.
+        :param timeout: The timeout of the connections created by the pool.
+        :param maxsize: The maximum number of idle connections kept in the pool.
+        """
+        self.url = url
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._idle = []
+        _POOLS.add(self)
+
+    def __repr__(self):
+        return "{0}(url={1!r}, timeout={2!r}, maxsize={3!r})".format(
+            self.__class__.__name__, self.url, self.timeout, self.maxsize
+        )
+
+    def _get_idle(self):
+        with self._lock:
+            while self._idle:
+                conn = self._idle.pop()
+                if not _is_connection_dropped(conn):
+                    return conn
+                log.debug("discarding dropped connection to %s", self.url)
+                conn.close()
+        return None
+
+    def _get(self):
+        conn = self._get_idle()
+        if conn is None:
+            return get_connection(self.url, self.timeout)
+        return conn
+
+    def _put(self, conn):
+        if conn.sock is None:
+            # The connection has been closed, e.g. because the server sent `Connection: close`.
+            return
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Return a context manager that yields a connection from the pool.
+
+        The connection is put back in the pool when the context exits without an error, otherwise it is closed. The
+        response of every request made with the connection must be fully read before exiting the context.
+        """
+        conn = self._get()
+        try:
+            yield conn
+        except BaseException:
+            conn.close()
+            raise
+        else:
+            self._put(conn)
+
+    def _request(self, conn, method, path, body, headers):
+        try:
+            conn.request(method, path, body, headers)
+            resp = compat.get_connection_response(conn)
+            data = resp.read()
+        except BaseException:
+            conn.close()
+            raise
+        self._put(conn)
+        return resp, data
+
+    def request(self, method, path, body=None, headers=None):
+        """Send a request on a connection of the pool.
+
+        The agent can close an idle connection after it has been checked and before the request is sent: the request
+        is then retried once on a new connection.
+
+        :param method: The HTTP method of the request.
+        :param path: The path of the request.
+        :param body: The body of the request.
+        :param headers: The headers of the request.
+        :return: The response, which has been read, and its body.
+        """
+        if headers is None:
+            headers = {}
+
+        conn = self._get_idle()
+        if conn is not None:
+            try:
+                return self._request(conn, method, path, body, headers)
+            except Exception as e:
+                if not _is_connection_reset(e):
+                    raise
+                log.debug("connection to %s closed by the remote end, retrying on a new connection", self.url)
+
+        return self._request(get_connection(self.url, self.timeout), method, path, body, headers)
+
+    def close(self):
+        """Close all the idle connections of the pool."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def _reset(self):
+        # The lock might have been held by another thread at fork time: do not use it.
+        self._lock = threading.Lock()
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+def _reset_pools():
+    # The sockets of the idle connections are shared with the parent process: drop them from the child.
+    for pool in list(_POOLS):
+        pool._reset()
+
+
+forksafe.register(_reset_pools)
@@ -1,6 +1,7 @@
 from collections import deque
 import threading
 
+from ddtrace.compat import monotonic
 from ddtrace.vendor import attr
 
 
@@ -13,57 +14,75 @@ class BufferItemTooLarge(Exception):
 
 
 @attr.s
-class TraceBuffer(object):
-    """A thread-safe buffer for collecting encoded trace payloads to be sent to
-    a Datadog Agent.
+class TraceQueue(object):
+    """A bounded thread-safe queue of traces waiting to be encoded.
 
-    :param max_size: The maximum size (in bytes) of the buffer.
-    :param max_item_size: The maximum size of any item in the buffer. It is necessary
-        to have an item limit as traces cannot be divided across trace payloads.
+    When the queue is full, the ``policy`` decides which trace is dropped:
+
+    - ``drop-newest``: the trace being put is dropped.
+    - ``drop-oldest``: the oldest trace in the queue is dropped to make room for the trace being put.
+    - ``block``: the caller waits up to ``timeout`` seconds for room in the queue, and the trace being put is dropped
+      if there is still none.
+
+    :param maxsize: The maximum number of traces in the queue.
+    :param policy: The policy applied when the queue is full.
+    :param timeout: The maximum time (in seconds) to wait for room in the queue with the ``block`` policy.
     """
 
-    max_size = attr.ib(type=int)
-    max_item_size = attr.ib(type=int)
-    _size = attr.ib(init=False, type=int, default=0, repr=True)
-    _lock = attr.ib(init=False, factory=threading.Lock, repr=False)
-    _buffer = attr.ib(init=False, factory=deque, repr=False)
+    POLICIES = ("drop-newest", "drop-oldest", "block")
 
-    def __len__(self):
-        return len(self._buffer)
+    maxsize = attr.ib(type=int)
+    policy = attr.ib(type=str, default="drop-newest")
+    timeout = attr.ib(type=float, default=0.1)
+    _queue = attr.ib(init=False, factory=deque, repr=False)
+    _not_full = attr.ib(init=False, factory=threading.Condition, repr=False)
 
-    @property
-    def size(self):
-        """Return the size in bytes of the trace buffer."""
-        with self._lock:
-            return self._size
+    @policy.validator
+    def _check_policy(self, attribute, value):
+        if value not in self.POLICIES:
+            raise ValueError(
+                "Unsupported queue policy %r, supported policies are: %s" % (value, ", ".join(self.POLICIES))
+            )
 
-    def _clear(self):
-        self._buffer.clear()
-        self._size = 0
+    def __len__(self):
+        return len(self._queue)
 
-    def put(self, item):
-        """Put an item in the buffer.
+    def put(self, trace):
+        """Put a trace in the queue.
 
-        The item should be an encoded trace (list of spans).
+        :returns: The trace dropped to apply the policy of the queue, or ``None`` if no trace was dropped.
         """
-        item_len = len(item)
-        if item_len > self.max_item_size or item_len > self.max_size:
-            raise BufferItemTooLarge()
-
-        with self._lock:
-            if self._size + item_len <= self.max_size:
-                self._buffer.append(item)
-                self._size += item_len
-            else:
-                raise BufferFull()
+        with self._not_full:
+            if len(self._queue) < self.maxsize:
+                self._queue.append(trace)
+                return None
+
+            if self.policy == "drop-oldest":
+                dropped = self._queue.popleft()
+                self._queue.append(trace)
+                return dropped
+
+            if self.policy == "block":
+                deadline = monotonic() + self.timeout
+                while len(self._queue) >= self.maxsize:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        break
+                    self._not_full.wait(remaining)
+                else:
+                    self._queue.append(trace)
+                    return None
+
+            return trace
 
     def get(self):
-        """Return the entire buffer.
+        """Return all the traces in the queue.
 
-        The buffer is cleared in the process.
+        The queue is cleared in the process.
         """
-        with self._lock:
+        with self._not_full:
             try:
-                return list(self._buffer)
+                return list(self._queue)
             finally:
-                self._clear()
+                self._queue.clear()
+                self._not_full.notify_all()
@@ -643,6 +643,28 @@ static inline int msgpack_pack_raw_body(msgpack_packer* x, const void* b, size_t
     return 0;
 }
 
+
+/*
+ * Bin
+ */
+
+static inline int msgpack_pack_bin(msgpack_packer* x, size_t l)
+{
+    if (l < 256) {
+        unsigned char buf[2];
+        buf[0] = 0xc4; buf[1] = (uint8_t)l;
+        msgpack_pack_append_buffer(x, buf, 2);
+    } else if (l < 65536) {
+        unsigned char buf[3];
+        buf[0] = 0xc5; _msgpack_store16(&buf[1], (uint16_t)l);
+        msgpack_pack_append_buffer(x, buf, 3);
+    } else {
+        unsigned char buf[5];
+        buf[0] = 0xc6; _msgpack_store32(&buf[1], (uint32_t)l);
+        msgpack_pack_append_buffer(x, buf, 5);
+    }
+}
+
 #undef msgpack_pack_append_buffer
 
 #undef TAKE8_8
@@ -0,0 +1,193 @@
+from __future__ import division
+
+from collections import deque
+import mmap
+import random
+import tempfile
+
+from ddtrace.compat import monotonic
+from ddtrace.vendor import attr
+
+
+@attr.s
+class SpillRing(object):
+    """A size-capped FIFO of payloads stored in a memory-mapped temporary file.
+
+    Payloads are written one after the other in the file, wrapping around at the end. The oldest payloads are evicted
+    to make room for new ones when the file is full.
+
+    :param capacity: The size (in bytes) of the file.
+    :param directory: The directory where the file is created. Defaults to the temporary directory of the system.
+    """
+
+    capacity = attr.ib(type=int)
+    directory = attr.ib(default=None)
+    _file = attr.ib(init=False, repr=False)
+    _mmap = attr.ib(init=False, repr=False)
+    # The (offset, length, count) of the payloads in the file, oldest first
+    _records = attr.ib(init=False, factory=deque, repr=False)
+    _size = attr.ib(init=False, type=int, default=0)
+
+    def __attrs_post_init__(self):
+        self._file = tempfile.TemporaryFile(prefix="ddtrace-spill-", dir=self.directory)
+        self._file.truncate(self.capacity)
+        self._mmap = mmap.mmap(self._file.fileno(), self.capacity)
+
+    def __len__(self):
+        return len(self._records)
+
+    @property
+    def size(self):
+        """Return the size in bytes of the payloads in the ring."""
+        return self._size
+
+    def _allocate(self, length):
+        """Return the offset where a payload of ``length`` bytes fits, or ``None`` if there is no room."""
+        if not self._records:
+            return 0
+
+        head = self._records[0][0]
+        last_offset, last_length, _ = self._records[-1]
+        tail = last_offset + last_length
+        if last_offset >= head:
+            # The payloads are in [head, tail): use the end of the file, or wrap around.
+            if self.capacity - tail >= length:
+                return tail
+            if head >= length:
+                return 0
+        elif head - tail >= length:
+            # The payloads are in [head, capacity) and [0, tail)
+            return tail
+        return None
+
+    def put(self, payload, count):
+        """Add a payload of ``count`` traces to the ring.
+
+        :returns: The ``(length, count)`` of the payloads dropped to make room, including the given payload if it is
+            larger than the ring.
+        """
+        data = memoryview(payload).tobytes()
+        length = len(data)
+        if length > self.capacity:
+            return [(length, count)]
+
+        dropped = []
+        offset = self._allocate(length)
+        while offset is None:
+            _, evicted_length, evicted_count = self._records.popleft()
+            self._size -= evicted_length
+            dropped.append((evicted_length, evicted_count))
+            offset = self._allocate(length)
+
+        self._mmap[offset : offset + length] = data
+        self._records.append((offset, length, count))
+        self._size += length
+        return dropped
+
+    def peek(self):
+        """Return the oldest payload and its trace count, or ``None`` if the ring is empty."""
+        if not self._records:
+            return None
+        offset, length, count = self._records[0]
+        return self._mmap[offset : offset + length], count
+
+    def pop(self):
+        """Remove the oldest payload."""
+        _, length, _ = self._records.popleft()
+        self._size -= length
+
+    def close(self):
+        self._records.clear()
+        self._size = 0
+        self._mmap.close()
+        self._file.close()
+
+
+@attr.s
+class RetryQueue(object):
+    """A bounded FIFO of payloads that failed to be sent and must be retried.
+
+    Payloads are kept in memory up to ``max_size`` bytes. Beyond that, the oldest payloads are moved to the ``spill``
+    ring if there is one, or dropped otherwise. The spilled payloads are older than the ones in memory, so they are
+    retried first.
+
+    The delay between two attempts grows exponentially with the number of consecutive failures, up to ``max_delay``
+    seconds, with some randomness so that the clients of an agent do not all retry at the same time.
+
+    :param max_size: The maximum size (in bytes) of the payloads kept in memory.
+    :param spill: The :class:`SpillRing` the payloads exceeding ``max_size`` are moved to.
+    :param base_delay: The delay (in seconds) before the first retry.
+    :param max_delay: The maximum delay (in seconds) between two attempts.
+    """
+
+    max_size = attr.ib(type=int)
+    spill = attr.ib(default=None)
+    base_delay = attr.ib(type=float, default=1.0)
+    max_delay = attr.ib(type=float, default=30.0)
+    _payloads = attr.ib(init=False, factory=deque, repr=False)
+    _size = attr.ib(init=False, type=int, default=0)
+    _attempts = attr.ib(init=False, type=int, default=0)
+    _next_attempt = attr.ib(init=False, type=float, default=0.0)
+
+    def __len__(self):
+        return len(self._payloads) + (len(self.spill) if self.spill is not None else 0)
+
+    @property
+    def size(self):
+        """Return the size in bytes of the payloads in the queue."""
+        return self._size + (self.spill.size if self.spill is not None else 0)
+
+    def put(self, payload, count):
+        """Add a payload of ``count`` traces to the queue.
+
+        :returns: The ``(length, count)`` of the payloads dropped to keep the queue within its limits.
+        """
+        dropped = []
+        self._payloads.append((payload, count))
+        self._size += len(payload)
+        while self._size > self.max_size:
+            oldest, oldest_count = self._payloads.popleft()
+            self._size -= len(oldest)
+            if self.spill is not None:
+                dropped.extend(self.spill.put(oldest, oldest_count))
+            else:
+                dropped.append((len(oldest), oldest_count))
+        return dropped
+
+    def peek(self):
+        """Return the oldest payload and its trace count, or ``None`` if the queue is empty."""
+        if self.spill is not None and len(self.spill):
+            return self.spill.peek()
+        if self._payloads:
+            return self._payloads[0]
+        return None
+
+    def pop(self):
+        """Remove the oldest payload."""
+        if self.spill is not None and len(self.spill):
+            self.spill.pop()
+        else:
+            payload, _ = self._payloads.popleft()
+            self._size -= len(payload)
+
+    def ready(self):
+        """Return whether the backoff delay since the last failed attempt has elapsed."""
+        return monotonic() >= self._next_attempt
+
+    def failed(self):
+        """Record a failed attempt and schedule the next one."""
+        # Cap the exponent to keep the delay computation within the range of floats
+        delay = min(self.max_delay, self.base_delay * 2 ** min(self._attempts, 32))
+        self._attempts += 1
+        self._next_attempt = monotonic() + delay / 2 + random.uniform(0, delay / 2)
+
+    def succeeded(self):
+        """Record a successful attempt, which resets the backoff delay."""
+        self._attempts = 0
+        self._next_attempt = 0.0
+
+    def close(self):
+        self._payloads.clear()
+        self._size = 0
+        if self.spill is not None:
+            self.spill.close()
@@ -0,0 +1,400 @@
+"""Client-side computation of the trace metrics.
+
+The Datadog Agent computes the hits, errors and latency distributions of the services from the traces it receives,
+which requires the tracer to send all of them, including the ones that are not kept. The
+:class:`StatsConcentrator` computes these metrics in the tracer instead, so that only the kept traces have to be
+sent, and the :class:`StatsWriter` sends them to the agent periodically.
+
+The top-level spans, i.e. the spans whose parent is in another service or in another process, and the measured spans
+are aggregated in time buckets by service, name, resource, type and HTTP status code. The durations of the spans are
+aggregated in a DDSketch: a histogram with logarithmic bins, so that the quantiles are known with a relative accuracy
+of 1% whatever the number of spans.
+"""
+import math
+import struct
+import threading
+from typing import Optional
+
+import ddtrace
+
+from . import agent
+from .. import _worker
+from .. import compat
+from ..compat import httplib
+from ..constants import SPAN_MEASURED_KEY
+from ..ext import http
+from ..settings import config
+from ..utils.time import StopWatch
+from ._encoding import Packer
+from .agent import ConnectionPool
+from .agent import get_trace_url
+from .hostname import get_hostname
+from .logger import get_logger
+from .runtime import get_runtime_id
+
+
+log = get_logger(__name__)
+
+# The duration of the time buckets of the metrics, same as the agent
+DEFAULT_BUCKET_SIZE_NS = 10 * 10 ** 9
+
+# The relative accuracy of the quantiles of the durations, same as the agent
+SKETCH_RELATIVE_ACCURACY = 0.01
+
+
+def _varint(buf, value):
+    # Append a protobuf varint
+    while value > 0x7F:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _double_field(buf, field, value):
+    _varint(buf, field << 3 | 1)
+    buf.extend(struct.pack("<d", value))
+
+
+def _message_field(buf, field, message):
+    _varint(buf, field << 3 | 2)
+    _varint(buf, len(message))
+    buf.extend(message)
+
+
+class DDSketch(object):
+    """A sketch of the distribution of positive values, with a logarithmic index mapping.
+
+    The value ``v`` is counted in the bin of index ``ceil(log(v) / log(gamma))``. With
+    ``gamma = (1 + a) / (1 - a)``, any value of the bin is within a relative distance ``a`` of the middle of the bin.
+    Durations in nanoseconds up to days need less than 2000 bins, so the number of bins is not bounded otherwise.
+    """
+
+    __slots__ = ("_bins", "zero_count", "count")
+
+    _GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+    _LOG_GAMMA = math.log(_GAMMA)
+
+    def __init__(self):
+        self._bins = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value <= 0:
+            self.zero_count += 1
+            return
+        index = int(math.ceil(math.log(value) / self._LOG_GAMMA))
+        self._bins[index] = self._bins.get(index, 0) + 1
+
+    def merge(self, other):
+        """Add the values of another sketch to this one."""
+        self.count += other.count
+        self.zero_count += other.zero_count
+        for index, count in other._bins.items():
+            self._bins[index] = self._bins.get(index, 0) + count
+
+    def quantile(self, q):
+        """Return the approximate value of the ``q`` quantile of the values, or ``None`` if there are none."""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        seen = self.zero_count
+        for index in sorted(self._bins):
+            seen += self._bins[index]
+            if seen > rank:
+                break
+        # The middle of the bin, in relative terms
+        return 2 * self._GAMMA ** index / (1 + self._GAMMA)
+
+    def to_proto(self):
+        """Return the sketch serialized as a ``DDSketch`` protobuf message, as expected by the agent."""
+        # IndexMapping: gamma, with the default index offset and interpolation
+        mapping = bytearray()
+        _double_field(mapping, 1, self._GAMMA)
+
+        # Store: the sparse bin counts, a map of sint32 to double
+        store = bytearray()
+        for index, count in sorted(self._bins.items()):
+            entry = bytearray()
+            _varint(entry, 1 << 3 | 0)
+            _varint(entry, (index << 1) ^ (index >> 31))
+            _double_field(entry, 2, count)
+            _message_field(store, 1, entry)
+
+        sketch = bytearray()
+        _message_field(sketch, 1, mapping)
+        _message_field(sketch, 2, store)
+        if self.zero_count:
+            _double_field(sketch, 4, self.zero_count)
+        return bytes(sketch)
+
+
+class _GroupedStats(object):
+    """The metrics of the spans of a time bucket with the same service, name, resource, type and status code."""
+
+    __slots__ = ("hits", "top_level_hits", "errors", "duration", "ok_distribution", "error_distribution")
+
+    def __init__(self):
+        self.hits = 0
+        self.top_level_hits = 0
+        self.errors = 0
+        self.duration = 0
+        self.ok_distribution = DDSketch()
+        self.error_distribution = DDSketch()
+
+    def merge(self, other):
+        """Add the metrics of other spans of the same group."""
+        self.hits += other.hits
+        self.top_level_hits += other.top_level_hits
+        self.errors += other.errors
+        self.duration += other.duration
+        self.ok_distribution.merge(other.ok_distribution)
+        self.error_distribution.merge(other.error_distribution)
+
+
+def _status_code(span):
+    status_code = span.meta.get(http.STATUS_CODE)
+    if status_code is None:
+        return 0
+    try:
+        return int(status_code)
+    except ValueError:
+        return 0
+
+
+class StatsConcentrator(object):
+    """Aggregate the metrics of the spans of finished traces in time buckets.
+
+    The spans are counted in the bucket of their end time.
+    """
+
+    def __init__(self, bucket_size_ns=DEFAULT_BUCKET_SIZE_NS):
+        self.bucket_size_ns = bucket_size_ns
+        self._lock = threading.Lock()
+        # The grouped stats by key, by bucket start time
+        self._buckets = {}
+
+    def add_trace(self, trace):
+        """Aggregate the top-level and measured spans of a trace."""
+        entries = []
+        for span in trace:
+            if span.duration_ns is None:
+                continue
+            parent = span._parent
+            top_level = parent is None or parent.service != span.service
+            if not top_level and not span.metrics.get(SPAN_MEASURED_KEY):
+                continue
+            end_ns = span.start_ns + span.duration_ns
+            key = (span.service, span.name, span.resource, span._span_type, _status_code(span))
+            entries.append((end_ns - end_ns % self.bucket_size_ns, key, top_level, span))
+
+        if not entries:
+            return
+
+        with self._lock:
+            for bucket_start, key, top_level, span in entries:
+                bucket = self._buckets.get(bucket_start)
+                if bucket is None:
+                    bucket = self._buckets[bucket_start] = {}
+                stats = bucket.get(key)
+                if stats is None:
+                    stats = bucket[key] = _GroupedStats()
+                stats.hits += 1
+                if top_level:
+                    stats.top_level_hits += 1
+                stats.duration += span.duration_ns
+                if span.error:
+                    stats.errors += 1
+                    stats.error_distribution.add(span.duration_ns)
+                else:
+                    stats.ok_distribution.add(span.duration_ns)
+
+    def pop(self, now_ns=None, force=False):
+        """Remove and return the buckets that are over, or all of them if ``force`` is set.
+
+        :return: The grouped stats by key, by bucket start time.
+        """
+        if now_ns is None:
+            now_ns = compat.time_ns()
+        with self._lock:
+            if force:
+                flushed, self._buckets = self._buckets, {}
+            else:
+                flushed = {
+                    start: self._buckets.pop(start)
+                    for start in list(self._buckets)
+                    if start + self.bucket_size_ns <= now_ns
+                }
+        return flushed
+
+    def merge(self, buckets, max_buckets):
+        """Put back buckets removed by :meth:`pop`, e.g. to send them again.
+
+        The oldest buckets are dropped so that at most ``max_buckets`` buckets are kept.
+        """
+        with self._lock:
+            for start, bucket in buckets.items():
+                current = self._buckets.get(start)
+                if current is None:
+                    self._buckets[start] = bucket
+                    continue
+                for key, stats in bucket.items():
+                    current_stats = current.get(key)
+                    if current_stats is None:
+                        current[key] = stats
+                    else:
+                        current_stats.merge(stats)
+
+            for start in sorted(self._buckets)[: max(0, len(self._buckets) - max_buckets)]:
+                del self._buckets[start]
+
+    def flush(self, now_ns=None, force=False):
+        """Remove and return the buckets that are over, or all of them if ``force`` is set.
+
+        The buckets are returned in the format of the ``Stats`` of the agent payloads.
+        """
+        return self.format(self.pop(now_ns, force))
+
+    def format(self, buckets):
+        """Return buckets removed by :meth:`pop` in the format of the ``Stats`` of the agent payloads."""
+        return [
+            {
+                "Start": start,
+                "Duration": self.bucket_size_ns,
+                "Stats": [
+                    {
+                        "Service": service or "",
+                        "Name": name or "",
+                        "Resource": resource or "",
+                        "Type": span_type or "",
+                        "HTTPStatusCode": status_code,
+                        "Hits": stats.hits,
+                        "TopLevelHits": stats.top_level_hits,
+                        "Errors": stats.errors,
+                        "Duration": stats.duration,
+                        # DEV: Packed as binary data rather than strings
+                        "OkSummary": bytearray(stats.ok_distribution.to_proto()),
+                        "ErrorSummary": bytearray(stats.error_distribution.to_proto()),
+                    }
+                    for (service, name, resource, span_type, status_code), stats in bucket.items()
+                ],
+            }
+            for start, bucket in sorted(buckets.items())
+        ]
+
+
+class StatsWriter(_worker.PeriodicWorkerThread):
+    """Writer of the trace metrics to the Datadog Agent.
+
+    The metrics of the traces written are aggregated by a :class:`StatsConcentrator` and the buckets that are over
+    are sent every ``interval`` seconds. All the buckets are sent when the writer is stopped.
+
+    The writer is disabled if the agent does not support the trace metrics computed by the tracer, the traces must
+    then be sent to the agent for it to compute their metrics. They can only be dropped once the agent accepted
+    the metrics.
+
+    The agent does not compute the metrics of the traces once the tracer does, so the buckets that cannot be sent
+    because of a connection or server error are sent again with the next ones, up to ``MAX_RETRIED_BUCKETS`` buckets.
+    """
+
+    ENDPOINT = "/v0.6/stats"
+
+    # The maximum number of buckets kept to be sent again, 5 minutes of metrics with the default bucket size
+    MAX_RETRIED_BUCKETS = 30
+
+    def __init__(self, agent_url=None, interval=DEFAULT_BUCKET_SIZE_NS / 1e9, timeout=agent.DEFAULT_TIMEOUT):
+        super(StatsWriter, self).__init__(interval=interval, name=self.__class__.__name__)
+        self.agent_url = get_trace_url() if agent_url is None else agent_url
+        self.enabled = True
+        # Whether the agent accepted the trace metrics computed by the tracer
+        self.accepted = False
+        self._timeout = timeout
+        self._conn_pool = ConnectionPool(self.agent_url, timeout)
+        self._concentrator = StatsConcentrator(int(interval * 1e9))
+        self._started_lock = threading.Lock()
+        self._sequence = 0
+        self._headers = {
+            "Datadog-Meta-Lang": "python",
+            "Datadog-Meta-Lang-Version": compat.PYTHON_VERSION,
+            "Datadog-Meta-Lang-Interpreter": compat.PYTHON_INTERPRETER,
+            "Datadog-Meta-Tracer-Version": ddtrace.__version__,
+            "Content-Type": "application/msgpack",
+        }
+
+    def recreate(self):
+        # type: () -> StatsWriter
+        return self.__class__(agent_url=self.agent_url, interval=self.interval, timeout=self._timeout)
+
+    def write(self, spans):
+        # Start the writer on first write, like `AgentWriter`
+        if self.started is False:
+            with self._started_lock:
+                if self.started is False:
+                    self.start()
+
+        self._concentrator.add_trace(spans)
+
+    def _put(self, data):
+        with StopWatch() as sw:
+            resp, _ = self._conn_pool.request("PUT", self.ENDPOINT, data, self._headers)
+            log.debug("sent trace stats (%db) in %.5fs", len(data), sw.elapsed())
+            return resp
+
+    def flush(self, force=False):
+        buckets = self._concentrator.pop(force=force)
+        if not buckets or not self.enabled:
+            return
+
+        self._sequence += 1
+        payload = {
+            "Hostname": get_hostname() if config.report_hostname else "",
+            "Env": config.env or "",
+            "Version": config.version or "",
+            "Lang": "python",
+            "TracerVersion": ddtrace.__version__,
+            "RuntimeID": get_runtime_id(),
+            "Sequence": self._sequence,
+            "Stats": self._concentrator.format(buckets),
+        }
+        try:
+            response = self._put(Packer().pack(payload))
+        except (httplib.HTTPException, OSError, IOError):
+            log.error("failed to send trace stats to Datadog Agent at %s", self.agent_url, exc_info=True)
+            self._concentrator.merge(buckets, self.MAX_RETRIED_BUCKETS)
+            return
+
+        if response.status in (404, 415):
+            log.warning(
+                "the Datadog Agent at %s does not support trace stats computed by the tracer, sending all the traces",
+                self.agent_url,
+            )
+            self.enabled = False
+        elif response.status < 300:
+            self.accepted = True
+        elif response.status >= 400:
+            log.error(
+                "failed to send trace stats to Datadog Agent at %s: HTTP error status %s, reason %s",
+                self.agent_url,
+                response.status,
+                response.reason,
+            )
+            if response.status >= 500:
+                self._concentrator.merge(buckets, self.MAX_RETRIED_BUCKETS)
+
+    def run_periodic(self):
+        self.flush()
+
+    def stop(self, timeout=None):
+        # type: (Optional[float]) -> None
+        if self.is_alive():
+            super(StatsWriter, self).stop()
+            self.join(timeout=timeout)
+
+    def on_shutdown(self):
+        try:
+            self.flush(force=True)
+        finally:
+            self._conn_pool.close()
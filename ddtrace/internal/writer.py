@@ -4,6 +4,7 @@ from json import loads
 import logging
 import sys
 import threading
+import zlib
 from typing import List
 from typing import Optional
 
@@ -16,16 +17,20 @@ from .. import _worker
 from .. import compat
 from ..compat import httplib
 from ..constants import KEEP_SPANS_RATE_KEY
-from ..encoding import Encoder
 from ..encoding import JSONEncoderV2
 from ..sampler import BasePrioritySampler
+from ..utils.formats import get_env
 from ..utils.time import StopWatch
-from .agent import get_connection
+from ._encoding import BufferedEncoderV05
+from ._encoding import ShardedEncoder
+from .agent import ConnectionPool
 from .agent import get_trace_url
 from .buffer import BufferFull
 from .buffer import BufferItemTooLarge
-from .buffer import TraceBuffer
+from .buffer import TraceQueue
 from .logger import get_logger
+from .retry import RetryQueue
+from .retry import SpillRing
 from .runtime import container
 from .sma import SimpleMovingAverage
 
@@ -42,6 +47,15 @@ LOG_ERR_INTERVAL = 60
 DEFAULT_SMA_WINDOW = 10
 
 
+def _gzip(data, level=1):
+    """Return the gzip compression of ``data``."""
+    if compat.PY2:
+        # zlib only supports the old buffer protocol on Python 2
+        data = memoryview(data).tobytes()
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
 def _human_size(nbytes):
     """Return a human-readable size."""
     i = 0
@@ -176,6 +190,27 @@ class AgentWriter(_worker.PeriodicWorkerThread, TraceWriter):
     payloads up to 50MB. A trace payload is just a list of traces and the agent
     expects a trace to be complete. That is, all spans with the same trace_id
     should be in the same trace.
+
+    Buffered traces are flushed every ``processing_interval`` seconds, or as
+    soon as their size reaches ``flush_threshold`` bytes.
+
+    Traces are encoded by the thread writing them, unless ``encode_queue_size``
+    is set. Traces are then put in a queue of that size and encoded by the
+    writer thread, which takes the encoding out of the application threads.
+    ``encode_queue_policy`` and ``encode_queue_timeout`` define what happens
+    when the queue is full (see :class:`ddtrace.internal.buffer.TraceQueue`).
+
+    Payloads that cannot be sent because of a connection error or a server
+    error are dropped, unless ``retry_queue_size`` is set. They are then kept
+    in memory, up to that many bytes, and retried with an exponential backoff
+    before any new payload, so that traces are sent in order. The oldest
+    payloads beyond that limit are moved to a memory-mapped file of
+    ``spill_size`` bytes if set, and dropped otherwise (see
+    :class:`ddtrace.internal.retry.RetryQueue`).
+
+    Payloads are sent uncompressed, unless ``compression`` is set to
+    ``"gzip"``. Payloads of at least ``compression_threshold`` bytes are then
+    compressed by the writer thread before being sent.
     """
 
     def __init__(
@@ -185,13 +220,22 @@ class AgentWriter(_worker.PeriodicWorkerThread, TraceWriter):
         sampler=None,
         priority_sampler=None,
         processing_interval=1,
-        # Match the payload size since there is no functionality
-        # to flush dynamically.
+        # Match the payload size so that the whole buffer can be sent in a single payload.
         buffer_size=8 * 1000000,
         max_payload_size=8 * 1000000,
+        flush_threshold=None,
         timeout=agent.DEFAULT_TIMEOUT,
         dogstatsd=None,
         report_metrics=False,
+        api_version=None,
+        encode_queue_size=None,
+        encode_queue_policy=None,
+        encode_queue_timeout=None,
+        retry_queue_size=None,
+        spill_size=None,
+        spill_dir=None,
+        compression=None,
+        compression_threshold=None,
     ):
         super(AgentWriter, self).__init__(
             interval=processing_interval, exit_timeout=shutdown_timeout, name=self.__class__.__name__
@@ -199,7 +243,9 @@ class AgentWriter(_worker.PeriodicWorkerThread, TraceWriter):
         self.agent_url = get_trace_url() if agent_url is None else agent_url
         self._buffer_size = buffer_size
         self._max_payload_size = max_payload_size
-        self._buffer = TraceBuffer(max_size=self._buffer_size, max_item_size=self._max_payload_size)
+        # Flush as soon as the buffer is half full by default, rather than waiting for the end of the interval, so that
+        # bursts of traces do not fill the buffer.
+        self._flush_threshold = buffer_size // 2 if flush_threshold is None else flush_threshold
         self._sampler = sampler
         self._priority_sampler = priority_sampler
         self._headers = {
@@ -209,11 +255,52 @@ class AgentWriter(_worker.PeriodicWorkerThread, TraceWriter):
             "Datadog-Meta-Tracer-Version": ddtrace.__version__,
         }
         self._timeout = timeout
-
-        if priority_sampler is not None:
-            self._endpoint = "/v0.4/traces"
+        self._conn_pool = ConnectionPool(self.agent_url, self._timeout)
+
+        if api_version is None:
+            api_version = get_env("trace", "api_version", default="v0.4" if priority_sampler is not None else "v0.3")
+        if api_version not in self._ENCODERS:
+            raise ValueError(
+                "Unsupported trace API version %r, supported versions are: %s"
+                % (api_version, ", ".join(sorted(self._ENCODERS)))
+            )
+        self._set_api_version(api_version)
+
+        if encode_queue_size is None:
+            encode_queue_size = int(get_env("trace", "encode_queue_size", default=0))
+        if encode_queue_policy is None:
+            encode_queue_policy = get_env("trace", "encode_queue_policy", default="drop-newest")
+        if encode_queue_timeout is None:
+            encode_queue_timeout = float(get_env("trace", "encode_queue_timeout", default=0.1))
+        if encode_queue_size > 0:
+            self._queue = TraceQueue(encode_queue_size, encode_queue_policy, encode_queue_timeout)
         else:
-            self._endpoint = "/v0.3/traces"
+            self._queue = None
+
+        if retry_queue_size is None:
+            retry_queue_size = int(get_env("trace", "retry_queue_size", default=0))
+        if spill_size is None:
+            spill_size = int(get_env("trace", "spill_size", default=0))
+        if spill_dir is None:
+            spill_dir = get_env("trace", "spill_dir")
+        self._spill_dir = spill_dir
+        if retry_queue_size > 0:
+            spill = SpillRing(spill_size, spill_dir) if spill_size > 0 else None
+            self._retry_queue = RetryQueue(retry_queue_size, spill)
+        else:
+            self._retry_queue = None
+
+        if compression is None:
+            compression = get_env("trace", "compression")
+        if compression not in self._COMPRESSORS:
+            raise ValueError(
+                "Unsupported payload compression %r, supported compressions are: %s"
+                % (compression, ", ".join(c for c in self._COMPRESSORS if c is not None))
+            )
+        self._compression = compression
+        if compression_threshold is None:
+            compression_threshold = int(get_env("trace", "compression_threshold", default=1024))
+        self._compression_threshold = compression_threshold
 
         self._container_info = container.get_container_info()
         if self._container_info and self._container_info.container_id:
@@ -223,7 +310,6 @@ class AgentWriter(_worker.PeriodicWorkerThread, TraceWriter):
                 }
             )
 
-        self._encoder = Encoder()
         self._headers.update({"Content-Type": self._encoder.content_type})
 
         self._started_lock = threading.Lock()
@@ -232,6 +318,14 @@ class AgentWriter(_worker.PeriodicWorkerThread, TraceWriter):
         self._metrics_reset()
         self._drop_sma = SimpleMovingAverage(DEFAULT_SMA_WINDOW)
 
+    def _set_api_version(self, api_version):
+        self._api_version = api_version
+        self._endpoint = "/%s/traces" % api_version
+        encoder_cls = self._ENCODERS[api_version]
+        # Keep the traces buffered so far when the encoding does not change
+        if type(getattr(self, "_encoder", None)) is not encoder_cls:
+            self._encoder = encoder_cls(max_size=self._buffer_size, max_item_size=self._max_payload_size)
+
     def _metrics_dist(self, name, count=1, tags=None):
         self._metrics[name]["count"] += count
         if tags:
@@ -265,32 +359,64 @@ class AgentWriter(_worker.PeriodicWorkerThread, TraceWriter):
             agent_url=self.agent_url,
             shutdown_timeout=self.exit_timeout,
             priority_sampler=self._priority_sampler,
+            buffer_size=self._buffer_size,
+            max_payload_size=self._max_payload_size,
+            flush_threshold=self._flush_threshold,
+            api_version=self._api_version,
+            encode_queue_size=self._queue.maxsize if self._queue is not None else 0,
+            encode_queue_policy=self._queue.policy if self._queue is not None else None,
+            encode_queue_timeout=self._queue.timeout if self._queue is not None else None,
+            retry_queue_size=self._retry_queue.max_size if self._retry_queue is not None else 0,
+            spill_size=self._retry_queue.spill.capacity
+            if self._retry_queue is not None and self._retry_queue.spill is not None
+            else 0,
+            spill_dir=self._spill_dir,
+            compression=self._compression,
+            compression_threshold=self._compression_threshold,
         )
-        writer._encoder = self._encoder
         writer._headers = self._headers
-        writer._endpoint = self._endpoint
         return writer
 
-    def _put(self, data, headers):
-        conn = get_connection(self.agent_url, self._timeout)
+    # The v0.5 payloads cannot be sharded: merging the shards would require merging their string tables.
+    _ENCODERS = {
+        "v0.3": ShardedEncoder,
+        "v0.4": ShardedEncoder,
+        "v0.5": BufferedEncoderV05,
+    }
+
+    _COMPRESSORS = {
+        None: None,
+        "gzip": _gzip,
+    }
 
+    def _put(self, data, headers):
         with StopWatch() as sw:
-            try:
-                conn.request("PUT", self._endpoint, data, headers)
-                resp = compat.get_connection_response(conn)
-                t = sw.elapsed()
-                if t >= self.interval:
-                    log_level = logging.WARNING
-                else:
-                    log_level = logging.DEBUG
-                log.log(log_level, "sent %s in %.5fs", _human_size(len(data)), t)
-                return Response.from_http_response(resp)
-            finally:
-                conn.close()
+            resp, body = self._conn_pool.request("PUT", self._endpoint, data, headers)
+            t = sw.elapsed()
+            if t >= self.interval:
+                log_level = logging.WARNING
+            else:
+                log_level = logging.DEBUG
+            log.log(log_level, "sent %s in %.5fs", _human_size(len(data)), t)
+            return Response(
+                status=resp.status,
+                body=body,
+                reason=getattr(resp, "reason", None),
+                msg=getattr(resp, "msg", None),
+            )
 
     def _downgrade(self, payload, response):
-        if self._endpoint == "/v0.4/traces":
-            self._endpoint = "/v0.3/traces"
+        if self._api_version == "v0.5":
+            # Traces that are being put in the previous encoder while it is replaced are lost.
+            self._set_api_version("v0.4")
+            # The payload cannot be converted to the v0.4 format
+            log.warning(
+                "Dropping trace payload: the Datadog Agent does not support the v0.5 trace API, downgrading to v0.4. "
+                "Upgrade the Datadog Agent or set DD_TRACE_API_VERSION=v0.4 to avoid this."
+            )
+            return None
+        if self._api_version == "v0.4":
+            self._set_api_version("v0.3")
             return payload
         raise ValueError
 
@@ -298,19 +424,24 @@ class AgentWriter(_worker.PeriodicWorkerThread, TraceWriter):
         headers = self._headers.copy()
         headers["X-Datadog-Trace-Count"] = str(count)
 
+        data = payload
+        if self._compression is not None and len(payload) >= self._compression_threshold:
+            data = self._COMPRESSORS[self._compression](payload)
+            headers["Content-Encoding"] = self._compression
+
         self._metrics_dist("http.requests")
 
-        response = self._put(payload, headers)
+        response = self._put(data, headers)
 
         if response.status >= 400:
             self._metrics_dist("http.errors", tags=["type:%s" % response.status])
         else:
-            self._metrics_dist("http.sent.bytes", len(payload))
+            self._metrics_dist("http.sent.bytes", len(data))
 
         if response.status in [404, 415]:
             log.debug("calling endpoint '%s' but received %s; downgrading API", self._endpoint, response.status)
             try:
-                payload = self._downgrade(payload, response)
+                new_payload = self._downgrade(payload, response)
             except ValueError:
                 log.error(
                     "unsupported endpoint '%s': received response %s from Datadog Agent",
@@ -318,7 +449,17 @@ class AgentWriter(_worker.PeriodicWorkerThread, TraceWriter):
                     response.status,
                 )
             else:
-                return self._send_payload(payload, count)
+                if new_payload is not None:
+                    return self._send_payload(new_payload, count)
+                self._metrics_dist("http.dropped.bytes", len(payload))
+                self._metrics_dist("http.dropped.traces", count)
+        elif response.status >= 500 and self._retry_queue is not None:
+            log.debug(
+                "failed to send traces to Datadog Agent at %s: HTTP error status %s, reason %s, retrying later",
+                self.agent_url,
+                response.status,
+                response.reason,
+            )
         elif response.status >= 400:
             log.error(
                 "failed to send traces to Datadog Agent at %s: HTTP error status %s, reason %s",
@@ -342,6 +483,7 @@ class AgentWriter(_worker.PeriodicWorkerThread, TraceWriter):
                         )
                 except ValueError:
                     log.error("sample_rate is negative, cannot update the rate samplers")
+        return response
 
     def write(self, spans):
         # type: (List[Span]) -> None
@@ -356,49 +498,123 @@ class AgentWriter(_worker.PeriodicWorkerThread, TraceWriter):
         self._metrics_dist("writer.accepted.traces")
         self._set_keep_rate(spans)
 
+        if self._queue is None:
+            self._encode(spans)
+            return
+
+        queued = len(self._queue)
+        dropped = self._queue.put(spans)
+        if dropped is not None:
+            log.warning("trace queue (%d traces) is full, dropping trace", self._queue.maxsize)
+            self._metrics_dist("buffer.dropped.traces", 1, tags=["reason:queue_full"])
+            self.wake()
+        elif queued < self._queue.maxsize // 2 <= len(self._queue):
+            # Encode the queued traces before the queue is full, only waking the writer when the queue crosses half
+            # of its size
+            self.wake()
+
+    def _encode(self, spans):
         try:
-            encoded = self._encoder.encode_trace(spans)
+            size = self._encoder.size
+            self._encoder.put(spans)
+        except BufferItemTooLarge as e:
+            payload_size = e.args[0]
+            log.warning(
+                "trace (%db) larger than payload limit (%db), dropping",
+                payload_size,
+                self._max_payload_size,
+            )
+            self._metrics_dist("buffer.dropped.traces", 1, tags=["reason:t_too_big"])
+            self._metrics_dist("buffer.dropped.bytes", payload_size, tags=["reason:t_too_big"])
+        except BufferFull as e:
+            payload_size = e.args[0]
+            log.warning(
+                "trace buffer (%s traces %db/%db) cannot fit trace of size %db, dropping",
+                len(self._encoder),
+                self._encoder.size,
+                self._encoder.max_size,
+                payload_size,
+            )
+            self._metrics_dist("buffer.dropped.traces", 1, tags=["reason:full"])
+            self._metrics_dist("buffer.dropped.bytes", payload_size, tags=["reason:full"])
+            self.wake()
         except Exception:
             log.error("failed to encode trace with encoder %r", self._encoder, exc_info=True)
             self._metrics_dist("encoder.dropped.traces", 1)
         else:
-            try:
-                self._buffer.put(encoded)
-            except BufferItemTooLarge:
-                log.warning(
-                    "trace (%db) larger than payload limit (%db), dropping",
-                    len(encoded),
-                    self._max_payload_size,
-                )
-                self._metrics_dist("buffer.dropped.traces", 1, tags=["reason:t_too_big"])
-                self._metrics_dist("buffer.dropped.bytes", len(encoded), tags=["reason:t_too_big"])
-            except BufferFull:
-                log.warning(
-                    "trace buffer (%s traces %db/%db) cannot fit trace of size %db, dropping",
-                    len(self._buffer),
-                    self._buffer.size,
-                    self._buffer.max_size,
-                    len(encoded),
-                )
-                self._metrics_dist("buffer.dropped.traces", 1, tags=["reason:full"])
-                self._metrics_dist("buffer.dropped.bytes", len(encoded), tags=["reason:full"])
-            else:
-                self._metrics_dist("buffer.accepted.traces", 1)
-                self._metrics_dist("buffer.accepted.spans", len(spans))
+            self._metrics_dist("buffer.accepted.traces", 1)
+            self._metrics_dist("buffer.accepted.spans", len(spans))
+            # Only wake the writer when the buffer crosses the threshold, not for every trace until it flushes
+            if size < self._flush_threshold <= self._encoder.size:
+                self.wake()
+
+    def _encode_queued(self):
+        """Encode the traces waiting in the queue."""
+        if self._queue is not None:
+            for spans in self._queue.get():
+                self._encode(spans)
+
+    def _try_send_payload(self, payload, count):
+        """Send a payload, returning whether it failed and must be retried later."""
+        try:
+            response = self._send_payload(payload, count)
+        except (httplib.HTTPException, OSError, IOError):
+            self._metrics_dist("http.errors", tags=["type:err"])
+            if self._retry_queue is None:
+                self._metrics_dist("http.dropped.bytes", len(payload))
+                self._metrics_dist("http.dropped.traces", count)
+                raise
+            log.debug("failed to send traces to Datadog Agent at %s, retrying later", self.agent_url, exc_info=True)
+            return True
+        return self._retry_queue is not None and response.status >= 500
+
+    def _retry_later(self, payload, count):
+        dropped_traces = 0
+        for length, n_traces in self._retry_queue.put(payload, count):
+            self._metrics_dist("http.dropped.bytes", length)
+            self._metrics_dist("http.dropped.traces", n_traces)
+            dropped_traces += n_traces
+        if dropped_traces:
+            log.warning(
+                "retry queue (%db) cannot fit the traces that failed to be sent, dropping %d traces",
+                self._retry_queue.max_size,
+                dropped_traces,
+            )
+
+    def _send_retries(self, force=False):
+        """Send the payloads waiting to be retried, in order, until one fails."""
+        queue = self._retry_queue
+        if queue is None or not len(queue) or not (force or queue.ready()):
+            return
+
+        item = queue.peek()
+        while item is not None:
+            payload, count = item
+            if self._try_send_payload(payload, count):
+                queue.failed()
+                return
+            queue.pop()
+            item = queue.peek()
+        queue.succeeded()
 
     def flush_queue(self, raise_exc=False):
-        enc_traces = self._buffer.get()
+        self._encode_queued()
+        encoded = self._encoder.encode()
         try:
-            if not enc_traces:
+            if encoded is None:
+                self._send_retries()
                 return
 
-            encoded = self._encoder.join_encoded(enc_traces)
+            n_traces = encoded.count
             try:
-                self._send_payload(encoded, len(enc_traces))
+                if self._retry_queue is not None and len(self._retry_queue):
+                    # The payloads waiting to be retried are sent first to preserve the order of the traces
+                    self._retry_later(encoded, n_traces)
+                    self._send_retries()
+                elif self._try_send_payload(encoded, n_traces):
+                    self._retry_later(encoded, n_traces)
+                    self._retry_queue.failed()
             except (httplib.HTTPException, OSError, IOError):
-                self._metrics_dist("http.errors", tags=["type:err"])
-                self._metrics_dist("http.dropped.bytes", len(encoded))
-                self._metrics_dist("http.dropped.traces", len(enc_traces))
                 if raise_exc:
                     raise
                 else:
@@ -410,7 +626,7 @@ class AgentWriter(_worker.PeriodicWorkerThread, TraceWriter):
                     # https://github.com/DataDog/datadogpy/issues/439
                     # This really isn't ideal as now we're going to do a ton of socket calls.
                     self.dogstatsd.distribution("datadog.tracer.http.sent.bytes", len(encoded))
-                    self.dogstatsd.distribution("datadog.tracer.http.sent.traces", len(enc_traces))
+                    self.dogstatsd.distribution("datadog.tracer.http.sent.traces", n_traces)
                     for name, metric in self._metrics.items():
                         self.dogstatsd.distribution("datadog.tracer.%s" % name, metric["count"], tags=metric["tags"])
         finally:
@@ -426,4 +642,12 @@ class AgentWriter(_worker.PeriodicWorkerThread, TraceWriter):
             super(AgentWriter, self).stop()
             self.join(timeout=timeout)
 
-    on_shutdown = run_periodic
+    def on_shutdown(self):
+        try:
+            self.run_periodic()
+            # Last chance to send the payloads waiting to be retried
+            self._send_retries(force=True)
+        finally:
+            if self._retry_queue is not None:
+                self._retry_queue.close()
+            self._conn_pool.close()
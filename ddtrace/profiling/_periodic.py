@@ -174,16 +174,24 @@ class PeriodicService(_service.Service):
         if self._worker:
             self._worker.interval = value
 
-    def start(self):
-        """Start the periodic service."""
-        super(PeriodicService, self).start()
+    def _create_worker(self):
+        """Create the thread running the service.
+
+        The worker must provide the `PeriodicThread` interface: `interval`, `ident`, `start`, `stop`, `join` and
+        `is_alive`.
+        """
         periodic_thread_class = PeriodicRealThread if self._real_thread else PeriodicThread
-        self._worker = periodic_thread_class(
+        return periodic_thread_class(
             self.interval,
             target=self.periodic,
             name="%s:%s" % (self.__class__.__module__, self.__class__.__name__),
             on_shutdown=self.on_shutdown,
         )
+
+    def start(self):
+        """Start the periodic service."""
+        super(PeriodicService, self).start()
+        self._worker = self._create_worker()
         self._worker.start()
 
     def join(self, timeout=None):
@@ -0,0 +1,9 @@
+# -*- encoding: utf-8 -*-
+"""Entry point of the profile exporter helper process."""
+import sys
+
+from ddtrace.profiling.exporter import sidecar
+
+
+if __name__ == "__main__":
+    sys.exit(sidecar.main(sys.argv[1:]))
@@ -8,3 +8,23 @@ def traceback_to_frames(
     traceback: types.TracebackType, max_nframes: int
 ) -> typing.Tuple[typing.List[FrameType], int]: ...
 def pyframe_to_frames(frame: types.FrameType, max_nframes: int) -> typing.Tuple[typing.List[FrameType], int]: ...
+
+StackType = typing.Tuple[int, ...]
+
+class StackTable(object):
+    max_code_objects: int
+    def __init__(self, max_code_objects: int = ...) -> None: ...
+    def __len__(self) -> int: ...
+    def __contains__(self, frame_id: int) -> bool: ...
+    def rotate(self) -> None: ...
+    def frame(self, frame_id: int) -> FrameType: ...
+    def frame_function(self, frame_id: int) -> int: ...
+    def function(self, function_id: int) -> typing.Tuple[str, str]: ...
+    def intern_frame(self, filename: str, lineno: int, function_name: str) -> int: ...
+    def intern_line(self, filename: str, lineno: int, line_to_function: typing.Callable[[str, int], str]) -> int: ...
+    def pyframe_to_stack(self, frame: types.FrameType, max_nframes: int) -> typing.Tuple[StackType, int]: ...
+    def traceback_to_stack(self, traceback: types.TracebackType, max_nframes: int) -> typing.Tuple[StackType, int]: ...
+    def frames_to_stack(self, frames: typing.Iterable[FrameType]) -> StackType: ...
+    def stack_to_frames(self, stack: StackType) -> typing.List[FrameType]: ...
+
+stack_table: StackTable
@@ -1,3 +1,14 @@
+from cpython.object cimport PyObject
+
+
+cdef extern from "frameobject.h":
+    ctypedef struct PyFrameObject:
+        PyFrameObject* f_back
+        PyObject* f_code
+
+    int PyFrame_GetLineNumber(PyFrameObject* frame)
+
+
 cpdef traceback_to_frames(traceback, max_nframes):
     """Serialize a Python traceback object into a list of tuple of (filename, lineno, function_name).
 
@@ -33,3 +44,246 @@ cpdef pyframe_to_frames(frame, max_nframes):
             frames.append((code.co_filename, frame.f_lineno, code.co_name))
         frame = frame.f_back
     return frames, nframes
+
+
+cdef class StackTable(object):
+    """A table of the frames seen by the collectors, with stable ids.
+
+    The frames are interned once as ``(filename, lineno, function_name)`` and the collectors record the stacks of
+    their events as tuples of frame ids, the exporter can then build the pprof locations of a frame only once. The
+    functions, i.e. ``(filename, function_name)``, are interned too.
+
+    The frame ids of the Python frames are cached by code object and line number, so that the strings of a frame are
+    only looked up the first time it is seen. The code objects of the cache are kept alive, so that their ids are not
+    reused, and the cache is cleared once it holds ``max_code_objects`` of them.
+
+    The table does not grow forever: :meth:`rotate` is called once a profile is exported, and drops the frames that
+    have not been used since the rotation before. The other frames keep their ids, and the ids are never reused: the
+    stacks recorded since the previous rotation stay valid until the next one.
+
+    :param max_code_objects: The maximum number of code objects to cache frame ids for.
+    """
+
+    cdef readonly Py_ssize_t max_code_objects
+    # The interned frames and the id of their function, by frame id
+    cdef dict _frames
+    cdef dict _frame_functions
+    # The interned functions, by function id
+    cdef dict _functions
+    cdef Py_ssize_t _next_frame_id
+    cdef Py_ssize_t _next_function_id
+    cdef dict _frame_ids
+    cdef dict _function_ids
+    # The ids of the frames used since the last rotation, and between the two rotations before
+    cdef set _used
+    cdef set _previous_used
+    # The frame ids by file name and line number
+    cdef dict _line_frame_ids
+    # The frame ids by line number and the code objects, by code object id
+    cdef dict _code_frame_ids
+    cdef dict _codes
+
+    def __init__(self, max_code_objects=4096):
+        self.max_code_objects = max_code_objects
+        self._frames = {}
+        self._frame_functions = {}
+        self._functions = {}
+        self._next_frame_id = 0
+        self._next_function_id = 0
+        self._frame_ids = {}
+        self._function_ids = {}
+        self._used = set()
+        self._previous_used = set()
+        self._line_frame_ids = {}
+        self._code_frame_ids = {}
+        self._codes = {}
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __contains__(self, frame_id):
+        return frame_id in self._frames
+
+    def rotate(self):
+        """Drop the frames that have not been used since the previous rotation.
+
+        The stacks recorded before the previous rotation must not be used anymore.
+        """
+        # DEV: No Python code runs in here, the collectors never see a table half rotated
+        used = self._used | self._previous_used
+        for frame_id in [frame_id for frame_id in self._frames if frame_id not in used]:
+            del self._frame_ids[self._frames.pop(frame_id)]
+            del self._frame_functions[frame_id]
+
+        used_functions = set(self._frame_functions.values())
+        for function_id in [function_id for function_id in self._functions if function_id not in used_functions]:
+            del self._function_ids[self._functions.pop(function_id)]
+
+        frames = self._frames
+        self._line_frame_ids = {
+            line: frame_id for line, frame_id in self._line_frame_ids.items() if frame_id in frames
+        }
+        for code_id, frame_ids in list(self._code_frame_ids.items()):
+            for lineno in [lineno for lineno, frame_id in frame_ids.items() if frame_id not in frames]:
+                del frame_ids[lineno]
+            if not frame_ids:
+                del self._code_frame_ids[code_id]
+                del self._codes[code_id]
+
+        self._previous_used = self._used
+        self._used = set()
+
+    cpdef frame(self, frame_id):
+        """Return the frame of an id.
+
+        :param frame_id: The id of the frame.
+        :return: The ``(filename, lineno, function_name)`` of the frame.
+        :raise KeyError: If the frame has been dropped by a rotation.
+        """
+        return self._frames[frame_id]
+
+    cpdef frame_function(self, frame_id):
+        """Return the id of the function of a frame.
+
+        :param frame_id: The id of the frame.
+        :return: The id of the function of the frame.
+        :raise KeyError: If the frame has been dropped by a rotation.
+        """
+        return self._frame_functions[frame_id]
+
+    cpdef function(self, function_id):
+        """Return the function of an id.
+
+        :param function_id: The id of the function.
+        :return: The ``(filename, function_name)`` of the function.
+        :raise KeyError: If the function has been dropped by a rotation.
+        """
+        return self._functions[function_id]
+
+    cpdef intern_frame(self, filename, lineno, function_name):
+        """Return the id of a frame, interning it if it is new.
+
+        :param filename: The file name of the frame.
+        :param lineno: The line number of the frame.
+        :param function_name: The function name of the frame.
+        :return: The id of the frame.
+        """
+        frame = (filename, lineno, function_name)
+        frame_id = self._frame_ids.get(frame)
+        if frame_id is not None:
+            self._used.add(frame_id)
+            return frame_id
+
+        function = (filename, function_name)
+        function_id = self._function_ids.get(function)
+        if function_id is None:
+            function_id = self._next_function_id
+            self._next_function_id += 1
+            self._functions[function_id] = function
+            self._function_ids[function] = function_id
+
+        frame_id = self._next_frame_id
+        self._next_frame_id += 1
+        self._frames[frame_id] = frame
+        self._frame_functions[frame_id] = function_id
+        self._frame_ids[frame] = frame_id
+        self._used.add(frame_id)
+        return frame_id
+
+    cpdef intern_line(self, filename, lineno, line_to_function):
+        """Return the id of the frame of a line, interning it if it is new.
+
+        This is for the frames of which only the file name and line number are known: the function name is only
+        resolved the first time the line is seen.
+
+        :param filename: The file name of the frame.
+        :param lineno: The line number of the frame.
+        :param line_to_function: The function returning the function name of a file name and line number.
+        :return: The id of the frame.
+        """
+        line = (filename, lineno)
+        frame_id = self._line_frame_ids.get(line)
+        if frame_id is None:
+            frame_id = self._line_frame_ids[line] = self.intern_frame(
+                filename, lineno, line_to_function(filename, lineno)
+            )
+        else:
+            self._used.add(frame_id)
+        return frame_id
+
+    cdef _code_frame_id(self, PyObject* code, int lineno):
+        cdef object code_id = <Py_ssize_t>code
+        cdef dict frame_ids = self._code_frame_ids.get(code_id)
+        if frame_ids is None:
+            if len(self._codes) >= self.max_code_objects:
+                self._codes.clear()
+                self._code_frame_ids.clear()
+            # DEV: Keep the code object so that its id is not reused
+            self._codes[code_id] = <object>code
+            frame_ids = self._code_frame_ids[code_id] = {}
+
+        frame_id = frame_ids.get(lineno)
+        if frame_id is None:
+            frame_id = frame_ids[lineno] = self.intern_frame(
+                (<object>code).co_filename, lineno, (<object>code).co_name
+            )
+        else:
+            self._used.add(frame_id)
+        return frame_id
+
+    cpdef pyframe_to_stack(self, frame, max_nframes):
+        """Convert a Python frame to a stack of frame ids.
+
+        :param frame: The frame object to serialize.
+        :param max_nframes: The maximum number of frames to return.
+        :return: The tuple of frame ids, innermost first, and the number of frames present in the original stack.
+        """
+        cdef PyFrameObject* f = NULL if frame is None else <PyFrameObject*>frame
+        cdef Py_ssize_t max_n = max_nframes
+        cdef Py_ssize_t nframes = 0
+        stack = []
+        while f != NULL:
+            if nframes < max_n:
+                stack.append(self._code_frame_id(<PyObject*>f.f_code, PyFrame_GetLineNumber(f)))
+            nframes += 1
+            f = f.f_back
+        return tuple(stack), nframes
+
+    cpdef traceback_to_stack(self, traceback, max_nframes):
+        """Convert a Python traceback object to a stack of frame ids.
+
+        :param traceback: The traceback object to serialize.
+        :param max_nframes: The maximum number of frames to return.
+        :return: The tuple of frame ids, innermost first, and the number of frames present in the original traceback.
+        """
+        tb = traceback
+        stack = []
+        nframes = 0
+        while tb is not None:
+            if nframes < max_nframes:
+                frame = tb.tb_frame
+                stack.append(self._code_frame_id(<PyObject*>frame.f_code, frame.f_lineno))
+            nframes += 1
+            tb = tb.tb_next
+        stack.reverse()
+        return tuple(stack), nframes
+
+    cpdef frames_to_stack(self, frames):
+        """Convert frames to a stack of frame ids.
+
+        :param frames: An iterable of ``(filename, lineno, function_name)``.
+        :return: The tuple of frame ids.
+        """
+        return tuple([self.intern_frame(filename, lineno, function_name) for filename, lineno, function_name in frames])
+
+    cpdef stack_to_frames(self, stack):
+        """Convert a stack of frame ids to frames.
+
+        :param stack: The tuple of frame ids.
+        :return: The list of ``(filename, lineno, function_name)``.
+        """
+        return [self.frame(frame_id) for frame_id in stack]
+
+
+# The table of the frames of the events recorded by the collectors
+stack_table = StackTable()
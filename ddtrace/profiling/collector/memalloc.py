@@ -10,6 +10,7 @@ from ddtrace.profiling import _attr
 from ddtrace.profiling import collector
 from ddtrace.profiling import event
 from ddtrace.profiling.collector import _threading
+from ddtrace.profiling.collector import _traceback
 from ddtrace.utils import formats
 from ddtrace.vendor import attr
 
@@ -82,14 +83,14 @@ class MemoryCollector(collector.PeriodicCollector):
                     thread_id=thread_id,
                     thread_name=_threading.get_thread_name(thread_id),
                     thread_native_id=_threading.get_thread_native_id(thread_id),
-                    frames=stack,
+                    stack=_traceback.stack_table.frames_to_stack(frames),
                     nframes=nframes,
                     size=size,
                     sample_size=self.heap_sample_size,
                 )
-                for (stack, nframes, thread_id), size in _memalloc.heap()
+                for (frames, nframes, thread_id), size in _memalloc.heap()
                 # TODO: this should probably be implemented in _memalloc directly for speed
-                if not self.ignore_profiler or not any(frame[0].startswith(_MODULE_TOP_DIR) for frame in stack)
+                if not self.ignore_profiler or not any(frame[0].startswith(_MODULE_TOP_DIR) for frame in frames)
             ),
         )
 
@@ -105,15 +106,15 @@ class MemoryCollector(collector.PeriodicCollector):
                     thread_id=thread_id,
                     thread_name=_threading.get_thread_name(thread_id),
                     thread_native_id=_threading.get_thread_native_id(thread_id),
-                    frames=stack,
+                    stack=_traceback.stack_table.frames_to_stack(frames),
                     nframes=nframes,
                     size=size,
                     capture_pct=capture_pct,
                     nevents=alloc_count,
                 )
-                for (stack, nframes, thread_id), size in events
+                for (frames, nframes, thread_id), size in events
                 # TODO: this should be implemented in _memalloc directly so we have more space for samples
                 # not coming from the profiler
-                if not self.ignore_profiler or not any(frame[0].startswith(_MODULE_TOP_DIR) for frame in stack)
+                if not self.ignore_profiler or not any(frame[0].startswith(_MODULE_TOP_DIR) for frame in frames)
             ),
         )
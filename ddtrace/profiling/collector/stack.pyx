@@ -12,6 +12,7 @@ from ddtrace.profiling import _nogevent
 from ddtrace.profiling import _periodic
 from ddtrace.profiling import collector
 from ddtrace.profiling import event
+from ddtrace.profiling import recorder
 from ddtrace.profiling.collector import _threading
 from ddtrace.profiling.collector import _traceback
 from ddtrace.utils import formats
@@ -28,6 +29,7 @@ FEATURES = {
     "cpu-time": False,
     "stack-exceptions": False,
     "gevent-tasks": False,
+    "native-sampler": False,
 }
 
 
@@ -53,7 +55,7 @@ IF UNAME_SYSNAME == "Linux":
 
     from cpython.exc cimport PyErr_SetFromErrno
 
-    cdef extern from "<pthread.h>":
+    cdef extern from "<pthread.h>" nogil:
         # POSIX says this might be a struct, but CPython relies on it being an unsigned long.
         # We should be defining pthread_t here like this:
         # ctypedef unsigned long pthread_t
@@ -87,22 +89,18 @@ IF UNAME_SYSNAME == "Linux":
         def _get_last_thread_time(self):
             return dict(self._last_thread_time)
 
-        def __call__(self, pthread_ids):
+        def __call__(self, pthread_ids, thread_cpu_times=None):
+            """Return the CPU time used by the threads since the last call.
+
+            :param pthread_ids: The ids of the threads.
+            :param thread_cpu_times: The CPU time of the threads by id if they were already read, e.g. by the
+                                     `_NativeSampler`. The threads missing from it are not accounted this time.
+            """
             cdef list cpu_times = []
-            for pthread_id in pthread_ids:
-                # TODO: Use QueryThreadCycleTime on Windows?
-                # ⚠ WARNING ⚠
-                # `pthread_getcpuclockid` can make Python segfault if the thread is does not exist anymore.
-                # In order avoid this, this function must be called with the GIL being held the entire time.
-                # This is why this whole file is compiled down to C: we make sure we never release the GIL between
-                # calling sys._current_frames() and pthread_getcpuclockid, making sure no thread disappeared.
-                try:
-                    cpu_time = p_clock_gettime_ns(p_pthread_getcpuclockid(pthread_id))
-                except OSError:
-                    # Just in case it fails, set it to 0
-                    # (Note that glibc never fails, it segfaults instead)
-                    cpu_time = 0
-                cpu_times.append(cpu_time)
+            if thread_cpu_times is not None:
+                cpu_times = [thread_cpu_times.get(pthread_id) for pthread_id in pthread_ids]
+            else:
+                cpu_times = self._read_cpu_times(pthread_ids)
 
             cdef dict pthread_cpu_time = {}
 
@@ -110,6 +108,10 @@ IF UNAME_SYSNAME == "Linux":
             for pthread_id, cpu_time in zip(pthread_ids, cpu_times):
                 thread_native_id = _threading.get_thread_native_id(pthread_id)
                 key = pthread_id, thread_native_id
+                if cpu_time is None:
+                    # The thread started after its CPU time was read
+                    pthread_cpu_time[key] = 0
+                    continue
                 # Do a max(0, …) here just in case the result is < 0:
                 # This should never happen, but it can happen if the one chance in a billion happens:
                 # - A new thread has been created and has the same native id and the same pthread_id.
@@ -124,6 +126,24 @@ IF UNAME_SYSNAME == "Linux":
                     del self._last_thread_time[key]
 
             return pthread_cpu_time
+
+        cdef list _read_cpu_times(self, pthread_ids):
+            cdef list cpu_times = []
+            for pthread_id in pthread_ids:
+                # TODO: Use QueryThreadCycleTime on Windows?
+                # ⚠ WARNING ⚠
+                # `pthread_getcpuclockid` can make Python segfault if the thread is does not exist anymore.
+                # In order avoid this, this function must be called with the GIL being held the entire time.
+                # This is why this whole file is compiled down to C: we make sure we never release the GIL between
+                # calling sys._current_frames() and pthread_getcpuclockid, making sure no thread disappeared.
+                try:
+                    cpu_time = p_clock_gettime_ns(p_pthread_getcpuclockid(pthread_id))
+                except OSError:
+                    # Just in case it fails, set it to 0
+                    # (Note that glibc never fails, it segfaults instead)
+                    cpu_time = 0
+                cpu_times.append(cpu_time)
+            return cpu_times
 ELSE:
     cdef class _ThreadTime(object):
         cdef long _last_process_time
@@ -131,7 +151,7 @@ ELSE:
         def __init__(self):
             self._last_process_time = compat.process_time_ns()
 
-        def __call__(self, pthread_ids):
+        def __call__(self, pthread_ids, thread_cpu_times=None):
             current_process_time = compat.process_time_ns()
             cpu_time = current_process_time - self._last_process_time
             self._last_process_time = current_process_time
@@ -159,6 +179,37 @@ class StackSampleEvent(event.StackBasedEvent):
     cpu_time_ns = attr.ib(default=0)
 
 
+@attr.s(slots=True, eq=False)
+class StackSampleAggregate(recorder.Aggregate):
+    """The stack samples folded by thread, span and stack.
+
+    The samples are keyed by ``(thread_id, thread_native_id, thread_name, trace_id, span_id, stack, nframes)``, where
+    ``trace_id`` and ``span_id`` are the smallest ids of the spans active in the thread, or ``None``, and ``stack`` is
+    the tuple of the frame ids in ``_traceback.stack_table``. Their values are ``[count, cpu_time_ns, wall_time_ns]``.
+    """
+
+    def add(self, samples, sampling_period):
+        """Fold stack samples in the aggregate.
+
+        :param samples: A list of ``(key, cpu_time_ns, wall_time_ns)``.
+        :param sampling_period: The sampling period of the samples.
+        """
+        cdef dict folded = self.samples
+        cdef list values
+
+        for key, cpu_time_ns, wall_time_ns in samples:
+            values = folded.get(key)
+            if values is None:
+                folded[key] = [1, cpu_time_ns, wall_time_ns]
+            else:
+                values[0] += 1
+                values[1] += cpu_time_ns
+                values[2] += wall_time_ns
+
+        self.nsamples += len(samples)
+        self.sampling_period_sum += len(samples) * sampling_period
+
+
 @event.event_class
 class StackExceptionSampleEvent(event.StackBasedEvent):
     """A a sample storing raised exceptions and their stack frames."""
@@ -252,7 +303,7 @@ cdef get_task(thread_id):
     return task_id, task_name
 
 
-cdef collect_threads(thread_id_ignore_list, thread_time, thread_span_links) with gil:
+cdef collect_threads(thread_id_ignore_list, thread_time, thread_span_links, thread_cpu_times) with gil:
     cdef dict current_exceptions = {}
 
     IF UNAME_SYSNAME != "Windows" and PY_MAJOR_VERSION >= 3 and PY_MINOR_VERSION >= 7:
@@ -295,7 +346,7 @@ cdef collect_threads(thread_id_ignore_list, thread_time, thread_span_links) with
         # so we don't leak the object
         Py_DECREF(running_threads)
 
-    cdef dict cpu_times = thread_time(running_threads.keys())
+    cdef dict cpu_times = thread_time(running_threads.keys(), thread_cpu_times)
 
     return tuple(
         (
@@ -313,7 +364,231 @@ cdef collect_threads(thread_id_ignore_list, thread_time, thread_span_links) with
 
 
 
-cdef stack_collect(ignore_profiler, thread_time, max_nframes, interval, wall_time, thread_span_links):
+IF UNAME_SYSNAME == "Linux" and PY_MAJOR_VERSION >= 3 and PY_MINOR_VERSION >= 7:
+    FEATURES["native-sampler"] = True
+
+    import os
+
+    from cpython.ref cimport Py_DECREF
+    from cpython.ref cimport Py_INCREF
+    from libc.stdlib cimport free
+    from libc.stdlib cimport realloc
+    from posix.time cimport CLOCK_MONOTONIC
+    from cpython.pythread cimport PyLockStatus
+    from cpython.pythread cimport PyThread_allocate_lock
+    from cpython.pythread cimport PyThread_free_lock
+    from cpython.pythread cimport PyThread_start_new_thread
+
+    cdef extern from "<Python.h>" nogil:
+        # The same as in Cython's cpython/pystate.pxd, but callable without the GIL
+        PyInterpreterState* _PyInterpreterState_Head_nogil "PyInterpreterState_Head"()
+        PyInterpreterState* _PyInterpreterState_Next_nogil "PyInterpreterState_Next"(PyInterpreterState*)
+        PyThreadState* _PyInterpreterState_ThreadHead_nogil "PyInterpreterState_ThreadHead"(PyInterpreterState*)
+        PyThreadState* _PyThreadState_Next_nogil "PyThreadState_Next"(PyThreadState*)
+
+        PyLockStatus PyThread_acquire_lock_timed(PyThread_type_lock lock, long long microseconds, int intr_flag)
+
+    cdef inline long long _monotonic_ns() nogil:
+        cdef timespec tp
+        clock_gettime(CLOCK_MONOTONIC, &tp)
+        return tp.tv_sec * 1000000000LL + tp.tv_nsec
+
+    # Held by the native samplers while they read the CPU time of the threads, and by a thread forking the process:
+    # the samplers hold the lock of the interpreters while reading them, which a forked child process must not inherit
+    cdef PyThread_type_lock _fork_lock = PyThread_allocate_lock()
+    if _fork_lock == NULL:
+        raise MemoryError()
+
+    def _before_fork():
+        with nogil:
+            PyThread_acquire_lock(_fork_lock, WAIT_LOCK)
+
+    def _after_fork():
+        PyThread_release_lock(_fork_lock)
+
+    os.register_at_fork(before=_before_fork, after_in_parent=_after_fork, after_in_child=_after_fork)
+
+    cdef class _NativeSampler(object):
+        """Call a sampling function periodically from a native thread.
+
+        The thread only holds the GIL to call ``target``: it waits for the next sample and reads the CPU time of the
+        threads without it, so the application threads do not have to give it the GIL just for it to find out whether
+        it is time to sample. ``target`` is called with the monotonic time of the sample in nanoseconds, the CPU time
+        of the threads by thread id, and the time spent reading them in nanoseconds.
+
+        This implements the `ddtrace.profiling._periodic.PeriodicThread` interface.
+        """
+
+        # The interval in seconds between the samples
+        cdef public double interval
+        cdef readonly object ident
+        cdef object _target
+        cdef object _pid
+        cdef PyThread_type_lock _stop_lock
+        cdef PyThread_type_lock _exit_lock
+        cdef bint _running
+        cdef bint _stopping
+        # The CPU time of the threads, grown as needed
+        cdef unsigned long* _thread_ids
+        cdef long long* _cpu_times
+        cdef size_t _max_threads
+
+        def __cinit__(self, interval, target):
+            self._stop_lock = PyThread_allocate_lock()
+            self._exit_lock = PyThread_allocate_lock()
+            if self._stop_lock == NULL or self._exit_lock == NULL:
+                raise MemoryError()
+
+        def __init__(self, interval, target):
+            self.interval = interval
+            self._target = target
+
+        def __dealloc__(self):
+            if self._stop_lock != NULL:
+                PyThread_free_lock(self._stop_lock)
+            if self._exit_lock != NULL:
+                PyThread_free_lock(self._exit_lock)
+            free(self._thread_ids)
+            free(self._cpu_times)
+
+        def start(self):
+            """Start the thread."""
+            if self.ident is not None:
+                raise RuntimeError("threads can only be started once")
+
+            # The thread waits on the stop lock between the samples and releases the exit lock once done
+            PyThread_acquire_lock(self._stop_lock, WAIT_LOCK)
+            PyThread_acquire_lock(self._exit_lock, WAIT_LOCK)
+            self._running = True
+            self._pid = os.getpid()
+
+            # The thread owns a reference to the sampler
+            Py_INCREF(self)
+            ident = PyThread_start_new_thread(_native_sampler_run, <void*>self)
+            if ident == -1:
+                Py_DECREF(self)
+                self._running = False
+                PyThread_release_lock(self._stop_lock)
+                PyThread_release_lock(self._exit_lock)
+                raise RuntimeError("can't start new thread")
+            self.ident = <unsigned long>ident
+
+        def is_alive(self):
+            # The thread does not exist anymore in a forked child process
+            return self._running and self._pid == os.getpid()
+
+        def stop(self):
+            """Stop the thread."""
+            if self.is_alive() and not self._stopping:
+                self._stopping = True
+                PyThread_release_lock(self._stop_lock)
+
+        def join(self, timeout=None):
+            """Wait for the thread to stop.
+
+            :param timeout: The maximum time to wait in seconds, or ``None`` to wait until it stops.
+            """
+            cdef long long timeout_us = -1 if timeout is None else int(timeout * 1e6)
+            cdef PyLockStatus status
+
+            if not self.is_alive():
+                return
+
+            with nogil:
+                status = PyThread_acquire_lock_timed(self._exit_lock, timeout_us, 0)
+            if status == PY_LOCK_ACQUIRED:
+                PyThread_release_lock(self._exit_lock)
+
+        cdef bint _grow(self) nogil:
+            cdef size_t max_threads = self._max_threads * 2 if self._max_threads else 16
+            cdef unsigned long* thread_ids = <unsigned long*>realloc(
+                self._thread_ids, max_threads * sizeof(unsigned long)
+            )
+            if thread_ids == NULL:
+                return False
+            self._thread_ids = thread_ids
+            cdef long long* cpu_times = <long long*>realloc(self._cpu_times, max_threads * sizeof(long long))
+            if cpu_times == NULL:
+                return False
+            self._cpu_times = cpu_times
+            self._max_threads = max_threads
+            return True
+
+        cdef size_t _read_cpu_times(self) nogil:
+            cdef PyInterpreterState* interp
+            cdef PyThreadState* tstate
+            cdef clockid_t clock_id
+            cdef timespec tp
+            cdef size_t nthreads = 0
+            cdef PyThread_type_lock lmutex = _PyRuntime.interpreters.mutex
+
+            # A thread removes its thread state from the interpreter with this lock held before it exits: while it
+            # is held, the threads of the thread states are alive. Only the threads running a frame are read, like
+            # the Python sampler does: `pthread_getcpuclockid` crashes on the leftover thread state of a native thread
+            # that exited.
+            if PyThread_acquire_lock(lmutex, WAIT_LOCK) != PY_LOCK_ACQUIRED:
+                return 0
+
+            interp = _PyInterpreterState_Head_nogil()
+            while interp:
+                tstate = _PyInterpreterState_ThreadHead_nogil(interp)
+                while tstate:
+                    if nthreads == self._max_threads and not self._grow():
+                        break
+                    if (
+                        tstate.frame != NULL
+                        and pthread_getcpuclockid(tstate.thread_id, &clock_id) == 0
+                        and clock_gettime(clock_id, &tp) == 0
+                    ):
+                        self._thread_ids[nthreads] = tstate.thread_id
+                        self._cpu_times[nthreads] = tp.tv_sec * 1000000000LL + tp.tv_nsec
+                        nthreads += 1
+                    tstate = _PyThreadState_Next_nogil(tstate)
+                interp = _PyInterpreterState_Next_nogil(interp)
+
+            PyThread_release_lock(lmutex)
+            return nthreads
+
+        cdef _run(self):
+            cdef bint stopped
+            cdef long long now
+            cdef long long read_time_ns
+            cdef size_t nthreads
+            cdef size_t i
+
+            try:
+                while True:
+                    with nogil:
+                        stopped = PyThread_acquire_lock_timed(
+                            self._stop_lock, <long long>(self.interval * 1e6), 0
+                        ) == PY_LOCK_ACQUIRED
+                        if not stopped:
+                            now = _monotonic_ns()
+                            PyThread_acquire_lock(_fork_lock, WAIT_LOCK)
+                            nthreads = self._read_cpu_times()
+                            PyThread_release_lock(_fork_lock)
+                            read_time_ns = _monotonic_ns() - now
+
+                    if stopped:
+                        break
+
+                    self._target(now, {self._thread_ids[i]: self._cpu_times[i] for i in range(nthreads)}, read_time_ns)
+            finally:
+                self._running = False
+                PyThread_release_lock(self._exit_lock)
+
+    cdef void _native_sampler_run(void* arg) with gil:
+        cdef _NativeSampler sampler = <_NativeSampler>arg
+        # `sampler` now holds the reference taken by `_NativeSampler.start` for the thread
+        Py_DECREF(sampler)
+        sampler._run()
+ELSE:
+    _NativeSampler = None
+
+
+cdef stack_collect(
+    ignore_profiler, thread_time, max_nframes, interval, wall_time, thread_span_links, aggregate, thread_cpu_times
+):
 
     if ignore_profiler:
         # Do not use `threading.enumerate` to not mess with locking (gevent!)
@@ -323,7 +598,7 @@ cdef stack_collect(ignore_profiler, thread_time, max_nframes, interval, wall_tim
     else:
         thread_id_ignore_list = set()
 
-    running_threads = collect_threads(thread_id_ignore_list, thread_time, thread_span_links)
+    running_threads = collect_threads(thread_id_ignore_list, thread_time, thread_span_links, thread_cpu_times)
 
     if thread_span_links:
         # FIXME also use native thread id
@@ -341,27 +616,43 @@ cdef stack_collect(ignore_profiler, thread_time, max_nframes, interval, wall_tim
         if task_id in thread_id_ignore_list:
             continue
 
-        frames, nframes = _traceback.pyframe_to_frames(frame, max_nframes)
-
-        stack_events.append(
-            StackSampleEvent(
-                thread_id=thread_id,
-                thread_native_id=thread_native_id,
-                thread_name=thread_name,
-                task_id=task_id,
-                task_name=task_name,
-                trace_ids=set(span.trace_id for span in spans),
-                span_ids=set(span.span_id for span in spans),
-                nframes=nframes, frames=frames,
-                wall_time_ns=wall_time,
-                cpu_time_ns=cpu_time,
-                sampling_period=int(interval * 1e9),
-            ),
-        )
+        frame_ids, nframes = _traceback.stack_table.pyframe_to_stack(frame, max_nframes)
+
+        if aggregate:
+            # Fold the sample in a `StackSampleAggregate` rather than creating an event
+            stack_events.append((
+                (
+                    thread_id,
+                    thread_native_id,
+                    thread_name,
+                    min(span.trace_id for span in spans) if spans else None,
+                    min(span.span_id for span in spans) if spans else None,
+                    frame_ids,
+                    nframes,
+                ),
+                cpu_time,
+                wall_time,
+            ))
+        else:
+            stack_events.append(
+                StackSampleEvent(
+                    thread_id=thread_id,
+                    thread_native_id=thread_native_id,
+                    thread_name=thread_name,
+                    task_id=task_id,
+                    task_name=task_name,
+                    trace_ids=set(span.trace_id for span in spans),
+                    span_ids=set(span.span_id for span in spans),
+                    nframes=nframes, stack=frame_ids,
+                    wall_time_ns=wall_time,
+                    cpu_time_ns=cpu_time,
+                    sampling_period=int(interval * 1e9),
+                ),
+            )
 
         if exception is not None:
             exc_type, exc_traceback = exception
-            frames, nframes = _traceback.traceback_to_frames(exc_traceback, max_nframes)
+            frame_ids, nframes = _traceback.stack_table.traceback_to_stack(exc_traceback, max_nframes)
             exc_events.append(
                 StackExceptionSampleEvent(
                     thread_id=thread_id,
@@ -370,7 +661,7 @@ cdef stack_collect(ignore_profiler, thread_time, max_nframes, interval, wall_tim
                     task_id=task_id,
                     task_name=task_name,
                     nframes=nframes,
-                    frames=frames,
+                    stack=frame_ids,
                     sampling_period=int(interval * 1e9),
                     exc_type=exc_type,
                 ),
@@ -464,6 +755,10 @@ class StackCollector(collector.PeriodicCollector):
     max_time_usage_pct = attr.ib(factory=_attr.from_env("DD_PROFILING_MAX_TIME_USAGE_PCT", 1, float))
     nframes = attr.ib(factory=_attr.from_env("DD_PROFILING_MAX_FRAMES", 64, int))
     ignore_profiler = attr.ib(factory=_attr.from_env("DD_PROFILING_IGNORE_PROFILER", True, formats.asbool))
+    # Fold the stack samples in a `StackSampleAggregate` of the recorder instead of recording `StackSampleEvent`
+    aggregate = attr.ib(factory=_attr.from_env("DD_PROFILING_AGGREGATE_STACK_SAMPLES", False, formats.asbool))
+    # Sample from a `_NativeSampler` rather than a Python thread when it is available
+    native_sampler = attr.ib(factory=_attr.from_env("DD_PROFILING_NATIVE_SAMPLER", False, formats.asbool))
     tracer = attr.ib(default=None)
     _thread_time = attr.ib(init=False, repr=False, eq=False)
     _last_wall_time = attr.ib(init=False, repr=False, eq=False)
@@ -486,6 +781,12 @@ class StackCollector(collector.PeriodicCollector):
         self._init()
         super(StackCollector, self).start()
 
+    def _create_worker(self):
+        # The native thread runs no Python code that could be sampled: keep the Python thread to profile the profiler
+        if self.native_sampler and self.ignore_profiler and FEATURES["native-sampler"]:
+            return _NativeSampler(self.interval, self._sample)
+        return super(StackCollector, self)._create_worker()
+
     def stop(self):
         super(StackCollector, self).stop()
         if self.tracer is not None:
@@ -495,17 +796,39 @@ class StackCollector(collector.PeriodicCollector):
         interval = (used_wall_time_ns / (self.max_time_usage_pct / 100.0)) - used_wall_time_ns
         return max(interval / 1e9, self.min_interval_time)
 
+    def _sample(self, now, thread_cpu_times, read_time_ns):
+        # Called by the `_NativeSampler` with the GIL held
+        for events in self._collect(now, thread_cpu_times, read_time_ns):
+            self.recorder.push_events(events)
+
     def collect(self):
+        return self._collect(compat.monotonic_ns())
+
+    def _collect(self, now, thread_cpu_times=None, used_wall_time_ns=0):
+        """Collect the stacks of the threads.
+
+        :param now: The monotonic time of the sample in nanoseconds.
+        :param thread_cpu_times: The CPU time of the threads by thread id, if it was already read.
+        :param used_wall_time_ns: The time already used to take the sample in nanoseconds.
+        """
+        start = compat.monotonic_ns()
+
         # Compute wall time
-        now = compat.monotonic_ns()
         wall_time = now - self._last_wall_time
         self._last_wall_time = now
 
-        all_events = stack_collect(
+        sampling_period = int(self.interval * 1e9)
+        stack_events, exc_events = stack_collect(
             self.ignore_profiler, self._thread_time, self.nframes, self.interval, wall_time, self._thread_span_links,
+            self.aggregate, thread_cpu_times,
         )
 
-        used_wall_time_ns = compat.monotonic_ns() - now
+        if self.aggregate:
+            self.recorder.push_samples(StackSampleAggregate, stack_events, sampling_period)
+
+        used_wall_time_ns += compat.monotonic_ns() - start
         self.interval = self._compute_new_interval(used_wall_time_ns)
 
-        return all_events
+        if self.aggregate:
+            return [exc_events]
+        return [stack_events, exc_events]
@@ -96,12 +96,12 @@ class _ProfiledLock(wrapt.ObjectProxy):
             try:
                 end = self._self_acquired_at = compat.monotonic_ns()
                 thread_id, thread_name = _current_thread()
-                frames, nframes = _traceback.pyframe_to_frames(sys._getframe(1), self._self_max_nframes)
+                stack, nframes = _traceback.stack_table.pyframe_to_stack(sys._getframe(1), self._self_max_nframes)
                 trace_ids, span_ids = self._get_trace_and_span_ids()
                 self._self_recorder.push_event(
                     LockAcquireEvent(
                         lock_name=self._self_name,
-                        frames=frames,
+                        stack=stack,
                         nframes=nframes,
                         thread_id=thread_id,
                         thread_name=thread_name,
@@ -122,13 +122,15 @@ class _ProfiledLock(wrapt.ObjectProxy):
                 if hasattr(self, "_self_acquired_at"):
                     try:
                         end = compat.monotonic_ns()
-                        frames, nframes = _traceback.pyframe_to_frames(sys._getframe(1), self._self_max_nframes)
+                        stack, nframes = _traceback.stack_table.pyframe_to_stack(
+                            sys._getframe(1), self._self_max_nframes
+                        )
                         thread_id, thread_name = _current_thread()
                         trace_ids, span_ids = self._get_trace_and_span_ids()
                         self._self_recorder.push_event(
                             LockReleaseEvent(
                                 lock_name=self._self_name,
-                                frames=frames,
+                                stack=stack,
                                 nframes=nframes,
                                 thread_id=thread_id,
                                 thread_name=thread_name,
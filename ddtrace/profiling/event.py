@@ -1,4 +1,5 @@
 from ddtrace import compat
+from ddtrace.profiling.collector import _traceback
 from ddtrace.vendor import attr
 
 
@@ -39,7 +40,16 @@ class StackBasedEvent(SampleEvent):
     thread_native_id = attr.ib(default=None)
     task_id = attr.ib(default=None)
     task_name = attr.ib(default=None)
-    frames = attr.ib(default=None)
+    _frames = attr.ib(default=None)
     nframes = attr.ib(default=None)
     trace_ids = attr.ib(default=None)
     span_ids = attr.ib(default=None)
+    # The frame ids in `_traceback.stack_table`: the collectors record those rather than the frames
+    stack = attr.ib(default=None)
+
+    @property
+    def frames(self):
+        """The frames of the event, as a list of ``(filename, lineno, function_name)``."""
+        if self._frames is None and self.stack is not None:
+            return _traceback.stack_table.stack_to_frames(self.stack)
+        return self._frames
@@ -23,7 +23,6 @@ class PprofFileExporter(pprof.PprofExporter):
         :param start_time_ns: The start time of recording.
         :param end_time_ns: The end time of recording.
         """
-        profile = super(PprofFileExporter, self).export(events, start_time_ns, end_time_ns)
         with gzip.open(self.prefix + (".%d.%d" % (os.getpid(), self._increment)), "wb") as f:
-            f.write(profile.SerializeToString())  # type: ignore[attr-defined]
+            self.export_serialized(f, events, start_time_ns, end_time_ns)
         self._increment += 1
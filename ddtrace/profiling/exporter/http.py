@@ -47,11 +47,13 @@ class PprofHTTPExporter(pprof.PprofExporter):
     max_retry_delay = attr.ib(default=None)
     _container_info = attr.ib(factory=container.get_container_info, repr=False)
     _retry_upload = attr.ib(init=False, eq=False)
+    _conn_pool = attr.ib(init=False, eq=False, repr=False)
     endpoint_path = attr.ib(default="/profiling/v1/input")
 
     def __attrs_post_init__(self):
         if self.max_retry_delay is None:
             self.max_retry_delay = self.timeout * 3
+        self._conn_pool = agent.ConnectionPool(self.endpoint, self.timeout)
         self._retry_upload = tenacity.Retrying(
             # Retry after 1s, 2s, 4s, 8s with some randomness
             wait=tenacity.wait_random_exponential(multiplier=0.5),
@@ -84,6 +86,10 @@ class PprofHTTPExporter(pprof.PprofExporter):
 
         self.tags = tags
 
+    @staticmethod
+    def _get_runtime_id():
+        return runtime.get_runtime_id()
+
     @staticmethod
     def _encode_multipart_formdata(fields, tags):
         boundary = binascii.hexlify(os.urandom(16))
@@ -121,7 +127,7 @@ class PprofHTTPExporter(pprof.PprofExporter):
     def _get_tags(self, service):
         tags = {
             "service": service.encode("utf-8"),
-            "runtime-id": runtime.get_runtime_id().encode("ascii"),
+            "runtime-id": self._get_runtime_id().encode("ascii"),
         }
 
         tags.update(self.tags)
@@ -145,12 +151,11 @@ class PprofHTTPExporter(pprof.PprofExporter):
         if self._container_info and self._container_info.container_id:
             headers["Datadog-Container-Id"] = self._container_info.container_id
 
-        profile = super(PprofHTTPExporter, self).export(events, start_time_ns, end_time_ns)
         s = six.BytesIO()
         with gzip.GzipFile(fileobj=s, mode="wb") as gz:
-            gz.write(profile.SerializeToString())
+            self.export_serialized(gz, events, start_time_ns, end_time_ns)
         fields = {
-            "runtime-id": runtime.get_runtime_id().encode("ascii"),
+            "runtime-id": self._get_runtime_id().encode("ascii"),
             "recording-start": (
                 datetime.datetime.utcfromtimestamp(start_time_ns / 1e9).replace(microsecond=0).isoformat() + "Z"
             ).encode(),
@@ -163,7 +168,7 @@ class PprofHTTPExporter(pprof.PprofExporter):
             "chunk-data": s.getvalue(),
         }
 
-        service = self.service or os.path.basename(profile.string_table[profile.mapping[0].filename])
+        service = self.service or os.path.basename(self._get_program_name())
 
         content_type, body = self._encode_multipart_formdata(
             fields,
@@ -171,19 +176,13 @@ class PprofHTTPExporter(pprof.PprofExporter):
         )
         headers["Content-Type"] = content_type
 
-        client = agent.get_connection(self.endpoint, self.timeout)
-        self._upload(client, self.endpoint_path, body, headers)
+        self._upload(self.endpoint_path, body, headers)
 
-    def _upload(self, client, path, body, headers):
-        self._retry_upload(self._upload_once, client, path, body, headers)
+    def _upload(self, path, body, headers):
+        self._retry_upload(self._upload_once, path, body, headers)
 
-    def _upload_once(self, client, path, body, headers):
-        try:
-            client.request("POST", path, body=body, headers=headers)
-            response = client.getresponse()
-            response.read()  # reading is mandatory
-        finally:
-            client.close()
+    def _upload_once(self, path, body, headers):
+        response, _ = self._conn_pool.request("POST", path, body, headers)
 
         if 200 <= response.status < 300:
             return
@@ -22,12 +22,12 @@ class _PprofConverter:
         thread_name: Any,
         trace_id: Any,
         span_id: Any,
-        frames: Any,
+        stack: Any,
         nframes: Any,
         samples: Any,
     ) -> None: ...
     def convert_memalloc_event(
-        self, thread_id: Any, thread_native_id: Any, thread_name: Any, frames: Any, nframes: Any, events: Any
+        self, thread_id: Any, thread_native_id: Any, thread_name: Any, stack: Any, nframes: Any, events: Any
     ) -> None: ...
     def convert_memalloc_heap_event(self, event: Any) -> None: ...
     def convert_lock_acquire_event(
@@ -37,7 +37,7 @@ class _PprofConverter:
         thread_name: Any,
         trace_id: Any,
         span_id: Any,
-        frames: Any,
+        stack: Any,
         nframes: Any,
         events: Any,
         sampling_ratio: Any,
@@ -49,7 +49,7 @@ class _PprofConverter:
         thread_name: Any,
         trace_id: Any,
         span_id: Any,
-        frames: Any,
+        stack: Any,
         nframes: Any,
         events: Any,
         sampling_ratio: Any,
@@ -61,7 +61,7 @@ class _PprofConverter:
         thread_name: Any,
         trace_id: Any,
         span_id: Any,
-        frames: Any,
+        stack: Any,
         nframes: Any,
         exc_type_name: Any,
         events: Any,
@@ -74,3 +74,4 @@ class PprofExporter(exporter.Exporter):
     @staticmethod
     def max_none(a: Any, b: Any): ...
     def export(self, events: Any, start_time_ns: Any, end_time_ns: Any) -> pprof_pb2.Profile: ...  # type: ignore[valid-type]
+    def export_serialized(self, fileobj: Any, events: Any, start_time_ns: Any, end_time_ns: Any) -> None: ...
@@ -3,8 +3,18 @@ import itertools
 import operator
 import sys
 
+from cpython.bytes cimport PyBytes_AS_STRING
+from cpython.bytes cimport PyBytes_FromStringAndSize
+from cpython.bytes cimport PyBytes_GET_SIZE
+from libc.stdint cimport int64_t
+from libc.stdint cimport uint64_t
+from libc.stdlib cimport free
+from libc.stdlib cimport malloc
+from libc.string cimport memcpy
+
 from ddtrace.profiling import _line2def
 from ddtrace.profiling import exporter
+from ddtrace.profiling.collector import _traceback
 from ddtrace.profiling.collector import memalloc
 from ddtrace.profiling.collector import stack
 from ddtrace.profiling.collector import threading
@@ -15,7 +25,24 @@ from ddtrace.vendor import six
 
 _ITEMGETTER_ZERO = operator.itemgetter(0)
 _ITEMGETTER_ONE = operator.itemgetter(1)
-_ATTRGETTER_ID = operator.attrgetter("id")
+
+_SAMPLE_TYPES = (
+    ("cpu-samples", "count"),
+    ("cpu-time", "nanoseconds"),
+    ("wall-time", "nanoseconds"),
+    ("exception-samples", "count"),
+    ("lock-acquire", "count"),
+    ("lock-acquire-wait", "nanoseconds"),
+    ("lock-release", "count"),
+    ("lock-release-hold", "nanoseconds"),
+    ("alloc-samples", "count"),
+    ("alloc-space", "bytes"),
+    ("heap-space", "bytes"),
+)
+
+# The kinds of stacks of the events, see `_event_stack`
+_STACK_IDS = 0
+_STACK_FRAMES = 1
 
 
 @attr.s
@@ -53,76 +80,236 @@ class _StringTable(object):
         return len(self._strings)
 
 
+def _event_stack(event):
+    """Return the stack of an event as ``(kind, stack)``.
+
+    The events recorded by the collectors have the ids of their frames in the stack table. The frames of the other
+    events are only interned once converted, so that their ids follow the order of the conversion.
+    """
+    if event.stack is not None:
+        return (_STACK_IDS, event.stack)
+    return (_STACK_FRAMES, tuple(event.frames))
+
+
+# The protobuf wire types
+DEF WIRE_VARINT = 0
+DEF WIRE_LENGTH_DELIMITED = 2
+
+
+cdef inline Py_ssize_t _varint_size(uint64_t value):
+    cdef Py_ssize_t size = 1
+    while value > 0x7F:
+        value >>= 7
+        size += 1
+    return size
+
+
+cdef inline Py_ssize_t _int_field_size(int field, int64_t value):
+    # The default values are not serialized
+    if value == 0:
+        return 0
+    return _varint_size(field << 3) + _varint_size(<uint64_t>value)
+
+
+cdef inline Py_ssize_t _message_field_size(int field, Py_ssize_t size):
+    return _varint_size(field << 3) + _varint_size(size) + size
+
+
+cdef Py_ssize_t _packed_field_size(int field, values) except -1:
+    cdef Py_ssize_t size = 0
+    cdef int64_t value
+
+    # The empty repeated fields are not serialized
+    if not values:
+        return 0
+
+    for value in values:
+        size += _varint_size(<uint64_t>value)
+    return _message_field_size(field, size)
+
+
+cdef class _ProtobufWriter(object):
+    """Write protobuf fields in the wire format to a file object.
+
+    The fields are written in a buffer of ``buffer_size`` bytes, which is written to the file object when full. The
+    messages are written like the Python protobuf library serializes them: the fields in order, without the fields
+    that have their default value, and the repeated numbers packed.
+    """
+
+    cdef unsigned char* _buffer
+    cdef Py_ssize_t _size
+    cdef Py_ssize_t _buffer_size
+    cdef object _fileobj
+
+    def __cinit__(self, fileobj, Py_ssize_t buffer_size=65536):
+        # DEV: A varint takes up to 10 bytes and must fit in the buffer
+        if buffer_size < 10:
+            raise ValueError("buffer_size must be at least 10 bytes")
+        self._fileobj = fileobj
+        self._size = 0
+        self._buffer_size = buffer_size
+        self._buffer = <unsigned char*>malloc(buffer_size)
+        if self._buffer == NULL:
+            raise MemoryError()
+
+    def __dealloc__(self):
+        free(self._buffer)
+
+    cpdef flush(self):
+        """Write the buffered data to the file object."""
+        if self._size:
+            self._fileobj.write(PyBytes_FromStringAndSize(<char*>self._buffer, self._size))
+            self._size = 0
+
+    cdef int _reserve(self, Py_ssize_t size) except -1:
+        if self._size + size > self._buffer_size:
+            self.flush()
+
+    cdef int write_varint(self, uint64_t value) except -1:
+        self._reserve(10)
+        while value > 0x7F:
+            self._buffer[self._size] = (value & 0x7F) | 0x80
+            self._size += 1
+            value >>= 7
+        self._buffer[self._size] = value
+        self._size += 1
+
+    cdef int write_tag(self, int field, int wire_type) except -1:
+        self.write_varint(field << 3 | wire_type)
+
+    cdef int write_int_field(self, int field, int64_t value) except -1:
+        # The default values are not serialized
+        if value != 0:
+            self.write_tag(field, WIRE_VARINT)
+            self.write_varint(<uint64_t>value)
+
+    cdef int write_message_header(self, int field, Py_ssize_t size) except -1:
+        self.write_tag(field, WIRE_LENGTH_DELIMITED)
+        self.write_varint(size)
+
+    cdef int write_bytes_field(self, int field, bytes value) except -1:
+        cdef Py_ssize_t size = PyBytes_GET_SIZE(value)
+        self.write_message_header(field, size)
+        if size > self._buffer_size:
+            self.flush()
+            self._fileobj.write(value)
+        else:
+            self._reserve(size)
+            memcpy(self._buffer + self._size, PyBytes_AS_STRING(value), size)
+            self._size += size
+
+    cdef int write_pair_message(self, int field, int64_t first, int64_t second) except -1:
+        # A message with two integer fields numbered 1 and 2: ValueType, Label and Line
+        self.write_message_header(field, _int_field_size(1, first) + _int_field_size(2, second))
+        self.write_int_field(1, first)
+        self.write_int_field(2, second)
+
+    cdef int write_packed_field(self, int field, values) except -1:
+        cdef Py_ssize_t size = 0
+        cdef int64_t value
+
+        if not values:
+            return 0
+
+        for value in values:
+            size += _varint_size(<uint64_t>value)
+        self.write_message_header(field, size)
+        for value in values:
+            self.write_varint(<uint64_t>value)
+
+
 @attr.s
 class _PprofConverter(object):
-    """Convert stacks generated by a Profiler to pprof format."""
+    """Convert stacks generated by a Profiler to pprof format.
+
+    The ids of the locations and functions are the ids of the frames and functions in the stack table, plus one. The
+    locations only depend on the stack table and are cached across profiles in ``location_cache``, while the functions
+    are created for each profile since they refer to its string table.
+    """
+
+    _stack_table = attr.ib(factory=lambda: _traceback.stack_table)
+    # The locations by frame id
+    _location_cache = attr.ib(factory=dict)
 
     # Those attributes will be serialize in a `pprof_pb2.Profile`
-    _functions = attr.ib(init=False, factory=dict)
+    # The function id and line number of the locations, by frame id
     _locations = attr.ib(init=False, factory=dict)
+    # The string ids of the name and file name of the functions, by function id
+    _functions = attr.ib(init=False, factory=dict)
     _string_table = attr.ib(init=False, factory=_StringTable)
 
-    _last_location_id = attr.ib(init=False, factory=_Sequence)
-    _last_func_id = attr.ib(init=False, factory=_Sequence)
-
     # A dict where key is a (Location, [Labels]) and value is a a dict.
     # This dict has sample-type (e.g. "cpu-time") as key and the numeric value.
     _location_values = attr.ib(
         factory=lambda: collections.defaultdict(lambda: collections.defaultdict(lambda: 0)), init=False, repr=False
     )
 
-    def _to_Function(self, filename, funcname):
-        try:
-            return self._functions[(filename, funcname)]
-        except KeyError:
-            func = pprof_pb2.Function(
-                id=self._last_func_id.generate(),
-                name=self._str(funcname),
-                filename=self._str(filename),
-            )
-            self._functions[(filename, funcname)] = func
-            return func
+    def _to_location_id(self, frame_id):
+        if frame_id not in self._locations:
+            function_id = self._stack_table.frame_function(frame_id)
+            self._locations[frame_id] = (function_id, self._stack_table.frame(frame_id)[1])
+            if function_id not in self._functions:
+                filename, funcname = self._stack_table.function(function_id)
+                self._functions[function_id] = (self._str(funcname), self._str(filename))
+        return frame_id + 1
 
-    def _to_Location(self, filename, lineno, funcname=None):
+    def _to_Location(self, frame_id):
         try:
-            return self._locations[(filename, lineno, funcname)]
+            return self._location_cache[frame_id]
         except KeyError:
-            if funcname is None:
-                real_funcname = _line2def.filename_and_lineno_to_def(filename, lineno)
-            else:
-                real_funcname = funcname
-            location = pprof_pb2.Location(
-                id=self._last_location_id.generate(),
+            function_id, lineno = self._locations[frame_id]
+            location = self._location_cache[frame_id] = pprof_pb2.Location(
+                id=frame_id + 1,
                 line=[
                     pprof_pb2.Line(
-                        function_id=self._to_Function(filename, real_funcname).id,
+                        function_id=function_id + 1,
                         line=lineno,
                     ),
                 ],
             )
-            self._locations[(filename, lineno, funcname)] = location
             return location
 
     def _str(self, string):
         """Convert a string to an id from the string table."""
         return self._string_table.to_id(str(string))
 
-    def _to_locations(self, frames, nframes):
-        locations = [self._to_Location(filename, lineno, funcname).id for filename, lineno, funcname in frames]
+    def _to_locations(self, stack, nframes):
+        kind, frame_ids = stack
+        if kind == _STACK_FRAMES:
+            frame_ids = self._stack_table.frames_to_stack(frame_ids)
+
+        locations = [self._to_location_id(frame_id) for frame_id in frame_ids]
 
-        omitted = nframes - len(frames)
+        omitted = nframes - len(frame_ids)
         if omitted:
-            locations.append(
-                self._to_Location("", 0, "<%d frame%s omitted>" % (omitted, ("s" if omitted > 1 else ""))).id
+            frame_id = self._stack_table.intern_frame(
+                "", 0, "<%d frame%s omitted>" % (omitted, ("s" if omitted > 1 else ""))
             )
+            locations.append(self._to_location_id(frame_id))
 
         return tuple(locations)
 
     def convert_stack_event(
-        self, thread_id, thread_native_id, thread_name, trace_id, span_id, frames, nframes, samples
+        self, thread_id, thread_native_id, thread_name, trace_id, span_id, stack, nframes, samples
+    ):
+        self.convert_stack_samples(
+            thread_id,
+            thread_native_id,
+            thread_name,
+            trace_id,
+            span_id,
+            stack,
+            nframes,
+            len(samples),
+            sum(s.cpu_time_ns for s in samples),
+            sum(s.wall_time_ns for s in samples),
+        )
+
+    def convert_stack_samples(
+        self, thread_id, thread_native_id, thread_name, trace_id, span_id, stack, nframes, count, cpu_time, wall_time
     ):
         location_key = (
-            self._to_locations(frames, nframes),
+            self._to_locations(stack, nframes),
             (
                 ("thread id", str(thread_id)),
                 ("thread native id", str(thread_native_id)),
@@ -132,13 +319,14 @@ class _PprofConverter(object):
             ),
         )
 
-        self._location_values[location_key]["cpu-samples"] = len(samples)
-        self._location_values[location_key]["cpu-time"] = sum(s.cpu_time_ns for s in samples)
-        self._location_values[location_key]["wall-time"] = sum(s.wall_time_ns for s in samples)
+        values = self._location_values[location_key]
+        values["cpu-samples"] += count
+        values["cpu-time"] += cpu_time
+        values["wall-time"] += wall_time
 
-    def convert_memalloc_event(self, thread_id, thread_native_id, thread_name, frames, nframes, events):
+    def convert_memalloc_event(self, thread_id, thread_native_id, thread_name, stack, nframes, events):
         location_key = (
-            self._to_locations(frames, nframes),
+            self._to_locations(stack, nframes),
             (
                 ("thread id", str(thread_id)),
                 ("thread native id", str(thread_native_id)),
@@ -157,7 +345,7 @@ class _PprofConverter(object):
 
     def convert_memalloc_heap_event(self, event):
         location_key = (
-            self._to_locations(event.frames, event.nframes),
+            self._to_locations(_event_stack(event), event.nframes),
             (
                 ("thread id", str(event.thread_id)),
                 ("thread native id", str(event.thread_native_id)),
@@ -168,10 +356,10 @@ class _PprofConverter(object):
         self._location_values[location_key]["heap-space"] += event.size
 
     def convert_lock_acquire_event(
-        self, lock_name, thread_id, thread_name, trace_id, span_id, frames, nframes, events, sampling_ratio
+        self, lock_name, thread_id, thread_name, trace_id, span_id, stack, nframes, events, sampling_ratio
     ):
         location_key = (
-            self._to_locations(frames, nframes),
+            self._to_locations(stack, nframes),
             (
                 ("thread id", str(thread_id)),
                 ("thread name", thread_name),
@@ -187,10 +375,10 @@ class _PprofConverter(object):
         )
 
     def convert_lock_release_event(
-        self, lock_name, thread_id, thread_name, trace_id, span_id, frames, nframes, events, sampling_ratio
+        self, lock_name, thread_id, thread_name, trace_id, span_id, stack, nframes, events, sampling_ratio
     ):
         location_key = (
-            self._to_locations(frames, nframes),
+            self._to_locations(stack, nframes),
             (
                 ("thread id", str(thread_id)),
                 ("thread name", thread_name),
@@ -206,10 +394,10 @@ class _PprofConverter(object):
         )
 
     def convert_stack_exception_event(
-        self, thread_id, thread_native_id, thread_name, trace_id, span_id, frames, nframes, exc_type_name, events
+        self, thread_id, thread_native_id, thread_name, trace_id, span_id, stack, nframes, exc_type_name, events
     ):
         location_key = (
-            self._to_locations(frames, nframes),
+            self._to_locations(stack, nframes),
             (
                 ("thread id", str(thread_id)),
                 ("thread native id", str(thread_native_id)),
@@ -223,7 +411,12 @@ class _PprofConverter(object):
         self._location_values[location_key]["exception-samples"] = len(events)
 
     def convert_memory_event(self, stats, sampling_ratio):
-        location = tuple(self._to_Location(frame.filename, frame.lineno).id for frame in reversed(stats.traceback))
+        location = tuple(
+            self._to_location_id(
+                self._stack_table.intern_line(frame.filename, frame.lineno, _line2def.filename_and_lineno_to_def)
+            )
+            for frame in reversed(stats.traceback)
+        )
         location_key = (location, tuple())
         self._location_values[location_key]["alloc-samples"] = int(stats.count / sampling_ratio)
         self._location_values[location_key]["alloc-space"] = int(stats.size / sampling_ratio)
@@ -256,8 +449,11 @@ class _PprofConverter(object):
                 ),
             ],
             # Sort location and function by id so the output is reproducible
-            location=sorted(self._locations.values(), key=_ATTRGETTER_ID),
-            function=sorted(self._functions.values(), key=_ATTRGETTER_ID),
+            location=[self._to_Location(frame_id) for frame_id in sorted(self._locations)],
+            function=[
+                pprof_pb2.Function(id=function_id + 1, name=name, filename=filename)
+                for function_id, (name, filename) in sorted(six.iteritems(self._functions))
+            ],
             string_table=list(self._string_table),
             time_nanos=start_time_ns,
             duration_nanos=duration_ns,
@@ -265,11 +461,81 @@ class _PprofConverter(object):
             period_type=period_type,
         )
 
+    def _serialize_profile(
+        self, fileobj, start_time_ns, duration_ns, period, sample_types, program_name, buffer_size=65536
+    ):
+        """Write the profile in the protobuf wire format, as `_build_profile` would serialize.
+
+        The profile is serialized without building the `pprof_pb2` messages, and the ids of the strings are
+        generated in the same order, so that the output is the same.
+        """
+        cdef _ProtobufWriter writer = _ProtobufWriter(fileobj, buffer_size)
+        cdef Py_ssize_t size
+
+        # Profile.sample_type
+        for type_, unit in sample_types:
+            writer.write_pair_message(1, self._str(type_), self._str(unit))
+
+        # Profile.sample
+        for (locations, labels), values in sorted(six.iteritems(self._location_values), key=_ITEMGETTER_ZERO):
+            values = [int(values.get(sample_type_name, 0)) for sample_type_name, unit in sample_types]
+            labels = [(self._str(key), self._str(s)) for key, s in labels]
+            size = _packed_field_size(1, locations) + _packed_field_size(2, values)
+            for key, s in labels:
+                size += _message_field_size(3, _int_field_size(1, key) + _int_field_size(2, s))
+            writer.write_message_header(2, size)
+            writer.write_packed_field(1, locations)
+            writer.write_packed_field(2, values)
+            for key, s in labels:
+                writer.write_pair_message(3, key, s)
+
+        period_type = (self._str("time"), self._str("nanoseconds"))
+
+        # Profile.mapping
+        filename = self._str(program_name)
+        writer.write_message_header(3, _int_field_size(1, 1) + _int_field_size(5, filename))
+        writer.write_int_field(1, 1)
+        writer.write_int_field(5, filename)
+
+        # Profile.location, sorted by id
+        for frame_id in sorted(self._locations):
+            function_id, lineno = self._locations[frame_id]
+            size = _int_field_size(1, frame_id + 1) + _message_field_size(
+                4, _int_field_size(1, function_id + 1) + _int_field_size(2, lineno)
+            )
+            writer.write_message_header(4, size)
+            writer.write_int_field(1, frame_id + 1)
+            writer.write_pair_message(4, function_id + 1, lineno)
+
+        # Profile.function, sorted by id
+        for function_id, (name, filename) in sorted(six.iteritems(self._functions)):
+            size = _int_field_size(1, function_id + 1) + _int_field_size(2, name) + _int_field_size(4, filename)
+            writer.write_message_header(5, size)
+            writer.write_int_field(1, function_id + 1)
+            writer.write_int_field(2, name)
+            writer.write_int_field(4, filename)
+
+        # Profile.string_table
+        for string in self._string_table:
+            writer.write_bytes_field(6, string if isinstance(string, bytes) else string.encode("utf-8"))
+
+        writer.write_int_field(9, start_time_ns)
+        writer.write_int_field(10, duration_ns)
+        writer.write_pair_message(11, period_type[0], period_type[1])
+        if period is not None:
+            writer.write_int_field(12, period)
+
+        writer.flush()
+
 
 @attr.s
 class PprofExporter(exporter.Exporter):
     """Export recorder events to pprof format."""
 
+    _stack_table = attr.ib(init=False, factory=lambda: _traceback.stack_table, repr=False)
+    # The locations of the frames of the stack table, kept from one export to the next
+    _location_cache = attr.ib(init=False, factory=dict, repr=False)
+
     @staticmethod
     def _get_program_name(default="-"):
         try:
@@ -313,10 +579,23 @@ class PprofExporter(exporter.Exporter):
             self._get_thread_name(event.thread_id, event.thread_name),
             self._get_trace_id(event),
             self._get_span_id(event),
-            tuple(event.frames),
+            _event_stack(event),
             event.nframes,
         )
 
+    def _stack_sample_group_key(self, key):
+        # The same as `_stack_event_group_key` for a key of `StackSampleAggregate`
+        thread_id, thread_native_id, thread_name, trace_id, span_id, stack, nframes = key
+        return (
+            thread_id,
+            thread_native_id,
+            self._get_thread_name(thread_id, thread_name),
+            "" if trace_id is None else str(trace_id),
+            "" if span_id is None else str(span_id),
+            (_STACK_IDS, stack),
+            nframes,
+        )
+
     def _group_stack_events(self, events):
         return itertools.groupby(
             sorted(events, key=self._stack_event_group_key),
@@ -330,7 +609,7 @@ class PprofExporter(exporter.Exporter):
             self._get_thread_name(event.thread_id, event.thread_name),
             self._get_trace_id(event),
             self._get_span_id(event),
-            tuple(event.frames),
+            _event_stack(event),
             event.nframes,
         )
 
@@ -349,7 +628,7 @@ class PprofExporter(exporter.Exporter):
             self._get_thread_name(event.thread_id, event.thread_name),
             self._get_trace_id(event),
             self._get_span_id(event),
-            tuple(event.frames),
+            _event_stack(event),
             event.nframes,
             exc_type_name,
         )
@@ -366,7 +645,7 @@ class PprofExporter(exporter.Exporter):
         return (
             event.thread_id,
             self._get_thread_name(event.thread_id, event.thread_name),
-            tuple(event.frames),
+            _event_stack(event),
             event.nframes,
             exc_type_name,
         )
@@ -395,20 +674,21 @@ class PprofExporter(exporter.Exporter):
             return a
         return max(a, b)
 
-    def export(self, events, start_time_ns, end_time_ns) -> pprof_pb2.Profile:  # type: ignore[valid-type]
-        """Convert events to pprof format.
+    def _convert(self, events):
+        """Convert events to pprof samples.
 
         :param events: The event dictionary from a `ddtrace.profiling.recorder.Recorder`.
-        :param start_time_ns: The start time of recording.
-        :param end_time_ns: The end time of recording.
-        :return: A protobuf Profile object.
+        :return: The converter holding the samples and the average sampling period of the events.
         """
-        program_name = self._get_program_name()
-
         sum_period = 0
         nb_event = 0
 
-        converter = _PprofConverter()
+        # Evict the locations of the frames dropped from the stack table, their ids are never reused
+        stack_table = self._stack_table
+        for frame_id in [frame_id for frame_id in self._location_cache if frame_id not in stack_table]:
+            del self._location_cache[frame_id]
+
+        converter = _PprofConverter(stack_table, self._location_cache)
 
         # Handle StackSampleEvent
         stack_events = []
@@ -418,13 +698,38 @@ class PprofExporter(exporter.Exporter):
             nb_event += 1
 
         for (
-            (thread_id, thread_native_id, thread_name, trace_id, span_id, frames, nframes),
+            (thread_id, thread_native_id, thread_name, trace_id, span_id, event_stack, nframes),
             stack_events,
         ) in self._group_stack_events(stack_events):
             converter.convert_stack_event(
-                thread_id, thread_native_id, thread_name, trace_id, span_id, frames, nframes, list(stack_events)
+                thread_id, thread_native_id, thread_name, trace_id, span_id, event_stack, nframes, list(stack_events)
             )
 
+        # Handle StackSampleAggregate: the samples are already grouped
+        aggregate = events.get(stack.StackSampleAggregate)
+        if aggregate is not None and aggregate.nsamples:
+            sum_period += aggregate.sampling_period_sum
+            nb_event += aggregate.nsamples
+            # Sort the samples like the events for the output to be reproducible
+            for (
+                (thread_id, thread_native_id, thread_name, trace_id, span_id, event_stack, nframes),
+                (count, cpu_time, wall_time),
+            ) in sorted(
+                (self._stack_sample_group_key(key), values) for key, values in six.iteritems(aggregate.samples)
+            ):
+                converter.convert_stack_samples(
+                    thread_id,
+                    thread_native_id,
+                    thread_name,
+                    trace_id,
+                    span_id,
+                    event_stack,
+                    nframes,
+                    count,
+                    cpu_time,
+                    wall_time,
+                )
+
         # Handle Lock events
         for event_class, convert_fn in (
             (threading.LockAcquireEvent, converter.convert_lock_acquire_event),
@@ -442,7 +747,7 @@ class PprofExporter(exporter.Exporter):
                     thread_name,
                     trace_id,
                     span_id,
-                    frames,
+                    event_stack,
                     nframes,
                 ), l_events in self._group_lock_events(lock_events):
                     convert_fn(
@@ -451,14 +756,14 @@ class PprofExporter(exporter.Exporter):
                         thread_name,
                         trace_id,
                         span_id,
-                        frames,
+                        event_stack,
                         nframes,
                         list(l_events),
                         sampling_ratio_avg,
                     )
 
         for (
-            (thread_id, thread_native_id, thread_name, trace_id, span_id, frames, nframes, exc_type_name),
+            (thread_id, thread_native_id, thread_name, trace_id, span_id, event_stack, nframes, exc_type_name),
             se_events,
         ) in self._group_stack_exception_events(events.get(stack.StackExceptionSampleEvent, [])):
             converter.convert_stack_exception_event(
@@ -467,7 +772,7 @@ class PprofExporter(exporter.Exporter):
                 thread_name,
                 trace_id,
                 span_id,
-                frames,
+                event_stack,
                 nframes,
                 exc_type_name,
                 list(se_events),
@@ -475,14 +780,14 @@ class PprofExporter(exporter.Exporter):
 
         if memalloc._memalloc:
             for (
-                (thread_id, thread_native_id, thread_name, trace_id, span_id, frames, nframes),
+                (thread_id, thread_native_id, thread_name, trace_id, span_id, event_stack, nframes),
                 memalloc_events,
             ) in self._group_stack_events(events.get(memalloc.MemoryAllocSampleEvent, [])):
                 converter.convert_memalloc_event(
                     thread_id,
                     thread_native_id,
                     thread_name,
-                    frames,
+                    event_stack,
                     nframes,
                     list(memalloc_events),
                 )
@@ -496,26 +801,42 @@ class PprofExporter(exporter.Exporter):
         else:
             period = None
 
-        duration_ns = end_time_ns - start_time_ns
-
-        sample_types = (
-            ("cpu-samples", "count"),
-            ("cpu-time", "nanoseconds"),
-            ("wall-time", "nanoseconds"),
-            ("exception-samples", "count"),
-            ("lock-acquire", "count"),
-            ("lock-acquire-wait", "nanoseconds"),
-            ("lock-release", "count"),
-            ("lock-release-hold", "nanoseconds"),
-            ("alloc-samples", "count"),
-            ("alloc-space", "bytes"),
-            ("heap-space", "bytes"),
-        )
+        return converter, period
 
+    def export(self, events, start_time_ns, end_time_ns) -> pprof_pb2.Profile:  # type: ignore[valid-type]
+        """Convert events to pprof format.
+
+        :param events: The event dictionary from a `ddtrace.profiling.recorder.Recorder`.
+        :param start_time_ns: The start time of recording.
+        :param end_time_ns: The end time of recording.
+        :return: A protobuf Profile object.
+        """
+        converter, period = self._convert(events)
         return converter._build_profile(
             start_time_ns=start_time_ns,
-            duration_ns=duration_ns,
+            duration_ns=end_time_ns - start_time_ns,
+            period=period,
+            sample_types=_SAMPLE_TYPES,
+            program_name=self._get_program_name(),
+        )
+
+    def export_serialized(self, fileobj, events, start_time_ns, end_time_ns):
+        """Convert events to pprof format and write the serialized profile to a file object.
+
+        The profile is serialized as the one returned by :meth:`export` but without building the protobuf messages,
+        and it is written to the file object in chunks, e.g. to a `gzip.GzipFile`.
+
+        :param fileobj: The file object to write the profile to.
+        :param events: The event dictionary from a `ddtrace.profiling.recorder.Recorder`.
+        :param start_time_ns: The start time of recording.
+        :param end_time_ns: The end time of recording.
+        """
+        converter, period = self._convert(events)
+        converter._serialize_profile(
+            fileobj,
+            start_time_ns=start_time_ns,
+            duration_ns=end_time_ns - start_time_ns,
             period=period,
-            sample_types=sample_types,
-            program_name=program_name,
+            sample_types=_SAMPLE_TYPES,
+            program_name=self._get_program_name(),
         )
@@ -0,0 +1,610 @@
+# -*- encoding: utf-8 -*-
+"""Export the profiles from a helper process.
+
+With :class:`SidecarExporter`, the events recorded by an application process are sent in a raw form over a Unix
+socket to a helper process, which converts them to pprof and uploads them. The application process then only spends
+time sampling and encoding the events, rather than converting, compressing and uploading the profiles while holding
+the GIL.
+
+A single helper process runs per host and user, for a version of Python and of the library, since the events are
+encoded with :mod:`marshal`, and for an API key and endpoint. It is started with
+``python -m ddtrace.profiling.bootstrap.sidecar`` by the first exporter that cannot connect to it, and it stops once it
+has not received any profile for a while. It uploads the profiles with the API key of its environment, i.e. the one of
+the application processes that share it: the name of its socket depends on a digest of the API key and the endpoint.
+
+Only the processes of the same user exchange profiles: the socket is in a directory that only the user can access, and
+both ends of a connection check the user of the other one when the platform tells it.
+"""
+import errno
+import hashlib
+import logging
+import marshal
+import os
+import select
+import socket
+import stat
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import ddtrace
+from ddtrace import compat
+from ddtrace.internal import runtime
+from ddtrace.internal.runtime import container
+from ddtrace.profiling import _attr
+from ddtrace.profiling import exporter
+from ddtrace.profiling.collector import _traceback
+from ddtrace.profiling.collector import memalloc
+from ddtrace.profiling.collector import stack
+from ddtrace.profiling.collector import threading as threading_collector
+from ddtrace.profiling.exporter import http
+from ddtrace.vendor import attr
+from ddtrace.vendor.six.moves import queue
+
+
+LOG = logging.getLogger(__name__)
+
+# The version of the encoding of the profiles
+_PROTOCOL_VERSION = 1
+
+# The size of the profiles, sent before them
+_HEADER = struct.Struct(">I")
+
+# The credentials of the process at the other end of a Unix socket: its pid, uid and gid
+_PEERCRED = struct.Struct("3i")
+
+_EVENT_CLASSES = {
+    cls.__name__: cls
+    for cls in (
+        stack.StackSampleEvent,
+        stack.StackExceptionSampleEvent,
+        threading_collector.LockAcquireEvent,
+        threading_collector.LockReleaseEvent,
+        memalloc.MemoryAllocSampleEvent,
+        memalloc.MemoryHeapSampleEvent,
+    )
+}
+
+# The fields of the events that are sent as they are: the stacks are sent separately
+_EVENT_FIELDS = {
+    name: tuple(a.name for a in attr.fields(cls) if a.name not in ("_frames", "stack"))
+    for name, cls in _EVENT_CLASSES.items()
+}
+
+
+def is_supported():
+    """Return whether the profiles can be exported from a helper process on this platform."""
+    return hasattr(socket, "AF_UNIX") and hasattr(os, "fork")
+
+
+def default_socket_path(api_key=None, endpoint=None):
+    """Return the path of the socket of the helper process of the current user, Python and library versions.
+
+    The socket is in a directory of the runtime directory of the user if there is one, of the temporary directory
+    otherwise. Its name contains a digest of the API key and the endpoint, so that the processes uploading with
+    another API key or to another endpoint use another helper process.
+
+    :param api_key: The API key to upload the profiles with, if any.
+    :param endpoint: The endpoint to upload the profiles to, if any.
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        directory = os.path.join(runtime_dir, "ddtrace-profiling")
+    else:
+        directory = os.path.join(tempfile.gettempdir(), "ddtrace-profiling-%d" % os.getuid())
+    digest = hashlib.sha256(("%s\0%s" % (api_key or "", endpoint or "")).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(
+        directory,
+        "%s-py%d%d-%s.sock" % (ddtrace.__version__, sys.version_info[0], sys.version_info[1], digest),
+    )
+
+
+def _check_socket_directory(socket_path, create=False):
+    """Check that only the current user can access the directory of ``socket_path``.
+
+    :param socket_path: The path of the socket.
+    :param create: Whether to create the directory if it does not exist.
+    :raise OSError: If the directory does not exist or other users can access it.
+    """
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    if create:
+        try:
+            os.mkdir(directory, 0o700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise OSError(errno.EPERM, "Only the current user must be able to access the directory", directory)
+
+
+def _peer_uid(sock):
+    """Return the user id of the process at the other end of a Unix socket, or ``None`` if it cannot be known."""
+    so_peercred = getattr(socket, "SO_PEERCRED", None)
+    if so_peercred is None:
+        return None
+    _, uid, _ = _PEERCRED.unpack(sock.getsockopt(socket.SOL_SOCKET, so_peercred, _PEERCRED.size))
+    return uid
+
+
+def _check_peer(sock):
+    """Check that the process at the other end of a Unix socket runs as the current user.
+
+    :raise OSError: If it runs as another user.
+    """
+    uid = _peer_uid(sock)
+    if uid is not None and uid != os.getuid():
+        raise OSError(errno.EPERM, "The process at the other end of the socket runs as user %d" % uid)
+
+
+class _Encoder(object):
+    """Replace the stacks of the events by the indexes of their frames in a list of the frames of a profile."""
+
+    def __init__(self, stack_table):
+        self._stack_table = stack_table
+        self.frames = []
+        self._indexes = {}
+
+    def _index(self, frame):
+        index = self._indexes.get(frame)
+        if index is None:
+            index = self._indexes[frame] = len(self.frames)
+            self.frames.append(frame)
+        return index
+
+    def stack(self, stack_ids):
+        frame = self._stack_table.frame
+        return tuple([self._index(frame(frame_id)) for frame_id in stack_ids])
+
+    def event_stack(self, event):
+        if event.stack is not None:
+            return self.stack(event.stack)
+        return tuple([self._index(tuple(frame)) for frame in event.frames])
+
+
+def encode(events, start_time_ns, end_time_ns, context, stack_table=_traceback.stack_table):
+    """Encode the events of a recorder to send them to the helper process.
+
+    :param events: The event dictionary from a `ddtrace.profiling.recorder.Recorder`.
+    :param start_time_ns: The start time of recording.
+    :param end_time_ns: The end time of recording.
+    :param context: The settings to upload the profile with, see :meth:`SidecarExporter.get_context`.
+    :param stack_table: The stack table of the stacks of the events.
+    :return: The encoded events.
+    """
+    encoder = _Encoder(stack_table)
+
+    encoded_events = {}
+    for cls, class_events in events.items():
+        name = cls.__name__
+        if _EVENT_CLASSES.get(name) is not cls or not class_events:
+            continue
+        fields = _EVENT_FIELDS[name]
+        rows = []
+        for event in class_events:
+            row = [getattr(event, field) for field in fields]
+            if cls is stack.StackExceptionSampleEvent:
+                exc_type = event.exc_type
+                row[fields.index("exc_type")] = (exc_type.__module__, exc_type.__name__)
+            row.append(encoder.event_stack(event))
+            rows.append(tuple(row))
+        encoded_events[name] = (fields, rows)
+
+    aggregate = events.get(stack.StackSampleAggregate)
+    if aggregate is not None and aggregate.nsamples:
+        encoded_aggregate = (
+            [(key[:5] + (encoder.stack(key[5]), key[6]), values) for key, values in aggregate.samples.items()],
+            aggregate.nsamples,
+            aggregate.sampling_period_sum,
+        )
+    else:
+        encoded_aggregate = None
+
+    return marshal.dumps(
+        {
+            "version": _PROTOCOL_VERSION,
+            "context": context,
+            "start_time_ns": start_time_ns,
+            "end_time_ns": end_time_ns,
+            "frames": encoder.frames,
+            "events": encoded_events,
+            "stack_sample_aggregate": encoded_aggregate,
+        }
+    )
+
+
+_EXCEPTION_TYPES = {}
+
+
+def _exception_type(module, name):
+    # The exception types only need a module and a name to be exported
+    try:
+        return _EXCEPTION_TYPES[(module, name)]
+    except KeyError:
+        exc_type = _EXCEPTION_TYPES[(module, name)] = type(str(name), (Exception,), {"__module__": module})
+        return exc_type
+
+
+def decode(data, stack_table=_traceback.stack_table):
+    """Decode the events encoded by :func:`encode`.
+
+    :param data: The encoded events.
+    :param stack_table: The stack table to intern the frames of the events in.
+    :return: The context, the event dictionary, the start and end time of recording.
+    """
+    payload = marshal.loads(data)
+    if payload["version"] != _PROTOCOL_VERSION:
+        raise ValueError("Unsupported profile encoding version %r" % payload["version"])
+
+    stack_ids = stack_table.frames_to_stack(payload["frames"])
+
+    events = {}
+    for name, (fields, rows) in payload["events"].items():
+        cls = _EVENT_CLASSES[name]
+        # DEV: attrs strips the leading underscore of the arguments of the private attributes
+        arguments = tuple(field.lstrip("_") for field in fields)
+        class_events = events[cls] = []
+        for row in rows:
+            kwargs = dict(zip(arguments, row))
+            if cls is stack.StackExceptionSampleEvent:
+                kwargs["exc_type"] = _exception_type(*kwargs["exc_type"])
+            kwargs["stack"] = tuple([stack_ids[index] for index in row[-1]])
+            class_events.append(cls(**kwargs))
+
+    encoded_aggregate = payload["stack_sample_aggregate"]
+    if encoded_aggregate is not None:
+        samples, nsamples, sampling_period_sum = encoded_aggregate
+        events[stack.StackSampleAggregate] = stack.StackSampleAggregate(
+            samples={
+                key[:5] + (tuple([stack_ids[index] for index in key[5]]), key[6]): list(values)
+                for key, values in samples
+            },
+            nsamples=nsamples,
+            sampling_period_sum=sampling_period_sum,
+        )
+
+    return payload["context"], events, payload["start_time_ns"], payload["end_time_ns"]
+
+
+def start_helper(socket_path, timeout, api_key=None):
+    """Start the helper process listening on ``socket_path``.
+
+    :param socket_path: The path of the socket of the helper process.
+    :param timeout: The time to wait for the helper process to listen, in seconds.
+    :param api_key: The API key to upload the profiles with, if any.
+    """
+    env = os.environ.copy()
+    # Do not profile nor trace the helper process
+    env.pop("DD_PROFILING_ENABLED", None)
+    # DEV: The API key is never sent on the socket
+    if api_key:
+        env.pop("DD_PROFILING_API_KEY", None)
+        env["DD_API_KEY"] = api_key
+    ddtrace_dir = os.path.dirname(os.path.abspath(ddtrace.__file__))
+    bootstrap_dirs = (os.path.join(ddtrace_dir, "bootstrap"), os.path.join(ddtrace_dir, "profiling", "bootstrap"))
+    if "PYTHONPATH" in env:
+        env["PYTHONPATH"] = os.pathsep.join(
+            path for path in env["PYTHONPATH"].split(os.pathsep) if os.path.abspath(path) not in bootstrap_dirs
+        )
+
+    with open(os.devnull, "r+b") as devnull:
+        process = subprocess.Popen(
+            [sys.executable, "-m", "ddtrace.profiling.bootstrap.sidecar", socket_path],
+            env=env,
+            stdin=devnull,
+            stdout=devnull,
+            stderr=devnull,
+            close_fds=True,
+        )
+
+    # The process exits once the helper process it forked listens on the socket
+    deadline = compat.monotonic() + timeout
+    while process.poll() is None:
+        if compat.monotonic() > deadline:
+            process.kill()
+            process.wait()
+            raise exporter.ExportError("The profile exporter helper process did not start in time")
+        time.sleep(0.01)
+
+    if process.returncode != 0:
+        raise exporter.ExportError("The profile exporter helper process failed to start")
+
+
+@attr.s
+class SidecarExporter(exporter.Exporter):
+    """Export the events from the helper process.
+
+    The helper process converts the events to pprof and uploads them with the settings of ``upload_exporter``.
+    """
+
+    upload_exporter = attr.ib()
+    socket_path = attr.ib()
+    start_timeout = attr.ib(default=5.0)
+    _sock = attr.ib(init=False, default=None, repr=False, eq=False)
+
+    @socket_path.default
+    def _default_socket_path(self):
+        return default_socket_path(self.upload_exporter.api_key, self.upload_exporter.endpoint)
+
+    def get_context(self):
+        """Return the settings to upload the profiles with."""
+        exp = self.upload_exporter
+        return {
+            "endpoint": exp.endpoint,
+            "endpoint_path": exp.endpoint_path,
+            "timeout": exp.timeout,
+            "max_retry_delay": exp.max_retry_delay,
+            "service": exp.service,
+            "tags": exp.tags,
+            "container_id": exp._container_info.container_id if exp._container_info else None,
+            "runtime_id": runtime.get_runtime_id(),
+            "program_name": exp._get_program_name(),
+        }
+
+    def _send(self, message):
+        if self._sock is None:
+            _check_socket_directory(self.socket_path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.socket_path)
+                _check_peer(sock)
+            except Exception:
+                sock.close()
+                raise
+            self._sock = sock
+
+        try:
+            self._sock.sendall(message)
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        """Close the connection to the helper process."""
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def export(self, events, start_time_ns, end_time_ns):
+        """Send the events to the helper process, starting it if it is not running.
+
+        :param events: The event dictionary from a `ddtrace.profiling.recorder.Recorder`.
+        :param start_time_ns: The start time of recording.
+        :param end_time_ns: The end time of recording.
+        """
+        data = encode(events, start_time_ns, end_time_ns, self.get_context())
+        message = _HEADER.pack(len(data)) + data
+
+        try:
+            self._send(message)
+            return
+        except (IOError, OSError):
+            LOG.debug("Unable to send the profile to the exporter helper process, starting it", exc_info=True)
+
+        start_helper(self.socket_path, self.start_timeout, self.upload_exporter.api_key)
+        try:
+            self._send(message)
+        except (IOError, OSError) as e:
+            raise exporter.ExportError("Unable to send the profile to the exporter helper process: %s" % e)
+
+
+@attr.s
+class _ApplicationHTTPExporter(http.PprofHTTPExporter):
+    """Upload the profiles of an application process as it would."""
+
+    runtime_id = attr.ib(default=None)
+    program_name = attr.ib(default=None)
+
+    def _get_runtime_id(self):
+        return self.runtime_id
+
+    def _get_program_name(self, default="-"):
+        return self.program_name or default
+
+
+def _context_key(context):
+    return tuple(
+        sorted(
+            (key, tuple(sorted(value.items())) if isinstance(value, dict) else value) for key, value in context.items()
+        )
+    )
+
+
+@attr.s
+class SidecarServer(object):
+    """Receive the events of the application processes and export them.
+
+    The events are received on a Unix socket and exported by a thread, so that the events of other processes are
+    received meanwhile. The server stops once it has not received events for ``idle_timeout`` seconds.
+
+    The profiles are uploaded with the API key of the environment of the server.
+    """
+
+    socket_path = attr.ib()
+    api_key = attr.ib(factory=lambda: os.environ.get("DD_API_KEY"), repr=False)
+    idle_timeout = attr.ib(factory=_attr.from_env("DD_PROFILING_SIDECAR_IDLE_TIMEOUT", 600, float))
+    max_queued_profiles = attr.ib(default=64)
+    max_exporters = attr.ib(default=1024)
+    _sock = attr.ib(init=False, default=None, repr=False)
+    _queue = attr.ib(init=False, default=None, repr=False)
+    _exporters = attr.ib(init=False, factory=dict, repr=False)
+
+    def bind(self):
+        """Listen on the socket.
+
+        :raise socket.error: If another helper process is listening on the socket.
+        :raise OSError: If other users can access the directory of the socket.
+        """
+        _check_socket_directory(self.socket_path, create=True)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Only the current user can connect to the socket
+        umask = os.umask(0o177)
+        try:
+            try:
+                sock.bind(self.socket_path)
+            except socket.error as e:
+                if e.errno != errno.EADDRINUSE:
+                    raise
+                # The socket is stale if nothing accepts connections on it
+                probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    probe.connect(self.socket_path)
+                except socket.error:
+                    os.unlink(self.socket_path)
+                    sock.bind(self.socket_path)
+                else:
+                    raise
+                finally:
+                    probe.close()
+        except Exception:
+            sock.close()
+            raise
+        finally:
+            os.umask(umask)
+
+        sock.listen(128)
+        self._sock = sock
+
+    def _get_exporter(self, context):
+        key = _context_key(context)
+        try:
+            return self._exporters[key]
+        except KeyError:
+            if len(self._exporters) >= self.max_exporters:
+                self._exporters.clear()
+            exp = self._exporters[key] = _ApplicationHTTPExporter(
+                endpoint=context["endpoint"],
+                endpoint_path=context["endpoint_path"],
+                api_key=self.api_key,
+                timeout=context["timeout"],
+                max_retry_delay=context["max_retry_delay"],
+                service=context["service"],
+                container_info=container.CGroupInfo(container_id=context["container_id"]),
+                runtime_id=context["runtime_id"],
+                program_name=context["program_name"],
+            )
+            # The tags were computed by the application process
+            exp.tags = dict(context["tags"])
+            return exp
+
+    def export(self, data):
+        """Export encoded events.
+
+        :param data: The events encoded by :func:`encode`.
+        """
+        context, events, start_time_ns, end_time_ns = decode(data)
+        try:
+            self._get_exporter(context).export(events, start_time_ns, end_time_ns)
+        finally:
+            # The frames of the profile are not needed anymore once it is exported
+            _traceback.stack_table.rotate()
+
+    def _export_worker(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                return
+            try:
+                self.export(data)
+            except exporter.ExportError as e:
+                LOG.error("Unable to export profile: %s. Ignoring.", e)
+            except Exception:
+                LOG.error("Unexpected error while exporting profile", exc_info=True)
+
+    def _receive(self, conn, buf):
+        """Read the profiles sent on a connection and queue them.
+
+        :return: Whether the connection is still open.
+        """
+        data = conn.recv(65536)
+        if not data:
+            return False
+        buf.extend(data)
+        while len(buf) >= _HEADER.size:
+            (size,) = _HEADER.unpack_from(bytes(buf[: _HEADER.size]))
+            if len(buf) < _HEADER.size + size:
+                break
+            try:
+                self._queue.put_nowait(bytes(buf[_HEADER.size : _HEADER.size + size]))
+            except queue.Full:
+                LOG.warning("Too many profiles to export, dropping one")
+            del buf[: _HEADER.size + size]
+        return True
+
+    def serve(self):
+        """Receive and export the events until the server is idle."""
+        if self._sock is None:
+            self.bind()
+
+        self._queue = queue.Queue(self.max_queued_profiles)
+        worker = threading.Thread(target=self._export_worker, name="ddtrace-profiling-sidecar-exporter")
+        worker.start()
+
+        # The receive buffers of the connections
+        connections = {}
+        last_receive = compat.monotonic()
+        try:
+            while compat.monotonic() - last_receive < self.idle_timeout:
+                readable, _, _ = select.select([self._sock] + list(connections), [], [], 1)
+                for sock in readable:
+                    if sock is self._sock:
+                        conn, _ = sock.accept()
+                        try:
+                            _check_peer(conn)
+                        except (OSError, socket.error) as e:
+                            LOG.warning("Rejecting a connection: %s", e)
+                            conn.close()
+                        else:
+                            connections[conn] = bytearray()
+                        continue
+                    try:
+                        still_open = self._receive(sock, connections[sock])
+                    except socket.error:
+                        still_open = False
+                    if still_open:
+                        last_receive = compat.monotonic()
+                    else:
+                        del connections[sock]
+                        sock.close()
+        finally:
+            for conn in connections:
+                conn.close()
+            self.close()
+            self._queue.put(None)
+            worker.join()
+
+    def close(self):
+        """Stop listening on the socket."""
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+
+
+def main(argv):
+    """Run the helper process in the background.
+
+    :param argv: The command line arguments: the path of the socket to listen on.
+    """
+    server = SidecarServer(argv[0])
+    try:
+        server.bind()
+    except socket.error as e:
+        if e.errno == errno.EADDRINUSE:
+            # Another helper process is listening on the socket
+            return 0
+        raise
+
+    # Detach from the application process once the socket is listening
+    if os.fork():
+        os._exit(0)
+    os.setsid()
+
+    server.serve()
+    return 0
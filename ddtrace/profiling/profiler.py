@@ -22,7 +22,9 @@ from ddtrace.profiling.collector import stack
 from ddtrace.profiling.collector import threading
 from ddtrace.profiling.exporter import file
 from ddtrace.profiling.exporter import http
+from ddtrace.profiling.exporter import sidecar
 from ddtrace.utils import deprecation
+from ddtrace.utils import formats
 from ddtrace.vendor import attr
 
 
@@ -218,17 +220,22 @@ class _ProfilerInstance(_service.Service):
 
         endpoint = _get_default_url(tracer, api_key) if url is None else url
 
-        return [
-            http.PprofHTTPExporter(  # type: ignore[call-arg]
-                service=service,
-                env=env,
-                tags=tags,
-                version=version,
-                api_key=api_key,
-                endpoint=endpoint,
-                endpoint_path=endpoint_path,
-            ),
-        ]
+        http_exporter = http.PprofHTTPExporter(  # type: ignore[call-arg]
+            service=service,
+            env=env,
+            tags=tags,
+            version=version,
+            api_key=api_key,
+            endpoint=endpoint,
+            endpoint_path=endpoint_path,
+        )
+
+        if formats.asbool(os.environ.get("DD_PROFILING_EXPORT_SIDECAR", False)):
+            if sidecar.is_supported():
+                return [sidecar.SidecarExporter(upload_exporter=http_exporter)]  # type: ignore[call-arg]
+            LOG.warning("Exporting profiles from a helper process is not supported on this platform")
+
+        return [http_exporter]
 
     def __attrs_post_init__(self):
         r = self._recorder = recorder.Recorder(
@@ -19,6 +19,32 @@ class _defaultdictkey(dict):
         raise KeyError(key)
 
 
+@attr.s(slots=True, eq=False)
+class Aggregate(object):
+    """Samples folded on arrival, instead of being recorded one event each.
+
+    The samples with the same key are summed, so the memory used is proportional to the number of different keys
+    rather than to the number of samples.
+    """
+
+    samples = attr.ib(factory=dict, repr=False)
+    """A dict of {key: values} of the folded samples."""
+
+    nsamples = attr.ib(default=0)
+    """The number of samples folded."""
+
+    sampling_period_sum = attr.ib(default=0)
+    """The sum of the sampling periods of the samples folded."""
+
+    def add(self, samples, sampling_period):
+        """Fold samples in the aggregate.
+
+        :param samples: The sample list.
+        :param sampling_period: The sampling period of the samples.
+        """
+        raise NotImplementedError
+
+
 @attr.s(slots=True)
 class Recorder(object):
     """An object that records program activity."""
@@ -63,7 +89,21 @@ class Recorder(object):
                 q = self.events[event_type]
                 q.extend(events)
 
+    def push_samples(self, aggregate_type, samples, sampling_period):
+        """Fold samples in the aggregate of their type.
+
+        :param aggregate_type: The `Aggregate` class of the samples.
+        :param samples: The sample list, in the format expected by the `Aggregate.add` method of ``aggregate_type``.
+        :param sampling_period: The sampling period of the samples.
+        """
+        # NOTE: same as push_events, do not try to push samples if the current PID has changed
+        if samples and os.getpid() == self._pid:
+            with self._events_lock:
+                self.events[aggregate_type].add(samples, sampling_period)
+
     def _get_deque_for_event_type(self, event_type):
+        if issubclass(event_type, Aggregate):
+            return event_type()
         return collections.deque(maxlen=self.max_events.get(event_type, self.default_max_events))
 
     def _reset_events(self):
@@ -6,6 +6,7 @@ from ddtrace.profiling import _attr
 from ddtrace.profiling import _periodic
 from ddtrace.profiling import _traceback
 from ddtrace.profiling import exporter
+from ddtrace.profiling.collector import _traceback as collector_traceback
 from ddtrace.vendor import attr
 
 
@@ -19,6 +20,7 @@ class Scheduler(_periodic.PeriodicService):
     recorder = attr.ib()
     exporters = attr.ib()
     before_flush = attr.ib(default=None, eq=False)
+    stack_table = attr.ib(factory=lambda: collector_traceback.stack_table, eq=False, repr=False)
     _interval = attr.ib(factory=_attr.from_env("DD_PROFILING_UPLOAD_INTERVAL", 60, float))
     _configured_interval = attr.ib(init=False)
     _last_export = attr.ib(init=False, default=None, eq=False)
@@ -56,6 +58,9 @@ class Scheduler(_periodic.PeriodicService):
                         "Unexpected error while exporting events. "
                         "Please report this bug to https://github.com/DataDog/dd-trace-py/issues"
                     )
+            # The events of the next profile are recorded after the previous rotation, they only refer to frames used
+            # since then, which the table keeps
+            self.stack_table.rotate()
 
     def periodic(self):
         start_time = compat.monotonic()
@@ -47,6 +47,8 @@ class HTTPPropagator(object):
         """
         headers[HTTP_HEADER_TRACE_ID] = str(span_context.trace_id)
         headers[HTTP_HEADER_PARENT_ID] = str(span_context.span_id)
+        # The sampling decision is final once it is propagated
+        span_context._sample_deferred()
         sampling_priority = span_context.sampling_priority
         # Propagate priority only if defined
         if sampling_priority is not None:
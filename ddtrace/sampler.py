@@ -3,9 +3,13 @@
 Any `sampled = False` trace won't be written, and can be ignored by the instrumentation.
 """
 import abc
+import json
+import re
 
 from .compat import iteritems
+from .compat import lru_cache
 from .compat import pattern_type
+from .compat import string_type
 from .constants import ENV_KEY
 from .constants import SAMPLING_AGENT_DECISION
 from .constants import SAMPLING_LIMIT_DECISION
@@ -116,17 +120,20 @@ RateByServiceSampler._default_key = RateByServiceSampler._key()
 
 
 class DatadogSampler(BaseSampler, BasePrioritySampler):
-    __slots__ = ("default_sampler", "limiter", "rules")
+    __slots__ = ("default_sampler", "limiter", "_rules", "_matching_rules")
 
     NO_RATE_LIMIT = -1
     DEFAULT_RATE_LIMIT = 100
     DEFAULT_SAMPLE_RATE = None
+    # The number of (service, name) pairs for which the rules that can match are cached
+    MATCHING_RULES_CACHE_SIZE = 1024
 
     def __init__(self, rules=None, default_sample_rate=None, rate_limit=None):
         """
         Constructor for DatadogSampler sampler
 
-        :param rules: List of :class:`SamplingRule` rules to apply to the root span of every trace, default no rules
+        :param rules: List of :class:`SamplingRule` rules to apply to the root span of every trace, default the
+            rules configured with ``DD_TRACE_SAMPLING_RULES`` if any
         :type rules: :obj:`list` of :class:`SamplingRule`
         :param default_sample_rate: The default sample rate to apply if no rules matched (default: ``None`` /
             Use :class:`RateByServiceSampler` only)
@@ -150,9 +157,10 @@ class DatadogSampler(BaseSampler, BasePrioritySampler):
         if rate_limit is None:
             rate_limit = int(get_env("trace", "rate_limit", default=self.DEFAULT_RATE_LIMIT))
 
-        # Ensure rules is a list
-        if not rules:
-            rules = []
+        if rules is None:
+            # If no rules were provided explicitly in code, try to load them from environment variable
+            rules = get_env("trace", "sampling_rules")
+            rules = self._parse_rules(rules) if rules else []
 
         # Validate that the rules is a list of SampleRules
         for rule in rules:
@@ -168,6 +176,92 @@ class DatadogSampler(BaseSampler, BasePrioritySampler):
         if default_sample_rate is not None:
             self.default_sampler = SamplingRule(sample_rate=default_sample_rate)
 
+    @staticmethod
+    def _parse_rules(rules):
+        """Return the :class:`SamplingRule` described by a JSON list of objects.
+
+        Each object has a ``sample_rate`` and may have a ``service``, a ``name``, a ``resource``, and ``tags``
+        mapping tag names to values. The values are matched exactly, unless they end with ``*`` in which case
+        they match any value starting with the rest of them. Invalid rules are ignored.
+        """
+        try:
+            json_rules = json.loads(rules)
+        except ValueError:
+            log.error("Unable to parse DD_TRACE_SAMPLING_RULES=%r", rules, exc_info=True)
+            return []
+
+        if not isinstance(json_rules, list):
+            log.error("DD_TRACE_SAMPLING_RULES=%r must be a list of rules", rules)
+            return []
+
+        def pattern(value):
+            if isinstance(value, string_type) and value.endswith("*"):
+                return re.compile(re.escape(value[:-1]))
+            return value
+
+        sampling_rules = []
+        for rule in json_rules:
+            try:
+                sampling_rules.append(
+                    SamplingRule(
+                        sample_rate=float(rule["sample_rate"]),
+                        service=pattern(rule["service"]) if "service" in rule else SamplingRule.NO_RULE,
+                        name=pattern(rule["name"]) if "name" in rule else SamplingRule.NO_RULE,
+                        resource=pattern(rule["resource"]) if "resource" in rule else SamplingRule.NO_RULE,
+                        tags={key: pattern(value) for key, value in iteritems(rule.get("tags") or {})},
+                    )
+                )
+            except (AttributeError, KeyError, TypeError, ValueError):
+                log.error("Ignoring invalid sampling rule %r", rule, exc_info=True)
+        return sampling_rules
+
+    @property
+    def rules(self):
+        """The rules applied to the root span of every trace, in order.
+
+        The rules that can match a span are cached by service and name: assign a new list of rules
+        rather than modifying this one, or the rules themselves, in place.
+        """
+        return self._rules
+
+    @rules.setter
+    def rules(self, rules):
+        self._rules = rules
+        self._matching_rules = lru_cache(maxsize=self.MATCHING_RULES_CACHE_SIZE)(self._get_matching_rules)
+
+    def _get_matching_rules(self, service, name):
+        """Return the :class:`_MatchingRules` that can match a span with the given service and name.
+
+        The service and the name patterns of the rules are evaluated here once and the rules are skipped if they
+        do not match. The rules that only match on the service and the name of the span are known to match, the
+        list ends with the first of them that does.
+        """
+        matching_rules = []
+        depends_on_span = False
+        for rule in self._rules:
+            # DEV: Subclasses overriding `matches` may match on anything, they are applied when the root span starts
+            if getattr(type(rule), "matches", None) == SamplingRule.matches:
+                if rule._cacheable:
+                    if not rule._matches(service, name):
+                        continue
+                    if not rule._has_span_patterns:
+                        matching_rules.append((rule, None))
+                        break
+                    matching_rules.append((rule, rule._matches_span))
+                    depends_on_span = True
+                    continue
+                depends_on_span = depends_on_span or rule._has_span_patterns
+            matching_rules.append((rule, rule.matches))
+        return _MatchingRules(matching_rules, depends_on_span)
+
+    def _depends_on_span(self, span):
+        """Return whether the rules that can match ``span`` match on more than its service and its name."""
+        try:
+            rules = self._matching_rules(span.service, span.name)
+        except TypeError:
+            rules = self._get_matching_rules(span.service, span.name)
+        return rules.depends_on_span
+
     def update_rate_by_service_sample_rates(self, sample_rates):
         # Pass through the call to our RateByServiceSampler
         if isinstance(self.default_sampler, RateByServiceSampler):
@@ -191,10 +285,15 @@ class DatadogSampler(BaseSampler, BasePrioritySampler):
         """
         # If there are rules defined, then iterate through them and find one that wants to sample
         matching_rule = None
+        try:
+            rules = self._matching_rules(span.service, span.name)
+        except TypeError:
+            # The service or the name of the span cannot be hashed, do not cache anything
+            rules = self._get_matching_rules(span.service, span.name)
         # Go through all rules and grab the first one that matched
         # DEV: This means rules should be ordered by the user from most specific to least specific
-        for rule in self.rules:
-            if rule.matches(span):
+        for rule, matches in rules.candidates(span):
+            if matches is None or matches(span):
                 matching_rule = rule
                 break
         else:
@@ -234,16 +333,127 @@ class DatadogSampler(BaseSampler, BasePrioritySampler):
         return True
 
 
+class _MatchingRules(object):
+    """The sampling rules that can match the spans with a given service and name.
+
+    Each rule comes with the function telling whether it matches a span, or ``None`` if it is known to match.
+    The rules matching on an exact value or on a regular expression starting with literal characters, for the
+    resource or a tag, are indexed by that value or prefix so that only the rules which can match a span are
+    evaluated.
+    """
+
+    __slots__ = ("rules", "depends_on_span", "_unindexed", "_exact", "_prefixes")
+
+    def __init__(self, rules, depends_on_span=False):
+        self.rules = tuple(rules)
+        # Whether a rule matches on the resource or the tags of the span
+        self.depends_on_span = depends_on_span
+        # The positions of the rules that have to be evaluated against every span
+        self._unindexed = []
+        # The positions of the rules by exact value, and all of them, by property
+        self._exact = {}
+        # The positions of the rules by prefix, and the lengths of the prefixes, by property
+        self._prefixes = {}
+
+        for position, (rule, matches) in enumerate(self.rules):
+            key = rule._index_key() if matches is not None and matches == rule._matches_span else None
+            if key is None:
+                self._unindexed.append(position)
+                continue
+
+            prop, value, is_prefix = key
+            if is_prefix:
+                positions, lengths = self._prefixes.setdefault(prop, ({}, set()))
+                lengths.add(len(value))
+            else:
+                positions, all_positions = self._exact.setdefault(prop, ({}, []))
+                all_positions.append(position)
+            positions.setdefault(value, []).append(position)
+
+        self._prefixes = {
+            prop: (positions, sorted(lengths)) for prop, (positions, lengths) in iteritems(self._prefixes)
+        }
+
+    def candidates(self, span):
+        """Return the rules which can match ``span``, in order."""
+        if not self._exact and not self._prefixes:
+            return self.rules
+
+        positions = list(self._unindexed)
+        for prop, (values, all_positions) in iteritems(self._exact):
+            value = SamplingRule._get_property(span, prop)
+            if isinstance(value, string_type):
+                positions.extend(values.get(value, ()))
+            else:
+                # DEV: Only strings are known to be equal to the indexed values if and only if they have the same hash
+                positions.extend(all_positions)
+        for prop, (prefixes, lengths) in iteritems(self._prefixes):
+            # DEV: Same conversion as the regular expression patterns
+            value = str(SamplingRule._get_property(span, prop))
+            for length in lengths:
+                if length > len(value):
+                    break
+                positions.extend(prefixes.get(value[:length], ()))
+        positions.sort()
+
+        rules = self.rules
+        return [rules[position] for position in positions]
+
+
+# The characters with a special meaning in a regular expression
+_REGEX_SPECIAL_CHARACTERS = frozenset(".^$*+?{}[]\\|()")
+
+
+def _literal_prefix(pattern):
+    """Return the literal characters starting any string matched by the regular expression ``pattern``."""
+    source = pattern.pattern
+    if not isinstance(source, string_type) or pattern.flags & (re.IGNORECASE | re.VERBOSE) or "|" in source:
+        return ""
+
+    prefix = []
+    i = 1 if source.startswith("^") else 0
+    while i < len(source):
+        character = source[i]
+        if character == "\\":
+            character = source[i + 1 : i + 2]
+            # DEV: Escaped letters and digits are classes or references, e.g. `\d`
+            if not character or character.isalnum():
+                break
+            size = 2
+        elif character in _REGEX_SPECIAL_CHARACTERS:
+            break
+        else:
+            size = 1
+        # The character is optional if it is followed by one of these quantifiers
+        if source[i + size : i + size + 1] in ("*", "?", "{"):
+            break
+        prefix.append(character)
+        i += size
+    return "".join(prefix)
+
+
 class SamplingRule(BaseSampler):
     """
     Definition of a sampling rule used by :class:`DatadogSampler` for applying a sample rate on a span
     """
 
-    __slots__ = ("_sample_rate", "_sampling_id_threshold", "service", "name")
+    __slots__ = (
+        "_sample_rate",
+        "_sampling_id_threshold",
+        "_service",
+        "_name",
+        "_resource",
+        "_tags",
+        "_service_matcher",
+        "_name_matcher",
+        "_resource_matcher",
+        "_tag_matchers",
+        "_cacheable",
+    )
 
     NO_RULE = object()
 
-    def __init__(self, sample_rate, service=NO_RULE, name=NO_RULE):
+    def __init__(self, sample_rate, service=NO_RULE, name=NO_RULE, resource=NO_RULE, tags=None):
         """
         Configure a new :class:`SamplingRule`
 
@@ -261,14 +471,31 @@ class SamplingRule(BaseSampler):
 
                 # Sample based on service name using custom function
                 SamplingRule(sample_rate=0.75, service=lambda service: 'my-app' in service),
+
+                # Sample no health check traces based on the resource
+                SamplingRule(sample_rate=0, resource='GET /health'),
+
+                # Sample 10% of the traces of an endpoint based on a tag
+                SamplingRule(sample_rate=0.1, tags={'http.route': re.compile('^/api/v1/')}),
             ])
 
+        When a rule matching on the resource or the tags can apply to a trace, the trace is sampled once its root
+        span finishes, or once the trace is propagated to another service if that happens first, so that the rule
+        sees the resource and the tags set by the integrations and the global tags. The tags stored as metrics,
+        e.g. the numeric ones, are matched as numbers.
+
         :param sample_rate: The sample rate to apply to any matching spans
         :type sample_rate: :obj:`float` greater than or equal to 0.0 and less than or equal to 1.0
         :param service: Rule to match the `span.service` on, default no rule defined
         :type service: :obj:`object` to directly compare, :obj:`function` to evaluate, or :class:`re.Pattern` to match
         :param name: Rule to match the `span.name` on, default no rule defined
         :type name: :obj:`object` to directly compare, :obj:`function` to evaluate, or :class:`re.Pattern` to match
+        :param resource: Rule to match the `span.resource` on, default no rule defined
+        :type resource: :obj:`object` to directly compare, :obj:`function` to evaluate, or :class:`re.Pattern` to
+            match
+        :param tags: Rules to match the tags of the span on, by tag name, default no rule defined
+        :type tags: :obj:`dict` of :obj:`object` to directly compare, :obj:`function` to evaluate, or
+            :class:`re.Pattern` to match
         """
         # Enforce sample rate constraints
         if not 0.0 <= sample_rate <= 1.0:
@@ -279,6 +506,8 @@ class SamplingRule(BaseSampler):
         self.sample_rate = sample_rate
         self.service = service
         self.name = name
+        self.resource = resource
+        self.tags = tags or {}
 
     @property
     def sample_rate(self):
@@ -289,34 +518,139 @@ class SamplingRule(BaseSampler):
         self._sample_rate = sample_rate
         self._sampling_id_threshold = sample_rate * MAX_TRACE_ID
 
-    def _pattern_matches(self, prop, pattern):
+    @property
+    def service(self):
+        return self._service
+
+    @service.setter
+    def service(self, service):
+        self._service = service
+        self._service_matcher = self._compile(service)
+        self._update_cacheable()
+
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        self._name = name
+        self._name_matcher = self._compile(name)
+        self._update_cacheable()
+
+    @property
+    def resource(self):
+        return self._resource
+
+    @resource.setter
+    def resource(self, resource):
+        self._resource = resource
+        self._resource_matcher = self._compile(resource)
+
+    @property
+    def tags(self):
+        return self._tags
+
+    @tags.setter
+    def tags(self, tags):
+        self._tags = tags
+        # DEV: Sorted so that the rule is always indexed by the same tag
+        self._tag_matchers = tuple((key, self._compile(tags[key])) for key in sorted(tags))
+
+    @property
+    def _has_span_patterns(self):
+        # Whether the rule matches on more than the service and the name of the span
+        return self._resource_matcher is not None or bool(self._tag_matchers)
+
+    def _update_cacheable(self):
+        # Whether the rule only depends on the service and the name of the span, i.e. has no function as pattern
+        self._cacheable = not any(
+            callable(pattern) for pattern in (getattr(self, "_service", None), getattr(self, "_name", None))
+        )
+
+    def _compile(self, pattern):
+        """Return a function telling whether a span property matches ``pattern``, or ``None`` for no rule."""
         # If the rule is not set, then assume it matches
         # DEV: Having no rule and being `None` are different things
         #   e.g. ignoring `span.service` vs `span.service == None`
         if pattern is self.NO_RULE:
-            return True
+            return None
 
         # If the pattern is callable (e.g. a function) then call it passing the prop
         #   The expected return value is a boolean so cast the response in case it isn't
         if callable(pattern):
-            try:
-                return bool(pattern(prop))
-            except Exception:
-                log.warning("%r pattern %r failed with %r", self, pattern, prop, exc_info=True)
-                # Their function failed to validate, assume it is a False
-                return False
+
+            def matcher(prop):
+                try:
+                    return bool(pattern(prop))
+                except Exception:
+                    log.warning("%r pattern %r failed with %r", self, pattern, prop, exc_info=True)
+                    # Their function failed to validate, assume it is a False
+                    return False
+
+            return matcher
 
         # The pattern is a regular expression and the prop is a string
         if isinstance(pattern, pattern_type):
-            try:
-                return bool(pattern.match(str(prop)))
-            except (ValueError, TypeError):
-                # This is to guard us against the casting to a string (shouldn't happen, but still)
-                log.warning("%r pattern %r failed with %r", self, pattern, prop, exc_info=True)
-                return False
+            match = pattern.match
+
+            def matcher(prop):
+                try:
+                    return match(str(prop)) is not None
+                except (ValueError, TypeError):
+                    # This is to guard us against the casting to a string (shouldn't happen, but still)
+                    log.warning("%r pattern %r failed with %r", self, pattern, prop, exc_info=True)
+                    return False
+
+            return matcher
 
         # Exact match on the values
-        return prop == pattern
+        def matcher(prop):
+            return prop == pattern
+
+        return matcher
+
+    def _matches(self, service, name):
+        service_matcher = self._service_matcher
+        if service_matcher is not None and not service_matcher(service):
+            return False
+        name_matcher = self._name_matcher
+        return name_matcher is None or name_matcher(name)
+
+    @staticmethod
+    def _get_tag(span, key):
+        # The numeric tags are set as metrics
+        value = span.get_tag(key)
+        return span.get_metric(key) if value is None else value
+
+    @classmethod
+    def _get_property(cls, span, prop):
+        # The resource for `None`, the tag otherwise
+        return span.resource if prop is None else cls._get_tag(span, prop)
+
+    def _matches_span(self, span):
+        # Whether the resource and the tags of the span match, regardless of its service and name
+        resource_matcher = self._resource_matcher
+        if resource_matcher is not None and not resource_matcher(span.resource):
+            return False
+        for key, matcher in self._tag_matchers:
+            if not matcher(self._get_tag(span, key)):
+                return False
+        return True
+
+    def _index_key(self):
+        """Return the property, the value or prefix and whether it is a prefix to index the rule by, if any.
+
+        The property is ``None`` for the resource and the name of the tag otherwise.
+        """
+        for prop, pattern in [(None, self._resource)] + [(key, self._tags[key]) for key, _ in self._tag_matchers]:
+            if isinstance(pattern, string_type):
+                return prop, pattern, False
+            if isinstance(pattern, pattern_type):
+                prefix = _literal_prefix(pattern)
+                if prefix:
+                    return prop, prefix, True
+        return None
 
     def matches(self, span):
         """
@@ -327,13 +661,7 @@ class SamplingRule(BaseSampler):
         :returns: Whether this span matches or not
         :rtype: :obj:`bool`
         """
-        return all(
-            self._pattern_matches(prop, pattern)
-            for prop, pattern in [
-                (span.service, self.service),
-                (span.name, self.name),
-            ]
-        )
+        return self._matches(span.service, span.name) and self._matches_span(span)
 
     def sample(self, span):
         """
@@ -355,11 +683,13 @@ class SamplingRule(BaseSampler):
         return "NO_RULE" if val is self.NO_RULE else val
 
     def __repr__(self):
-        return "{}(sample_rate={!r}, service={!r}, name={!r})".format(
+        return "{}(sample_rate={!r}, service={!r}, name={!r}, resource={!r}, tags={!r})".format(
             self.__class__.__name__,
             self.sample_rate,
             self._no_rule_or_self(self.service),
             self._no_rule_or_self(self.name),
+            self._no_rule_or_self(self.resource),
+            self.tags,
         )
 
     __str__ = __repr__
@@ -79,6 +79,12 @@ class Config(object):
 
         self.health_metrics_enabled = asbool(get_env("trace", "health_metrics_enabled", default=False))
 
+        # Do not record the child spans of the traces rejected by the sampler, nor send the traces to the agent
+        self.drop_rejected_traces = asbool(get_env("trace", "drop_rejected_traces", default=False))
+
+        # Compute the trace metrics in the tracer, so that the traces rejected by the sampler need not be sent
+        self.compute_stats = asbool(get_env("trace", "compute_stats", default=False))
+
     def __getattr__(self, name):
         if name not in self._config:
             self._config[name] = IntegrationConfig(self, name)
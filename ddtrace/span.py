@@ -1,121 +1,25 @@
-import math
 import sys
 import traceback
-from typing import List
-from typing import Optional
 
 from .compat import StringIO
-from .compat import is_integer
 from .compat import iteritems
-from .compat import numeric_types
 from .compat import stringify
 from .compat import time_ns
 from .constants import MANUAL_DROP_KEY
 from .constants import MANUAL_KEEP_KEY
-from .constants import NUMERIC_TAGS
-from .constants import SERVICE_KEY
-from .constants import SERVICE_VERSION_KEY
-from .constants import SPAN_MEASURED_KEY
-from .constants import VERSION_KEY
 from .ext import SpanTypes
 from .ext import errors
-from .ext import http
-from .ext import net
-from .ext import priority
-from .internal import _rand
+from .internal._span import SpanBase
 from .internal.logger import get_logger
-from .vendor import six
 
 
 log = get_logger(__name__)
 
 
-class Span(object):
-
-    __slots__ = [
-        # Public span attributes
-        "service",
-        "name",
-        "resource",
-        "span_id",
-        "trace_id",
-        "parent_id",
-        "meta",
-        "error",
-        "metrics",
-        "_span_type",
-        "start_ns",
-        "duration_ns",
-        "tracer",
-        # Sampler attributes
-        "sampled",
-        # Internal attributes
-        "_context",
-        "_parent",
-        "_ignored_exceptions",
-        "__weakref__",
-    ]
-
-    def __init__(
-        self,
-        tracer,
-        name,
-        service=None,
-        resource=None,
-        span_type=None,
-        trace_id=None,
-        span_id=None,
-        parent_id=None,
-        start=None,
-        context=None,
-        _check_pid=True,
-    ):
-        """
-        Create a new span. Call `finish` once the traced operation is over.
-
-        :param ddtrace.Tracer tracer: the tracer that will submit this span when
-            finished.
-        :param str name: the name of the traced operation.
-
-        :param str service: the service name
-        :param str resource: the resource name
-        :param str span_type: the span type
-
-        :param int trace_id: the id of this trace's root span.
-        :param int parent_id: the id of this span's direct parent span.
-        :param int span_id: the id of this span.
-
-        :param int start: the start time of request as a unix epoch in seconds
-        :param object context: the Context of the span.
-        """
-        # required span info
-        self.name = name
-        self.service = service
-        self.resource = resource or name
-        self._span_type = None
-        self.span_type = span_type
-
-        # tags / metadata
-        self.meta = {}
-        self.error = 0
-        self.metrics = {}
-
-        # timing
-        self.start_ns = time_ns() if start is None else int(start * 1e9)
-        self.duration_ns = None
-
-        # tracing
-        self.trace_id = trace_id or _rand.rand64bits(check_pid=_check_pid)
-        self.span_id = span_id or _rand.rand64bits(check_pid=_check_pid)
-        self.parent_id = parent_id
-        self.tracer = tracer
+class Span(SpanBase):
 
-        # sampling
-        self.sampled = True
-
-        self._context = context
-        self._parent = None
-        self._ignored_exceptions = None  # type: Optional[List[Exception]]
+    # DEV: The attributes of the span are declared by `SpanBase`
+    __slots__ = ()
 
     def _ignore_exception(self, exc):
         # type: (Exception) -> None
@@ -168,107 +72,6 @@ class Span(object):
     def duration(self, value):
         self.duration_ns = value * 1e9
 
-    def finish(self, finish_time=None):
-        """Mark the end time of the span and submit it to the tracer.
-        If the span has already been finished don't do anything
-
-        :param int finish_time: The end time of the span in seconds.
-                                Defaults to now.
-        """
-        if self.finished:
-            return
-
-        if self.duration_ns is None:
-            ft = time_ns() if finish_time is None else int(finish_time * 1e9)
-            # be defensive so we don't die if start isn't set
-            self.duration_ns = ft - (self.start_ns or ft)
-
-        if self._context:
-            trace, sampled = self._context.close_span(self)
-            if self.tracer and trace and sampled:
-                self.tracer.write(trace)
-
-    def set_tag(self, key, value=None):
-        """Set a tag key/value pair on the span.
-
-        Keys must be strings, values must be ``stringify``-able.
-
-        :param key: Key to use for the tag
-        :type key: str
-        :param value: Value to assign for the tag
-        :type value: ``stringify``-able value
-        """
-
-        if not isinstance(key, six.string_types):
-            log.warning("Ignoring tag pair %s:%s. Key must be a string.", key, value)
-            return
-
-        # Special case, force `http.status_code` as a string
-        # DEV: `http.status_code` *has* to be in `meta` for metrics
-        #   calculated in the trace agent
-        if key == http.STATUS_CODE:
-            value = str(value)
-
-        # Determine once up front
-        val_is_an_int = is_integer(value)
-
-        # Explicitly try to convert expected integers to `int`
-        # DEV: Some integrations parse these values from strings, but don't call `int(value)` themselves
-        INT_TYPES = (net.TARGET_PORT,)
-        if key in INT_TYPES and not val_is_an_int:
-            try:
-                value = int(value)
-                val_is_an_int = True
-            except (ValueError, TypeError):
-                pass
-
-        # Set integers that are less than equal to 2^53 as metrics
-        if val_is_an_int and abs(value) <= 2 ** 53:
-            self.set_metric(key, value)
-            return
-
-        # All floats should be set as a metric
-        elif isinstance(value, float):
-            self.set_metric(key, value)
-            return
-
-        # Key should explicitly be converted to a float if needed
-        elif key in NUMERIC_TAGS:
-            try:
-                # DEV: `set_metric` will try to cast to `float()` for us
-                self.set_metric(key, value)
-            except (TypeError, ValueError):
-                log.warning("error setting numeric metric %s:%s", key, value)
-
-            return
-
-        elif key == MANUAL_KEEP_KEY:
-            self.context.sampling_priority = priority.USER_KEEP
-            return
-        elif key == MANUAL_DROP_KEY:
-            self.context.sampling_priority = priority.USER_REJECT
-            return
-        elif key == SERVICE_KEY:
-            self.service = value
-        elif key == SERVICE_VERSION_KEY:
-            # Also set the `version` tag to the same value
-            # DEV: Note that we do no return, we want to set both
-            self.set_tag(VERSION_KEY, value)
-        elif key == SPAN_MEASURED_KEY:
-            # Set `_dd.measured` tag as a metric
-            # DEV: `set_metric` will ensure it is an integer 0 or 1
-            if value is None:
-                value = 1
-            self.set_metric(key, value)
-            return
-
-        try:
-            self.meta[key] = stringify(value)
-            if key in self.metrics:
-                del self.metrics[key]
-        except Exception:
-            log.warning("error setting tag %s, ignoring it", key, exc_info=True)
-
     def _set_str_tag(self, key, value):
         # (str, str) -> None
         self.meta[key] = stringify(value)
@@ -295,38 +98,6 @@ class Span(object):
     def set_metas(self, kvs):
         self.set_tags(kvs)
 
-    def set_metric(self, key, value):
-        # This method sets a numeric tag value for the given key. It acts
-        # like `set_meta()` and it simply add a tag without further processing.
-
-        # Enforce a specific connstant for `_dd.measured`
-        if key == SPAN_MEASURED_KEY:
-            try:
-                value = int(bool(value))
-            except (ValueError, TypeError):
-                log.warning("failed to convert %r tag to an integer from %r", key, value)
-                return
-
-        # FIXME[matt] we could push this check to serialization time as well.
-        # only permit types that are commonly serializable (don't use
-        # isinstance so that we convert unserializable types like numpy
-        # numbers)
-        if type(value) not in numeric_types:
-            try:
-                value = float(value)
-            except (ValueError, TypeError):
-                log.debug("ignoring not number metric %s:%s", key, value)
-                return
-
-        # don't allow nan or inf
-        if math.isnan(value) or math.isinf(value):
-            log.debug("ignoring not real metric %s:%s", key, value)
-            return
-
-        if key in self.meta:
-            del self.meta[key]
-        self.metrics[key] = value
-
     def set_metrics(self, metrics):
         if metrics:
             for k, v in iteritems(metrics):
@@ -383,7 +154,7 @@ class Span(object):
             self.meta[errors.ERROR_STACK] = tb
 
     def set_exc_info(self, exc_type, exc_val, exc_tb):
-        """ Tag the span with an error tuple as from `sys.exc_info()`. """
+        """Tag the span with an error tuple as from `sys.exc_info()`."""
         if not (exc_type and exc_val and exc_tb):
             return  # nothing to do
 
@@ -405,14 +176,14 @@ class Span(object):
         self.meta[errors.ERROR_STACK] = tb
 
     def _remove_exc_info(self):
-        """ Remove all exception related information from the span. """
+        """Remove all exception related information from the span."""
         self.error = 0
         self._remove_tag(errors.ERROR_MSG)
         self._remove_tag(errors.ERROR_TYPE)
         self._remove_tag(errors.ERROR_STACK)
 
     def pprint(self):
-        """ Return a human readable version of the span. """
+        """Return a human readable version of the span."""
         lines = [
             ("name", self.name),
             ("id", self.span_id),
@@ -458,3 +229,44 @@ class Span(object):
             self.parent_id,
             self.name,
         )
+
+
+class _NoopSpan(Span):
+    """A span of a trace that is dropped.
+
+    It is part of the context of the trace so that the trace is propagated and the parent of the following spans
+    is still correct, but it does not record any tag. The tags changing the sampling decision of the trace still
+    apply.
+    """
+
+    __slots__ = ()
+
+    def set_tag(self, key, value=None):
+        if key == MANUAL_KEEP_KEY or key == MANUAL_DROP_KEY:
+            super(_NoopSpan, self).set_tag(key, value)
+
+    def set_tags(self, tags):
+        for key in (MANUAL_KEEP_KEY, MANUAL_DROP_KEY):
+            if key in tags:
+                self.set_tag(key, tags[key])
+
+    def _set_str_tag(self, key, value):
+        pass
+
+    def set_meta(self, k, v):
+        pass
+
+    def set_metas(self, kvs):
+        pass
+
+    def set_metric(self, key, value):
+        pass
+
+    def set_metrics(self, metrics):
+        pass
+
+    def set_traceback(self, limit=20):
+        pass
+
+    def set_exc_info(self, exc_type, exc_val, exc_tb):
+        pass
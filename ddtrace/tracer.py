@@ -10,7 +10,11 @@ from . import compat
 from .constants import ENV_KEY
 from .constants import FILTERS_KEY
 from .constants import HOSTNAME_KEY
+from .constants import MANUAL_DROP_KEY
+from .constants import MANUAL_KEEP_KEY
 from .constants import SAMPLE_RATE_METRIC_KEY
+from .constants import SAMPLING_PRIORITY_KEY
+from .constants import SERVICE_KEY
 from .constants import VERSION_KEY
 from .context import Context
 from .ext import system
@@ -25,6 +29,7 @@ from .internal.logger import get_logger
 from .internal.logger import hasHandlers
 from .internal.runtime import RuntimeWorker
 from .internal.runtime import get_runtime_id
+from .internal.stats import StatsWriter
 from .internal.writer import AgentWriter
 from .internal.writer import LogWriter
 from .provider import DefaultContextProvider
@@ -33,9 +38,11 @@ from .sampler import RateByServiceSampler
 from .sampler import RateSampler
 from .settings import config
 from .span import Span
+from .span import _NoopSpan
 from .utils.deprecation import deprecated
 from .utils.formats import asbool
 from .utils.formats import get_env
+from .vendor import attr
 
 
 log = get_logger(__name__)
@@ -55,6 +62,24 @@ if debug_mode and not hasHandlers(log):
 
 _INTERNAL_APPLICATION_SPAN_TYPES = {"custom", "template", "web", "worker"}
 
+# The header telling the agent that the tracer computes the metrics of the traces it sends
+_CLIENT_COMPUTED_STATS_HEADER = "Datadog-Client-Computed-Stats"
+
+# The tags which, when set on a span, also modify something else than the span tags
+_SIDE_EFFECT_TAGS = frozenset((MANUAL_DROP_KEY, MANUAL_KEEP_KEY, SERVICE_KEY))
+
+
+@attr.s(slots=True)
+class _SpanDefaults(object):
+    """The decisions made by a tracer once per trace for the child spans of the trace."""
+
+    tracer = attr.ib()
+    # The tags and metrics of the child spans, from the global tags and the environment
+    meta = attr.ib(type=dict)
+    metrics = attr.ib(type=dict)
+    # The mapped service and version tag of the child spans, by service
+    services = attr.ib(init=False, factory=dict)
+
 
 class Tracer(object):
     """
@@ -80,6 +105,7 @@ class Tracer(object):
         self.sampler = None
         self.priority_sampler = None
         self._runtime_worker = None
+        self._stats_writer = None
         self._filters = []
 
         configure_kwargs = {}
@@ -296,6 +322,8 @@ class Tracer(object):
         elif self.writer:
             self.writer.dogstatsd = get_dogstatsd_client(self._dogstatsd_url)
 
+        self._configure_stats_writer()
+
         if context_provider is not None:
             self.context_provider = context_provider
 
@@ -370,6 +398,19 @@ class Tracer(object):
             context = Context()
             parent = None
 
+        if parent:
+            if context._drop_rejected:
+                sampling_priority = context._sampling_priority
+                if sampling_priority is not None and sampling_priority <= 0:
+                    return self._start_dropped_span(context, parent, name, service, resource, span_type)
+
+            # The trace of a local parent span has already been sampled and its service decided
+            defaults = context._span_defaults
+            if defaults is None or defaults.tracer is not self:
+                defaults = context._span_defaults = self._span_defaults()
+            if defaults is not None:
+                return self._start_child_span(defaults, context, parent, name, service, resource, span_type)
+
         if parent:
             trace_id = parent.trace_id
             parent_span_id = parent.span_id
@@ -428,37 +469,27 @@ class Tracer(object):
             if self._runtime_worker and self._is_span_internal(span):
                 span.meta["language"] = "python"
 
-            span.sampled = self.sampler.sample(span)
-            # Old behavior
-            # DEV: The new sampler sets metrics and priority sampling on the span for us
-            if not isinstance(self.sampler, DatadogSampler):
-                if span.sampled:
-                    # When doing client sampling in the client, keep the sample rate so that we can
-                    # scale up statistics in the next steps of the pipeline.
-                    if isinstance(self.sampler, RateSampler):
-                        span.set_metric(SAMPLE_RATE_METRIC_KEY, self.sampler.sample_rate)
-
-                    if self.priority_sampler:
-                        # At this stage, it's important to have the service set. If unset,
-                        # priority sampler will use the default sampling rate, which might
-                        # lead to oversampling (that is, dropping too many traces).
-                        if self.priority_sampler.sample(span):
-                            context.sampling_priority = AUTO_KEEP
-                        else:
-                            context.sampling_priority = AUTO_REJECT
-                else:
-                    if self.priority_sampler:
-                        # If dropped by the local sampler, distributed instrumentation can drop it too.
-                        context.sampling_priority = AUTO_REJECT
-            else:
-                context.sampling_priority = AUTO_KEEP if span.sampled else AUTO_REJECT
-                # We must always mark the span as sampled so it is forwarded to the agent
-                span.sampled = True
-
         # Apply default global tags.
+        # DEV: Before sampling the root span of a new trace, the sampling rules may match on them
         if self.tags:
             span.set_tags(self.tags)
 
+        # The global tags may have kept or dropped the trace already
+        if not trace_id and MANUAL_KEEP_KEY not in self.tags and MANUAL_DROP_KEY not in self.tags:
+            if isinstance(self.sampler, DatadogSampler) and self.sampler._depends_on_span(span):
+                # Apply the rules matching on the resource or the tags of the root span when they are known: once it
+                # finishes, or once the trace is propagated
+                context._sampling_deferred = True
+            else:
+                self._sample(span, context)
+
+        # Drop the traces rejected by the sampler, or upstream, instead of forwarding them to the agent
+        # DEV: The decision is made when the trace is flushed, on its final sampling priority. The child spans started
+        #      while the trace is rejected are not recorded, see `_start_dropped_span`
+        # DEV: Not when the tracer computes the trace metrics, which need all the spans
+        if parent is None and config.drop_rejected_traces and self._stats_writer is None:
+            context._drop_rejected = True
+
         if config.env:
             span._set_str_tag(ENV_KEY, config.env)
 
@@ -479,23 +510,173 @@ class Tracer(object):
 
         # update set of services handled by tracer
         if service and service not in self._services and self._is_span_internal(span):
-            self._services.add(service)
-
-            # The constant tags for the dogstatsd client needs to updated with any new
-            # service(s) that may have been added.
-            if self._runtime_worker:
-                self._runtime_worker.update_runtime_tags()
+            self._add_service(service)
 
         self._hooks.emit(self.__class__.start_span, span)
 
         return span
 
+    def _sample(self, span, context):
+        """Decide whether to keep the trace of the root ``span``, and set its sampling priority on ``context``."""
+        span.sampled = self.sampler.sample(span)
+        # Old behavior
+        # DEV: The new sampler sets metrics and priority sampling on the span for us
+        if not isinstance(self.sampler, DatadogSampler):
+            if span.sampled:
+                # When doing client sampling in the client, keep the sample rate so that we can
+                # scale up statistics in the next steps of the pipeline.
+                if isinstance(self.sampler, RateSampler):
+                    span.set_metric(SAMPLE_RATE_METRIC_KEY, self.sampler.sample_rate)
+
+                if self.priority_sampler:
+                    # At this stage, it's important to have the service set. If unset,
+                    # priority sampler will use the default sampling rate, which might
+                    # lead to oversampling (that is, dropping too many traces).
+                    if self.priority_sampler.sample(span):
+                        context.sampling_priority = AUTO_KEEP
+                    else:
+                        context.sampling_priority = AUTO_REJECT
+            else:
+                if self.priority_sampler:
+                    # If dropped by the local sampler, distributed instrumentation can drop it too.
+                    context.sampling_priority = AUTO_REJECT
+        else:
+            context.sampling_priority = AUTO_KEEP if span.sampled else AUTO_REJECT
+            # We must always mark the span as sampled so it is forwarded to the agent
+            span.sampled = True
+
+    def _start_child_span(self, defaults, context, parent, name, service, resource, span_type):
+        """Start a span that is the child of the local ``parent`` span.
+
+        This is the same as ``start_span`` but all the decisions that only depend on the trace or on the service are
+        taken from ``defaults``.
+        """
+        if service is None:
+            service = parent.service
+
+        service_defaults = defaults.services.get(service)
+        if service_defaults is None:
+            service_defaults = defaults.services[service] = self._service_defaults(context, service)
+        mapped_service, version = service_defaults
+
+        span = Span(
+            self,
+            name,
+            trace_id=parent.trace_id,
+            parent_id=parent.span_id,
+            service=mapped_service,
+            resource=resource,
+            span_type=span_type,
+            _check_pid=False,
+        )
+        span.sampled = parent.sampled
+        span._parent = parent
+
+        if defaults.meta:
+            span.meta.update(defaults.meta)
+        if defaults.metrics:
+            span.metrics.update(defaults.metrics)
+        if version is not None:
+            span.meta[VERSION_KEY] = version
+
+        context.add_span(span)
+
+        if service and service not in self._services and self._is_span_internal(span):
+            self._add_service(service)
+
+        if self._hooks._hooks:
+            self._hooks.emit(self.__class__.start_span, span)
+
+        return span
+
+    def _start_dropped_span(self, context, parent, name, service, resource, span_type):
+        """Start a span that is the child of the local ``parent`` span of a dropped trace.
+
+        The span is a :class:`ddtrace.span._NoopSpan`: it is added to the context so that the trace is still
+        propagated, but it does not record any tag. The trace is not sent unless its sampling decision changes, e.g.
+        with the manual keep tag.
+        """
+        span = _NoopSpan(
+            self,
+            name,
+            trace_id=parent.trace_id,
+            parent_id=parent.span_id,
+            service=parent.service if service is None else service,
+            resource=resource,
+            span_type=span_type,
+            _check_pid=False,
+        )
+        span.sampled = False
+        span._parent = parent
+        context.add_span(span)
+
+        if self._hooks._hooks:
+            self._hooks.emit(self.__class__.start_span, span)
+
+        return span
+
+    def _span_defaults(self):
+        """Return the tags of the child spans of a trace, or ``None`` if they must be computed for each span."""
+        if not _SIDE_EFFECT_TAGS.isdisjoint(self.tags):
+            return None
+
+        # Apply the default global tags like `start_span` does
+        span = Span(None, None, trace_id=1, span_id=1, _check_pid=False)
+        if self.tags:
+            span.set_tags(self.tags)
+        if config.env:
+            span._set_str_tag(ENV_KEY, config.env)
+        return _SpanDefaults(self, span.meta, span.metrics)
+
+    def _service_defaults(self, context, service):
+        """Return the mapped service and the version tag of the child spans of the trace with the given service."""
+        version = None
+        # Only set the version tag on internal spans, see `start_span`
+        if config.version:
+            root_span = context.get_current_root_span()
+            if (root_span is None and service == config.service) or (
+                root_span and root_span.service == service and VERSION_KEY in root_span.meta
+            ):
+                version = compat.stringify(config.version)
+        return config.service_mapping.get(service, service), version
+
+    def _add_service(self, service):
+        self._services.add(service)
+
+        # The constant tags for the dogstatsd client needs to updated with any new
+        # service(s) that may have been added.
+        if self._runtime_worker:
+            self._runtime_worker.update_runtime_tags()
+
     def _start_runtime_worker(self):
         if not self._dogstatsd_url:
             return
 
         self._runtime_worker = RuntimeWorker(self._dogstatsd_url)
 
+    def _configure_stats_writer(self):
+        """Compute the trace metrics in the tracer if enabled and the traces are sent to the agent."""
+        if not (config.compute_stats and isinstance(self.writer, AgentWriter)):
+            if self._stats_writer is not None:
+                self._stats_writer.stop()
+                self._stats_writer = None
+                if isinstance(self.writer, AgentWriter):
+                    self.writer._headers.pop(_CLIENT_COMPUTED_STATS_HEADER, None)
+            return
+
+        if config.drop_rejected_traces:
+            log.warning(
+                "DD_TRACE_DROP_REJECTED_TRACES is ignored when the trace metrics are computed by the tracer, "
+                "the rejected traces are dropped once their metrics are computed"
+            )
+
+        if self._stats_writer is None or self._stats_writer.agent_url != self.writer.agent_url:
+            if self._stats_writer is not None:
+                self._stats_writer.stop()
+            self._stats_writer = StatsWriter(self.writer.agent_url)
+        # Tell the agent not to compute the metrics of the traces sent again
+        self.writer._headers[_CLIENT_COMPUTED_STATS_HEADER] = "yes"
+
     def _check_new_process(self):
         """Checks if the tracer is in a new process (was forked) and performs
         the necessary updates if it is a new process
@@ -514,8 +695,6 @@ class Tracer(object):
         # The spans remaining in the context can not and will not be finished
         # in this new process. So we need to copy out the trace metadata needed
         # to continue the trace.
-        # Also, note that because we're in a forked process, the lock that the
-        # context has might be permanently locked so we can't use ctx.clone().
         new_ctx = Context(
             sampling_priority=ctx._sampling_priority,
             span_id=ctx._parent_span_id,
@@ -532,6 +711,8 @@ class Tracer(object):
 
         # Re-create the background writer thread
         self.writer = self.writer.recreate()
+        if self._stats_writer is not None:
+            self._stats_writer = self._stats_writer.recreate()
 
         return new_ctx
 
@@ -651,6 +832,24 @@ class Tracer(object):
                     if not spans:
                         return
 
+            stats_writer = self._stats_writer
+            if stats_writer is not None:
+                if stats_writer.enabled:
+                    stats_writer.write(spans)
+                    # The agent does not need the traces rejected by the sampler once it accepts their metrics
+                    if stats_writer.accepted:
+                        root = spans[0]
+                        sampling_priority = root.get_metric(SAMPLING_PRIORITY_KEY)
+                        if sampling_priority is None and root.context is not None:
+                            # DEV: Only the root span has the sampling priority, not the other spans of a partial
+                            #      flush
+                            sampling_priority = root.context.sampling_priority
+                        if sampling_priority is not None and sampling_priority <= 0:
+                            return
+                else:
+                    # The agent does not support the metrics computed by the tracer, it must compute them again
+                    self.writer._headers.pop(_CLIENT_COMPUTED_STATS_HEADER, None)
+
             self.writer.write(spans=spans)
 
     @deprecated(message="Manually setting service info is no longer necessary", version="1.0.0")
@@ -765,6 +964,8 @@ class Tracer(object):
         :type timeout: :obj:`int` | :obj:`float` | :obj:`None`
         """
         self.writer.stop(timeout=timeout)
+        if self._stats_writer is not None:
+            self._stats_writer.stop(timeout=timeout)
         if self._runtime_worker:
             self._shutdown_runtime_worker()
 
@@ -791,4 +992,5 @@ class Tracer(object):
 
     @staticmethod
     def _is_span_internal(span):
-        return not span.span_type or span.span_type in _INTERNAL_APPLICATION_SPAN_TYPES
+        span_type = span.span_type
+        return not span_type or span_type in _INTERNAL_APPLICATION_SPAN_TYPES
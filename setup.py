@@ -207,6 +207,21 @@ setup(
                     sources=["ddtrace/internal/_rand.pyx"],
                     language="c",
                 ),
+                Cython.Distutils.Extension(
+                    "ddtrace.internal._context",
+                    sources=["ddtrace/internal/_context.pyx"],
+                    language="c",
+                ),
+                Cython.Distutils.Extension(
+                    "ddtrace.internal._rate_limiter",
+                    sources=["ddtrace/internal/_rate_limiter.pyx"],
+                    language="c",
+                ),
+                Cython.Distutils.Extension(
+                    "ddtrace.internal._span",
+                    sources=["ddtrace/internal/_span.pyx"],
+                    language="c",
+                ),
                 Extension(
                     "ddtrace.internal._encoding",
                     ["ddtrace/internal/_encoding.pyx"],
@@ -17,6 +17,7 @@ from ddtrace.constants import SPAN_MEASURED_KEY
 from ddtrace.encoding import JSONEncoder
 from ddtrace.ext import http
 from ddtrace.internal._encoding import MsgpackEncoder
+from ddtrace.internal._span import SpanBase
 from ddtrace.internal.dogstatsd import get_dogstatsd_client
 from ddtrace.internal.writer import AgentWriter
 from ddtrace.vendor import wrapt
@@ -84,6 +85,8 @@ def override_global_config(values):
         "analytics_enabled",
         "report_hostname",
         "health_metrics_enabled",
+        "drop_rejected_traces",
+        "compute_stats",
         "env",
         "version",
         "service",
@@ -466,6 +469,9 @@ class DummyTracer(Tracer):
         self._update_writer()
 
 
+_SPAN_BASE_ATTRIBUTES = frozenset(key for key in vars(SpanBase) if not key.startswith("__"))
+
+
 class TestSpan(Span):
     """
     Test wrapper for a :class:`ddtrace.span.Span` that provides additional functions and assertions
@@ -495,6 +501,15 @@ class TestSpan(Span):
         # DEV: Use `object.__setattr__` to by-pass this class's `__setattr__`
         object.__setattr__(self, "_span", span)
 
+    def __getattribute__(self, key):
+        """
+        Look up the attributes and methods of the compiled span core on the base :class:`ddtrace.span.Span`
+        """
+        # DEV: They are always defined on this object too, so `__getattr__` is never called for them
+        if key in _SPAN_BASE_ATTRIBUTES:
+            return getattr(object.__getattribute__(self, "_span"), key)
+        return object.__getattribute__(self, key)
+
     def __getattr__(self, key):
         """
         First look for property on the base :class:`ddtrace.span.Span` otherwise return this object's attribute
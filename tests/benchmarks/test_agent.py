@@ -0,0 +1,81 @@
+import threading
+
+import pytest
+
+from ddtrace.compat import get_connection_response
+from ddtrace.internal import agent
+from ddtrace.vendor.six.moves import BaseHTTPServer
+from ddtrace.vendor.six.moves import socketserver
+
+
+PAYLOAD = b"x" * 20000
+
+
+class _AgentRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Like the agent, do not delay small writes on keep-alive connections
+    disable_nagle_algorithm = True
+
+    @staticmethod
+    def log_message(format, *args):  # noqa: A002
+        pass
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+
+@pytest.fixture
+def agent_server():
+    server = socketserver.ThreadingTCPServer(("localhost", 0), _AgentRequestHandler)
+    server.daemon_threads = True
+    server.connections = 0
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        t.join()
+
+
+def _send(conn):
+    conn.request("PUT", "/v0.4/traces", PAYLOAD, {"Content-Length": str(len(PAYLOAD))})
+    get_connection_response(conn).read()
+
+
+@pytest.mark.benchmark(group="agent-put", min_time=0.005)
+def test_put_connect_per_request(benchmark, agent_server):
+    url = "http://localhost:%d" % agent_server.server_address[1]
+
+    def put():
+        conn = agent.get_connection(url)
+        try:
+            _send(conn)
+        finally:
+            conn.close()
+
+    benchmark(put)
+    benchmark.extra_info["connections"] = agent_server.connections
+
+
+@pytest.mark.benchmark(group="agent-put", min_time=0.005)
+def test_put_connection_pool(benchmark, agent_server):
+    pool = agent.ConnectionPool("http://localhost:%d" % agent_server.server_address[1])
+
+    def put():
+        with pool.connection() as conn:
+            _send(conn)
+
+    benchmark(put)
+    pool.close()
+    benchmark.extra_info["connections"] = agent_server.connections
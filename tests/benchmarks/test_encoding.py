@@ -1,10 +1,20 @@
+import json
+import threading
+
 import msgpack
 from msgpack.fallback import Packer
 import pytest
 
+from ddtrace.vendor import psutil
+
+from ddtrace.encoding import JSONEncoderV2
 from ddtrace.encoding import MsgpackEncoder
 from ddtrace.encoding import _EncoderBase
+from ddtrace.internal._encoding import BufferedEncoder
+from ddtrace.internal._encoding import BufferedEncoderV05
+from ddtrace.internal._encoding import ShardedEncoder
 from tests.tracer.test_encoders import RefMsgpackEncoder
+from tests.tracer.test_encoders import _ref_json_spans
 from tests.tracer.test_encoders import gen_trace
 
 
@@ -25,6 +35,7 @@ class PPMsgpackEncoder(_EncoderBase):
 
 
 trace_large = gen_trace(nspans=1000)
+trace_medium = gen_trace(nspans=200, key_size=10, ntags=10, nmetrics=4)
 trace_small = gen_trace(nspans=50, key_size=10, ntags=5, nmetrics=4)
 
 
@@ -77,3 +88,120 @@ def test_join_encoded_custom(benchmark):
     benchmark(
         trace_encoder.join_encoded, [trace_encoder.encode_trace(trace_large), trace_encoder.encode_trace(trace_small)]
     )
+
+
+@pytest.mark.benchmark(group="encoding.payload", min_time=0.005)
+def test_encode_payload_small_multi_join(benchmark):
+    def func():
+        return trace_encoder.join_encoded([trace_encoder.encode_trace(trace_small) for _ in range(50)])
+
+    benchmark(func)
+
+
+@pytest.mark.benchmark(group="encoding.payload", min_time=0.005)
+def test_encode_payload_small_multi_buffered(benchmark):
+    encoder = BufferedEncoder(max_size=8 << 20, max_item_size=8 << 20)
+
+    def func():
+        for _ in range(50):
+            encoder.put(trace_small)
+        return encoder.encode()
+
+    benchmark(func)
+
+
+@pytest.mark.parametrize("encoder_cls", [BufferedEncoder, BufferedEncoderV05], ids=["v0.4", "v0.5"])
+@pytest.mark.parametrize(
+    "traces",
+    [[trace_small for _ in range(50)], [trace_large]],
+    ids=["small-multi", "large"],
+)
+@pytest.mark.benchmark(group="encoding.api_version", min_time=0.005)
+def test_encode_payload_api_version(benchmark, encoder_cls, traces):
+    encoder = encoder_cls(max_size=8 << 20, max_item_size=8 << 20)
+
+    def func():
+        for trace in traces:
+            encoder.put(trace)
+        return encoder.encode()
+
+    payload = benchmark(func)
+    benchmark.extra_info["payload_bytes"] = len(payload)
+
+
+@pytest.mark.parametrize("encoder_cls", [BufferedEncoder, ShardedEncoder], ids=["single", "sharded"])
+@pytest.mark.parametrize("nthreads", [1, 4, 16])
+@pytest.mark.benchmark(group="encoding.contention", min_time=0.005)
+def test_encode_payload_contention(benchmark, encoder_cls, nthreads):
+    encoder = encoder_cls(max_size=64 << 20, max_item_size=8 << 20)
+
+    def put():
+        for _ in range(20):
+            encoder.put(trace_small)
+
+    def func():
+        threads = [threading.Thread(target=put) for _ in range(nthreads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return encoder.encode()
+
+    payload = benchmark(func)
+    assert payload.count == 20 * nthreads
+
+
+@pytest.mark.parametrize(
+    "traces",
+    [[trace_small for _ in range(10)], [trace_large]],
+    ids=["small-multi", "large"],
+)
+@pytest.mark.benchmark(group="encoding.json", min_time=0.005)
+def test_encode_json_to_dict(benchmark, traces):
+    def func():
+        return json.dumps({"traces": [_ref_json_spans(trace, True) for trace in traces]})
+
+    benchmark(func)
+
+
+@pytest.mark.parametrize(
+    "traces",
+    [[trace_small for _ in range(10)], [trace_large]],
+    ids=["small-multi", "large"],
+)
+@pytest.mark.benchmark(group="encoding.json", min_time=0.005)
+def test_encode_json_spans(benchmark, traces):
+    benchmark(JSONEncoderV2().encode_traces, traces)
+
+
+def _memory_info(func, *args):
+    """Return the peak of memory traced while calling ``func`` and the RSS of the process afterwards."""
+    tracemalloc = pytest.importorskip("tracemalloc")
+
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, psutil.Process().memory_info().rss
+
+
+@pytest.mark.parametrize(
+    "trace",
+    [trace_small, trace_medium, trace_large],
+    ids=["small", "medium", "huge"],
+)
+@pytest.mark.benchmark(group="encoding.memory", min_time=0.005)
+def test_encode_trace_memory(benchmark, trace):
+    encoder = MsgpackEncoder()
+
+    def func():
+        for _ in range(100):
+            encoder.encode_trace(trace)
+
+    benchmark(func)
+    peak, rss = _memory_info(func)
+    benchmark.extra_info["peak_alloc_bytes"] = peak
+    benchmark.extra_info["encoded_bytes"] = len(encoder.encode_trace(trace))
+    benchmark.extra_info["rss_bytes"] = rss
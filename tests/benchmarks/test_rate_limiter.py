@@ -0,0 +1,37 @@
+import threading
+
+import pytest
+
+from ddtrace.internal.rate_limiter import RateLimiter
+from ddtrace.sampler import DatadogSampler
+
+
+@pytest.mark.benchmark(group="rate-limiter", min_time=0.005)
+def test_is_allowed(benchmark):
+    limiter = RateLimiter(DatadogSampler.DEFAULT_RATE_LIMIT)
+
+    benchmark(limiter.is_allowed)
+
+
+@pytest.mark.parametrize("nthreads", [1, 4, 16])
+@pytest.mark.benchmark(group="rate-limiter.contention", min_time=0.005)
+def test_is_allowed_contention(benchmark, nthreads):
+    # 50k decisions per run, shared between the threads: the run should not be slower with more threads
+    decisions = 50000 // nthreads
+    limiter = RateLimiter(DatadogSampler.DEFAULT_RATE_LIMIT)
+
+    def decide():
+        is_allowed = limiter.is_allowed
+        for _ in range(decisions):
+            is_allowed()
+            limiter.effective_rate
+
+    def func():
+        threads = [threading.Thread(target=decide) for _ in range(nthreads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    benchmark(func)
+    benchmark.extra_info["decisions"] = decisions * nthreads
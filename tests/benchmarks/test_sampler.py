@@ -0,0 +1,54 @@
+import re
+
+import mock
+import pytest
+
+from ddtrace.sampler import DatadogSampler
+from ddtrace.sampler import SamplingRule
+from ddtrace.sampler import _MatchingRules
+from ddtrace.span import Span
+from tests import DummyTracer
+
+
+def rules(n=50):
+    # A mix of exact and regular expression patterns, none of which matches the spans below
+    return [
+        SamplingRule(sample_rate=0.5, service="service-%d" % i, name=re.compile(r"^op-%d\." % i))
+        if i % 2
+        else SamplingRule(sample_rate=0.5, service=re.compile(r"^service-%d$" % i), name="op-%d" % i)
+        for i in range(n)
+    ] + [SamplingRule(sample_rate=1.0, name="web.request")]
+
+
+@pytest.mark.parametrize("cached", [True, False], ids=["cached", "uncached"])
+@pytest.mark.benchmark(group="sampler.rules", min_time=0.005)
+def test_sample_50_rules(benchmark, cached):
+    sampler = DatadogSampler(rules=rules(), default_sample_rate=1.0)
+    if not cached:
+        sampler._matching_rules = sampler._get_matching_rules
+    span = Span(DummyTracer(), "web.request", service="web")
+
+    benchmark(sampler.sample, span)
+
+
+def resource_rules(n=300):
+    # Half exact resources, half resource prefixes, plus a catch-all rule
+    return [
+        SamplingRule(sample_rate=0.5, resource="GET /endpoint-%d" % i)
+        if i % 2
+        else SamplingRule(sample_rate=0.5, resource=re.compile(r"^POST /endpoint-%d/" % i))
+        for i in range(n)
+    ] + [SamplingRule(sample_rate=1.0)]
+
+
+@pytest.mark.parametrize("indexed", [True, False], ids=["indexed", "unindexed"])
+@pytest.mark.benchmark(group="sampler.resource_rules", min_time=0.005)
+def test_sample_300_resource_rules(benchmark, indexed):
+    sampler = DatadogSampler(rules=resource_rules(), default_sample_rate=1.0)
+    span = Span(DummyTracer(), "web.request", service="web", resource="POST /endpoint-150/users")
+
+    if indexed:
+        benchmark(sampler.sample, span)
+    else:
+        with mock.patch.object(_MatchingRules, "candidates", lambda self, span: self.rules):
+            benchmark(sampler.sample, span)
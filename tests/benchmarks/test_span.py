@@ -0,0 +1,55 @@
+import pytest
+
+from ddtrace.constants import SERVICE_VERSION_KEY
+from ddtrace.constants import SPAN_MEASURED_KEY
+from ddtrace.ext import http
+from ddtrace.span import Span
+
+
+TAGS = [
+    ("str", "component", "django"),
+    ("int", "db.row_count", 42),
+    ("float", "_dd.rule_psr", 0.5),
+    ("large_int", "thread.id", 2 ** 60),
+    ("status_code", http.STATUS_CODE, 200),
+    ("measured", SPAN_MEASURED_KEY, True),
+    ("version", SERVICE_VERSION_KEY, "1.0.0"),
+]
+
+
+@pytest.mark.benchmark(group="span.create", min_time=0.005)
+def test_create(benchmark):
+    benchmark(Span, None, "web.request", service="web", resource="GET /", span_type="web")
+
+
+@pytest.mark.benchmark(group="span.create", min_time=0.005)
+def test_create_child(benchmark):
+    benchmark(Span, None, "web.request", trace_id=1, span_id=2, parent_id=3, _check_pid=False)
+
+
+@pytest.mark.parametrize("kind,key,value", TAGS, ids=[kind for kind, _, _ in TAGS])
+@pytest.mark.benchmark(group="span.set_tag", min_time=0.005)
+def test_set_tag(benchmark, kind, key, value):
+    span = Span(None, "web.request")
+    benchmark(span.set_tag, key, value)
+
+
+@pytest.mark.benchmark(group="span.set_tags", min_time=0.005)
+def test_set_tags(benchmark):
+    span = Span(None, "web.request")
+    benchmark(span.set_tags, {key: value for _, key, value in TAGS})
+
+
+@pytest.mark.parametrize("value", [42, 0.5, "1.5"], ids=["int", "float", "str"])
+@pytest.mark.benchmark(group="span.set_metric", min_time=0.005)
+def test_set_metric(benchmark, value):
+    span = Span(None, "web.request")
+    benchmark(span.set_metric, "db.row_count", value)
+
+
+@pytest.mark.benchmark(group="span.finish", min_time=0.005)
+def test_finish(benchmark):
+    def setup():
+        return (Span(None, "web.request"),), {}
+
+    benchmark.pedantic(lambda span: span.finish(), setup=setup, rounds=10000)
@@ -20,3 +20,35 @@ def test_randbits_stdlib(benchmark):
     from ddtrace.compat import getrandbits
 
     benchmark(getrandbits, 64)
+
+
+@pytest.mark.benchmark(group="span-id.batch", min_time=0.005)
+def test_rand64bits_batch(benchmark):
+    from ddtrace.internal import _rand
+
+    # More than a buffer of numbers, the cost of refilling the buffer is included
+    def func():
+        rand64bits = _rand.rand64bits
+        for _ in range(4096):
+            rand64bits()
+
+    benchmark(func)
+
+
+@pytest.mark.benchmark(group="span-id.batch", min_time=0.005)
+def test_randbits_stdlib_batch(benchmark):
+    from ddtrace.compat import getrandbits
+
+    def func():
+        for _ in range(4096):
+            getrandbits(64)
+
+    benchmark(func)
+
+
+@pytest.mark.benchmark(group="span-id.span", min_time=0.005)
+def test_span_ids(benchmark):
+    from ddtrace.span import Span
+
+    # Both the trace and the span ids are generated, with the pid check
+    benchmark(Span, None, "span")
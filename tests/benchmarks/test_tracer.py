@@ -1,6 +1,11 @@
+import mock
 import pytest
 
+from ddtrace.context import Context
+from ddtrace.encoding import MsgpackEncoder
+from ddtrace.sampler import DatadogSampler
 from tests import DummyTracer
+from tests import override_global_config
 
 
 @pytest.fixture
@@ -88,3 +93,74 @@ def test_tracer_large_trace(benchmark, tracer):
 
 def test_tracer_start_span(benchmark, tracer):
     benchmark(tracer.start_span, "benchmark")
+
+
+@pytest.fixture
+def configured_tracer(tracer):
+    # A tracer configured like a typical application
+    tracer.set_tags({"team": "web", "region": "us-east-1", "shard": 3})
+    # Only measure the creation of the spans, not the encoding of the traces by the dummy writer
+    tracer.writer.write = mock.Mock()
+    with override_global_config(dict(env="prod", version="1.2.3", service="web")):
+        yield tracer
+
+
+@pytest.mark.benchmark(group="tracer.request", min_time=0.005)
+def test_tracer_orm_request(benchmark, configured_tracer):
+    # A web request running 200 database queries
+    def func(tracer):
+        with tracer.trace("django.request", span_type="web"):
+            for _ in range(200):
+                with tracer.trace("postgres.query", service="postgres", span_type="sql"):
+                    pass
+
+    benchmark(func, configured_tracer)
+
+
+@pytest.mark.benchmark(group="tracer.request", min_time=0.005)
+def test_tracer_nested_request(benchmark, configured_tracer):
+    # A web request with 200 nested function calls
+    def func(tracer, depth=0):
+        with tracer.trace("function"):
+            if depth < 200:
+                func(tracer, depth + 1)
+
+    benchmark(func, configured_tracer)
+
+
+@pytest.mark.benchmark(group="tracer.batch", min_time=0.005)
+@pytest.mark.parametrize("partial_flush", [False, True], ids=["no_partial_flush", "partial_flush"])
+def test_tracer_batch_job(benchmark, tracer, partial_flush):
+    # A batch job processing 5000 items
+    tracer.writer.write = mock.Mock()
+
+    def func(tracer):
+        with tracer.trace("job"):
+            for _ in range(5000):
+                with tracer.trace("item"):
+                    pass
+
+    with mock.patch.object(Context, "_partial_flush_enabled", partial_flush):
+        benchmark(func, tracer)
+
+
+@pytest.mark.benchmark(group="tracer.sample_rate", min_time=0.005)
+@pytest.mark.parametrize("drop_rejected_traces", [False, True], ids=["send_rejected", "drop_rejected"])
+@pytest.mark.parametrize("sample_rate", [0.01, 0.1, 1.0])
+def test_tracer_sampled_request(benchmark, tracer, sample_rate, drop_rejected_traces):
+    # A web request running 50 tagged database queries, its trace is encoded when it is sent
+    tracer.configure(sampler=DatadogSampler(default_sample_rate=sample_rate, rate_limit=DatadogSampler.NO_RATE_LIMIT))
+    encoder = MsgpackEncoder()
+    tracer.writer.write = lambda spans=None: encoder.encode_trace(spans)
+
+    def func(tracer):
+        with tracer.trace("django.request", span_type="web") as span:
+            span.set_tag("http.url", "/users")
+            for i in range(50):
+                with tracer.trace("postgres.query", service="postgres", span_type="sql") as span:
+                    span.set_tag("sql.query", "SELECT * FROM users WHERE id = %s")
+                    span.set_tag("db.row_count", i)
+                    span.set_tag("out.port", "5432")
+
+    with override_global_config(dict(drop_rejected_traces=drop_rejected_traces)):
+        benchmark(func, tracer)
@@ -0,0 +1,58 @@
+import mock
+import pytest
+
+from ddtrace.internal._encoding import BufferedEncoder
+from ddtrace.internal.writer import AgentWriter
+from ddtrace.internal.writer import Response
+from ddtrace.internal.writer import _gzip
+from tests.tracer.test_encoders import gen_trace
+
+
+trace_small = gen_trace(nspans=50, key_size=10, ntags=5, nmetrics=4)
+trace_medium = gen_trace(nspans=200, key_size=10, ntags=10, nmetrics=4)
+trace_large = gen_trace(nspans=1000)
+
+
+def _payload(traces):
+    encoder = BufferedEncoder(max_size=64 << 20, max_item_size=64 << 20)
+    for trace in traces:
+        encoder.put(trace)
+    return encoder.encode().getvalue()
+
+
+@pytest.mark.parametrize("encode_queue_size", [0, 1000], ids=["sync", "queue"])
+@pytest.mark.benchmark(group="writer.write", min_time=0.005)
+def test_write(benchmark, encode_queue_size):
+    # Measure the time spent by the application thread finishing a trace
+    writer = AgentWriter(
+        agent_url="http://dne:1234",
+        processing_interval=3600,
+        buffer_size=1 << 30,
+        max_payload_size=1 << 30,
+        encode_queue_size=encode_queue_size,
+    )
+    writer._put = mock.Mock(return_value=Response(status=200))
+    writer.wake = mock.Mock()
+    try:
+        # Flush the traces between rounds so that the flush is not timed
+        benchmark.pedantic(writer.write, args=(trace_medium,), setup=writer.flush_queue, rounds=500)
+    finally:
+        writer.stop()
+
+
+@pytest.mark.parametrize("level", [1, 6, 9])
+@pytest.mark.parametrize(
+    "traces",
+    [[trace_small] * 50, [trace_medium] * 10, [trace_large]],
+    ids=["small-multi", "medium-multi", "large"],
+)
+@pytest.mark.benchmark(group="writer.compression", min_time=0.005)
+def test_gzip_payload(benchmark, traces, level):
+    # Payloads repeating a single trace compress much better than payloads of traces with distinct random tags. The
+    # payloads of an application are somewhere in between.
+    payload = _payload(traces)
+    compressed = benchmark(_gzip, payload, level)
+    benchmark.extra_info["payload_bytes"] = len(payload)
+    benchmark.extra_info["compression_ratio"] = float(len(payload)) / len(compressed)
+    if benchmark.stats is not None:
+        benchmark.extra_info["ns_per_byte"] = benchmark.stats.stats.mean * 1e9 / len(payload)
@@ -325,12 +325,20 @@ def test_bad_endpoint():
 def test_bad_payload():
     t = Tracer()
 
+    class BadPayload(bytes):
+        count = 1
+
     class BadEncoder:
-        def encode_trace(self, spans):
-            return []
+        size = 0
+
+        def __len__(self):
+            return 0
 
-        def join_encoded(self, traces):
-            return "not msgpack"
+        def put(self, trace):
+            pass
+
+        def encode(self):
+            return BadPayload(b"not msgpack")
 
     t.writer._encoder = BadEncoder()
     with mock.patch("ddtrace.internal.writer.log") as log:
@@ -351,10 +359,13 @@ def test_bad_encoder():
     t = Tracer()
 
     class BadEncoder:
-        def encode_trace(self, spans):
+        def __len__(self):
+            return 0
+
+        def put(self, trace):
             raise Exception()
 
-        def join_encoded(self, traces):
+        def encode(self):
             pass
 
     t.writer._encoder = BadEncoder()
@@ -12,6 +12,7 @@ from ddtrace.profiling import collector
 from ddtrace.profiling import profiler
 from ddtrace.profiling import recorder
 from ddtrace.profiling.collector import _threading
+from ddtrace.profiling.collector import _traceback
 from ddtrace.profiling.collector import stack
 from ddtrace.vendor import six
 
@@ -210,7 +211,7 @@ def test_repr():
         stack.StackCollector,
         "StackCollector(status=<ServiceStatus.STOPPED: 'stopped'>, "
         "recorder=Recorder(default_max_events=32768, max_events={}), min_interval_time=0.01, max_time_usage_pct=1.0, "
-        "nframes=64, ignore_profiler=True, tracer=None)",
+        "nframes=64, ignore_profiler=True, aggregate=False, native_sampler=False, tracer=None)",
     )
 
 
@@ -340,7 +341,7 @@ def test_exception_collection():
     assert e.sampling_period > 0
     assert e.thread_id == _nogevent.thread_get_ident()
     assert e.thread_name == "MainThread"
-    assert e.frames == [(__file__, 334, "test_exception_collection")]
+    assert e.frames == [(__file__, 335, "test_exception_collection")]
     assert e.nframes == 1
     assert e.exc_type == ValueError
 
@@ -460,6 +461,48 @@ def test_collect_multiple_span_ids(tracer_and_collector):
             break
 
 
+def test_collect_once_aggregate():
+    r = recorder.Recorder()
+    s = stack.StackCollector(r, aggregate=True)
+    s._init()
+    # The stack samples are folded in the recorder, only the exceptions are returned
+    assert len(s.collect()) == 1
+    s.collect()
+
+    aggregate = r.events[stack.StackSampleAggregate]
+    assert not r.events[stack.StackSampleEvent]
+    assert aggregate.nsamples >= 2
+    assert aggregate.sampling_period_sum > 0
+    assert sum(count for count, cpu_time, wall_time in aggregate.samples.values()) == aggregate.nsamples
+    for (thread_id, thread_native_id, thread_name, trace_id, span_id, frame_ids, nframes), values in six.iteritems(
+        aggregate.samples
+    ):
+        if thread_name == "MainThread":
+            assert thread_id > 0
+            assert trace_id is None and span_id is None
+            assert isinstance(frame_ids, tuple)
+            assert _traceback.stack_table.stack_to_frames(frame_ids)[0][0].endswith(".py")
+            assert nframes >= len(frame_ids)
+            break
+    else:
+        pytest.fail("Unable to find the main thread")
+
+
+def test_collect_span_ids_aggregate(tracer):
+    r = recorder.Recorder()
+    c = stack.StackCollector(r, tracer=tracer, aggregate=True)
+    c._init()
+    try:
+        span = tracer.start_span("foobar")
+        child = tracer.start_span("foobar", child_of=span)
+        c.collect()
+    finally:
+        tracer.deregister_on_start_span(c._thread_span_links.link_span)
+
+    keys = r.events[stack.StackSampleAggregate].samples
+    assert (child.trace_id, child.span_id) in {(key[3], key[4]) for key in keys}
+
+
 def test_stress_trace_collection(tracer_and_collector):
     tracer, collector = tracer_and_collector
 
@@ -528,3 +571,106 @@ def test_thread_time_cache():
         assert set(tt._get_last_thread_time().keys()) == set(
             (pthread_id, _threading.get_thread_native_id(pthread_id)) for pthread_id in threads
         )
+
+
+@pytest.mark.skipif(not stack.FEATURES["cpu-time"], reason="CPU time not supported")
+def test_thread_time_cpu_times():
+    tt = stack._ThreadTime()
+    main_thread_id = threading.current_thread().ident
+    key = (main_thread_id, _threading.get_thread_native_id(main_thread_id))
+
+    assert tt([main_thread_id], {main_thread_id: 1000}) == {key: 0}
+    assert tt([main_thread_id], {main_thread_id: 1500}) == {key: 500}
+    # A thread whose CPU time was not read is not accounted
+    assert tt([main_thread_id], {}) == {key: 0}
+    assert tt._get_last_thread_time() == {key: 1500}
+
+
+def _spin(duration):
+    end = time.time() + duration
+    while time.time() < end:
+        pass
+
+
+@pytest.mark.skipif(not stack.FEATURES["native-sampler"], reason="Native sampler not supported")
+@pytest.mark.skipif(TESTING_GEVENT, reason="Test not compatible with gevent")
+def test_native_sampler():
+    r = recorder.Recorder()
+    c = stack.StackCollector(r, native_sampler=True)
+    with c:
+        assert isinstance(c._worker, stack._NativeSampler)
+        assert c._worker.is_alive()
+        t = threading.Thread(target=_spin, args=(0.5,))
+        t.start()
+        _spin(0.5)
+        t.join()
+    assert not c._worker.is_alive()
+
+    events = r.events[stack.StackSampleEvent]
+    assert {threading.current_thread().ident, t.ident} <= {e.thread_id for e in events}
+    assert all(e.thread_id != c._worker.ident for e in events)
+    assert sum(e.cpu_time_ns for e in events if e.thread_id == t.ident) > 0
+    assert all(e.wall_time_ns > 0 for e in events)
+
+
+@pytest.mark.skipif(not stack.FEATURES["native-sampler"], reason="Native sampler not supported")
+def test_native_sampler_stop_before_sample():
+    sampler = stack._NativeSampler(60, lambda *args: pytest.fail("Sampled"))
+    sampler.start()
+    with pytest.raises(RuntimeError):
+        sampler.start()
+    sampler.stop()
+    sampler.join()
+    assert not sampler.is_alive()
+
+
+@pytest.mark.skipif(not stack.FEATURES["native-sampler"], reason="Native sampler not supported")
+@pytest.mark.skipif(TESTING_GEVENT, reason="Test not compatible with gevent")
+def test_native_sampler_fork():
+    # The sampler reads the thread states as often as possible
+    sampler = stack._NativeSampler(0, lambda *args: None)
+    sampler.start()
+    try:
+        for _ in range(100):
+            pid = os.fork()
+            if pid == 0:
+                # Starting and stopping a thread needs the lock of the interpreters in the child process
+                t = threading.Thread(target=lambda: None)
+                t.start()
+                t.join()
+                os._exit(0)
+
+            deadline = time.time() + 10
+            while os.waitpid(pid, os.WNOHANG) == (0, 0):
+                if time.time() > deadline:
+                    os.kill(pid, 9)
+                    os.waitpid(pid, 0)
+                    pytest.fail("The child process is stuck")
+                time.sleep(0.001)
+    finally:
+        sampler.stop()
+        sampler.join()
+
+
+def test_native_sampler_disabled():
+    # The native sampler is opt-in
+    assert stack.StackCollector(recorder.Recorder()).native_sampler is False
+    c = stack.StackCollector(recorder.Recorder(), native_sampler=False)
+    with c:
+        assert not isinstance(c._worker, stack._NativeSampler or ())
+        assert c._worker.is_alive()
+
+
+@pytest.mark.benchmark(
+    group="stack-collector-cpu-bound",
+)
+@pytest.mark.parametrize("native_sampler", (None, False, True))
+def test_collector_cpu_bound_overhead(benchmark, native_sampler):
+    # Sample at 100 Hz, whatever the time used by the collector
+    if native_sampler is None:
+        benchmark(_fib, 20)
+    else:
+        if native_sampler and not stack.FEATURES["native-sampler"]:
+            pytest.skip("Native sampler not supported")
+        with stack.StackCollector(recorder.Recorder(), max_time_usage_pct=100, native_sampler=native_sampler):
+            benchmark(_fib, 20)
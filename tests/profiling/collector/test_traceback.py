@@ -1,5 +1,8 @@
 import sys
 
+import mock
+import pytest
+
 from ddtrace.profiling.collector import _traceback
 
 
@@ -15,10 +18,105 @@ def test_check_traceback_to_frames():
     frames, nframes = _traceback.traceback_to_frames(traceback, 10)
     assert nframes == 2
     assert frames == [
-        (__file__, 7, "_x"),
+        (__file__, 10, "_x"),
         (
             __file__,
-            15,
+            18,
             "test_check_traceback_to_frames",
         ),
     ]
+
+
+def test_stack_table_traceback_to_stack():
+    try:
+        _x()
+    except Exception:
+        exc_type, exc_value, traceback = sys.exc_info()
+    table = _traceback.StackTable()
+    stack, nframes = table.traceback_to_stack(traceback, 10)
+    assert nframes == 2
+    assert table.stack_to_frames(stack[:1]) == [(__file__, 10, "_x")]
+    assert table.stack_to_frames(stack[1:])[0][2] == "test_stack_table_traceback_to_stack"
+
+
+def test_stack_table_pyframe_to_stack():
+    table = _traceback.StackTable()
+    frame = sys._getframe().f_back
+    stack, nframes = table.pyframe_to_stack(frame, 10)
+    frames, _ = _traceback.pyframe_to_frames(frame, 10)
+    assert len(stack) == min(nframes, 10)
+    assert table.stack_to_frames(stack) == frames
+    # The ids are stable
+    assert table.pyframe_to_stack(frame, 10) == (stack, nframes)
+    assert table.frames_to_stack(frames) == stack
+    assert len(table) == len(set(stack))
+
+
+def test_stack_table_intern():
+    table = _traceback.StackTable()
+    assert table.intern_frame("foo.py", 1, "foo") == 0
+    assert table.intern_frame("foo.py", 2, "foo") == 1
+    assert table.intern_frame("bar.py", 1, "bar") == 2
+    assert table.intern_frame("foo.py", 1, "foo") == 0
+    assert table.stack_to_frames((0, 1, 2)) == [("foo.py", 1, "foo"), ("foo.py", 2, "foo"), ("bar.py", 1, "bar")]
+    assert [table.frame_function(frame_id) for frame_id in (0, 1, 2)] == [0, 0, 1]
+    assert [table.function(function_id) for function_id in (0, 1)] == [("foo.py", "foo"), ("bar.py", "bar")]
+
+
+def test_stack_table_intern_line():
+    table = _traceback.StackTable()
+    line_to_function = mock.Mock(return_value="foo")
+    assert table.intern_line("foo.py", 1, line_to_function) == table.intern_frame("foo.py", 1, "foo")
+    assert table.intern_line("foo.py", 1, line_to_function) == 0
+    # The function name is only resolved the first time the line is seen
+    line_to_function.assert_called_once_with("foo.py", 1)
+
+
+def test_stack_table_rotate():
+    table = _traceback.StackTable()
+    stack = table.frames_to_stack([("foo.py", 1, "foo"), ("bar.py", 1, "bar")])
+    frame = sys._getframe().f_back
+    pystack, _ = table.pyframe_to_stack(frame, 1)
+
+    # The frames used since the previous rotation are kept
+    table.rotate()
+    assert len(table) == 3
+    assert table.stack_to_frames(stack) == [("foo.py", 1, "foo"), ("bar.py", 1, "bar")]
+
+    # The frames still used keep their ids
+    assert table.frames_to_stack([("foo.py", 1, "foo")]) == stack[:1]
+    assert table.pyframe_to_stack(frame, 1)[0] == pystack
+    table.rotate()
+    table.rotate()
+    assert table.stack_to_frames(stack[:1] + pystack) == [("foo.py", 1, "foo")] + table.stack_to_frames(pystack)
+    assert table.function(table.frame_function(stack[0])) == ("foo.py", "foo")
+
+    # The frames unused for two rotations are dropped, with their functions, and their ids are not reused
+    assert stack[1] not in table
+    with pytest.raises(KeyError):
+        table.frame(stack[1])
+    assert table.intern_frame("bar.py", 1, "bar") == 3
+    assert table.function(table.frame_function(3)) == ("bar.py", "bar")
+    assert table.frame_function(3) == 3
+
+
+def test_stack_table_max_code_objects():
+    table = _traceback.StackTable(max_code_objects=1)
+    frame = sys._getframe().f_back
+    stack, nframes = table.pyframe_to_stack(frame, 10)
+    # The frame ids do not depend on the code objects cached
+    assert table.pyframe_to_stack(frame, 10) == (stack, nframes)
+
+
+@pytest.mark.benchmark(
+    group="traceback-pyframe",
+)
+def test_pyframe_to_frames_speed(benchmark):
+    benchmark(_traceback.pyframe_to_frames, sys._getframe(), 64)
+
+
+@pytest.mark.benchmark(
+    group="traceback-pyframe",
+)
+def test_pyframe_to_stack_speed(benchmark):
+    benchmark(_traceback.StackTable().pyframe_to_stack, sys._getframe(), 64)
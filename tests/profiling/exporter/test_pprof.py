@@ -1,11 +1,15 @@
+import gzip
 import os
 
 import mock
+import pytest
 
+from ddtrace.profiling.collector import _traceback
 from ddtrace.profiling.collector import memalloc
 from ddtrace.profiling.collector import stack
 from ddtrace.profiling.collector import threading
 from ddtrace.profiling.exporter import pprof
+from ddtrace.profiling.exporter import pprof_pb2
 from ddtrace.vendor import six
 
 
@@ -675,6 +679,8 @@ def test_to_str_none():
 
 def test_ppprof_exporter():
     exp = pprof.PprofExporter()
+    # Use a new stack table for the ids to be reproducible
+    exp._stack_table = _traceback.StackTable()
     exp._get_program_name = mock.Mock()
     exp._get_program_name.return_value = "bonjour"
     exports = exp.export(TEST_EVENTS, 1, 7)
@@ -686,7 +692,180 @@ def test_ppprof_exporter():
         assert f.read() == str(exports), filename
 
 
+def test_pprof_exporter_stack_aggregate():
+    exp = pprof.PprofExporter()
+    exp._stack_table = _traceback.StackTable()
+    exp._get_program_name = mock.Mock()
+    exp._get_program_name.return_value = "bonjour"
+
+    stack_events = TEST_EVENTS[stack.StackSampleEvent]
+    aggregate = stack.StackSampleAggregate()
+    for event in stack_events:
+        trace_id = min(event.trace_ids) if event.trace_ids else None
+        span_id = min(event.span_ids) if event.span_ids else None
+        key = (
+            event.thread_id,
+            event.thread_native_id,
+            event.thread_name,
+            trace_id,
+            span_id,
+            exp._stack_table.frames_to_stack(event.frames),
+            event.nframes,
+        )
+        aggregate.add([(key, event.cpu_time_ns, event.wall_time_ns)], event.sampling_period)
+
+    # The folded samples are exported as the events they stand for
+    assert exp.export({stack.StackSampleAggregate: aggregate}, 1, 7) == exp.export(
+        {stack.StackSampleEvent: stack_events}, 1, 7
+    )
+
+
 def test_pprof_exporter_empty():
     exp = pprof.PprofExporter()
     export = exp.export({}, 0, 1)
     assert len(export.sample) == 0
+
+
+def test_pprof_exporter_location_cache():
+    exp = pprof.PprofExporter()
+    exp._stack_table = _traceback.StackTable()
+    exp._get_program_name = mock.Mock()
+    exp._get_program_name.return_value = "bonjour"
+
+    profile = exp.export(TEST_EVENTS, 1, 7)
+    locations = dict(exp._location_cache)
+    assert sorted(location.id - 1 for location in locations.values()) == list(range(len(exp._stack_table)))
+
+    # The locations are built once, the next profiles refer to the locations they use
+    stack_events = {stack.StackSampleEvent: TEST_EVENTS[stack.StackSampleEvent]}
+    second = exp.export(stack_events, 1, 7)
+    assert exp._location_cache == locations
+    assert all(exp._location_cache[location.id - 1] is locations[location.id - 1] for location in second.location)
+    assert exp.export(TEST_EVENTS, 1, 7) == profile
+
+
+def test_pprof_exporter_stack_table_rotate():
+    exp = pprof.PprofExporter()
+    exp._stack_table = _traceback.StackTable()
+    exp._get_program_name = mock.Mock()
+    exp._get_program_name.return_value = "bonjour"
+
+    def _event(frames):
+        return stack.StackSampleEvent(
+            thread_id=1,
+            thread_name="MainThread",
+            stack=exp._stack_table.frames_to_stack(frames),
+            nframes=len(frames),
+            cpu_time_ns=1,
+            wall_time_ns=1,
+            sampling_period=1,
+        )
+
+    # The stacks recorded before the rotation are still exported, with the same ids
+    old = _event([("foo.py", 1, "foo"), ("bar.py", 2, "bar")])
+    exp._stack_table.rotate()
+    new = _event([("foo.py", 1, "foo")])
+    assert new.stack == old.stack[:1]
+    profile = exp.export({stack.StackSampleEvent: [old, new]}, 1, 7)
+    assert [location.id for location in profile.location] == [1, 2]
+    assert sorted(exp._location_cache) == [0, 1]
+
+    # The locations of the frames dropped from the stack table are evicted
+    exp._stack_table.rotate()
+    exp._stack_table.rotate()
+    assert 1 not in exp._stack_table
+    profile = exp.export({stack.StackSampleEvent: [_event([("foo.py", 1, "foo")])]}, 1, 7)
+    assert [location.id for location in profile.location] == [1]
+    assert sorted(exp._location_cache) == [0]
+
+
+def test_pprof_exporter_serialized():
+    exp = pprof.PprofExporter()
+    exp._stack_table = _traceback.StackTable()
+    exp._get_program_name = mock.Mock()
+    exp._get_program_name.return_value = "bonjour"
+
+    profile = exp.export(TEST_EVENTS, 1, 7)
+    serialized = six.BytesIO()
+    exp.export_serialized(serialized, TEST_EVENTS, 1, 7)
+
+    assert serialized.getvalue() == profile.SerializeToString()
+    assert pprof_pb2.Profile.FromString(serialized.getvalue()) == profile
+
+
+def test_serialize_profile_buffer_size():
+    with pytest.raises(ValueError):
+        pprof._PprofConverter()._serialize_profile(six.BytesIO(), 0, 1, None, pprof._SAMPLE_TYPES, "bonjour", 9)
+
+
+def test_pprof_exporter_serialized_empty():
+    exp = pprof.PprofExporter()
+    serialized = six.BytesIO()
+    exp.export_serialized(serialized, {}, 0, 1)
+    assert serialized.getvalue() == exp.export({}, 0, 1).SerializeToString()
+
+
+@pytest.mark.parametrize("buffer_size", (10, 64, 65536))
+def test_serialize_profile(buffer_size):
+    table = _traceback.StackTable()
+    stack = table.frames_to_stack([(u"🤣.py", 2 ** 40, "func"), ("foo.py", 0, "")] * 1000)
+    c = pprof._PprofConverter(table)
+    c.convert_stack_samples(2 ** 63 - 1, 0, u"thread 🤣", "", "", (pprof._STACK_IDS, stack), 2010, 1, -1, 2 ** 40)
+
+    serialized = six.BytesIO()
+    fileobj = mock.Mock(wraps=serialized)
+    c._serialize_profile(fileobj, -5, 2 ** 62, None, pprof._SAMPLE_TYPES, u"bonjour 🤣", buffer_size)
+    # The data is written by chunks when the buffer is full
+    assert fileobj.write.call_count >= len(serialized.getvalue()) // buffer_size
+
+    profile = c._build_profile(-5, 2 ** 62, None, pprof._SAMPLE_TYPES, u"bonjour 🤣")
+    assert serialized.getvalue() == profile.SerializeToString()
+    assert pprof_pb2.Profile.FromString(serialized.getvalue()) == profile
+
+
+def _stack_events(n):
+    return {
+        stack.StackSampleEvent: [
+            stack.StackSampleEvent(
+                thread_id=i % 10,
+                thread_native_id=i % 10,
+                thread_name="Thread %d" % (i % 10),
+                trace_ids={i},
+                span_ids={i},
+                frames=[("module%d.py" % (j % 20), i % 100 + j, "func%d" % j) for j in range(30)],
+                nframes=30,
+                wall_time_ns=1000,
+                cpu_time_ns=100,
+                sampling_period=1000000,
+            )
+            for i in range(n)
+        ]
+    }
+
+
+@pytest.mark.benchmark(
+    group="pprof-export",
+)
+def test_pprof_export_speed(benchmark):
+    exp = pprof.PprofExporter()
+    events = _stack_events(1000)
+
+    def export():
+        with gzip.GzipFile(fileobj=six.BytesIO(), mode="wb") as gz:
+            gz.write(exp.export(events, 0, 1).SerializeToString())
+
+    benchmark(export)
+
+
+@pytest.mark.benchmark(
+    group="pprof-export",
+)
+def test_pprof_export_serialized_speed(benchmark):
+    exp = pprof.PprofExporter()
+    events = _stack_events(1000)
+
+    def export():
+        with gzip.GzipFile(fileobj=six.BytesIO(), mode="wb") as gz:
+            exp.export_serialized(gz, events, 0, 1)
+
+    benchmark(export)
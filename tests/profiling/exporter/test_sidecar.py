@@ -0,0 +1,264 @@
+# -*- encoding: utf-8 -*-
+import os
+import socket
+import sys
+import threading
+
+import mock
+import pytest
+
+from ddtrace.profiling import exporter
+from ddtrace.profiling.collector import _traceback
+from ddtrace.profiling.collector import stack
+from ddtrace.profiling.exporter import http
+from ddtrace.profiling.exporter import pprof
+from ddtrace.profiling.exporter import sidecar
+
+from . import test_pprof
+
+
+pytestmark = pytest.mark.skipif(not sidecar.is_supported(), reason="Unix sockets are not supported")
+
+
+_CONTEXT = {"service": "myservice"}
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    # The server creates the directory of the socket
+    return str(tmp_path / "sidecar" / "sidecar.sock")
+
+
+def _pprof_exporter(stack_table):
+    exp = pprof.PprofExporter()
+    exp._stack_table = stack_table
+    exp._get_program_name = mock.Mock()
+    exp._get_program_name.return_value = "bonjour"
+    return exp
+
+
+def test_encode_decode():
+    data = sidecar.encode(test_pprof.TEST_EVENTS, 1, 7, _CONTEXT)
+    stack_table = _traceback.StackTable()
+    context, events, start_time_ns, end_time_ns = sidecar.decode(data, stack_table)
+
+    assert context == _CONTEXT
+    assert (start_time_ns, end_time_ns) == (1, 7)
+    assert set(events) == set(test_pprof.TEST_EVENTS)
+    for cls, class_events in test_pprof.TEST_EVENTS.items():
+        assert len(events[cls]) == len(class_events)
+        for event, decoded in zip(class_events, events[cls]):
+            assert stack_table.stack_to_frames(decoded.stack) == [tuple(frame) for frame in event.frames]
+            for field in sidecar._EVENT_FIELDS[cls.__name__]:
+                if field == "exc_type":
+                    assert decoded.exc_type.__name__ == event.exc_type.__name__
+                    assert decoded.exc_type.__module__ == event.exc_type.__module__
+                else:
+                    assert getattr(decoded, field) == getattr(event, field), field
+
+    # The helper process exports the same profile as the application process
+    stack_table = _traceback.StackTable()
+    profile = _pprof_exporter(stack_table).export(test_pprof.TEST_EVENTS, 1, 7)
+    _, events, _, _ = sidecar.decode(data, stack_table)
+    assert _pprof_exporter(stack_table).export(events, 1, 7) == profile
+
+
+def test_encode_decode_aggregate():
+    stack_table = _traceback.StackTable()
+    aggregate = stack.StackSampleAggregate()
+    for event in test_pprof.TEST_EVENTS[stack.StackSampleEvent]:
+        key = (1, 2, "MainThread", None, None, stack_table.frames_to_stack(event.frames), event.nframes)
+        aggregate.add([(key, event.cpu_time_ns, event.wall_time_ns)], event.sampling_period)
+
+    data = sidecar.encode({stack.StackSampleAggregate: aggregate}, 1, 7, _CONTEXT, stack_table)
+    decoded_table = _traceback.StackTable()
+    _, events, _, _ = sidecar.decode(data, decoded_table)
+
+    decoded = events[stack.StackSampleAggregate]
+    assert decoded.nsamples == aggregate.nsamples
+    assert decoded.sampling_period_sum == aggregate.sampling_period_sum
+    assert {
+        key[:5] + (tuple(decoded_table.stack_to_frames(key[5])),) + key[6:]: values
+        for key, values in decoded.samples.items()
+    } == {
+        key[:5] + (tuple(stack_table.stack_to_frames(key[5])),) + key[6:]: values
+        for key, values in aggregate.samples.items()
+    }
+
+
+def test_decode_version():
+    data = sidecar.encode({}, 1, 7, _CONTEXT)
+    with mock.patch("ddtrace.profiling.exporter.sidecar._PROTOCOL_VERSION", sidecar._PROTOCOL_VERSION + 1):
+        with pytest.raises(ValueError):
+            sidecar.decode(data)
+
+
+def test_export(socket_path):
+    server = sidecar.SidecarServer(socket_path, api_key="my-api-key", idle_timeout=1)
+    server.bind()
+    uploaded = threading.Event()
+    uploads = []
+
+    def _upload(self, path, body, headers):
+        uploads.append((self, path, body, headers))
+        uploaded.set()
+
+    with mock.patch.object(http.PprofHTTPExporter, "_upload", _upload):
+        t = threading.Thread(target=server.serve)
+        t.start()
+        try:
+            upload_exporter = http.PprofHTTPExporter(
+                endpoint="http://localhost:8126",
+                service="myservice",
+                api_key="my-api-key",
+                container_info=None,
+            )
+            exp = sidecar.SidecarExporter(upload_exporter=upload_exporter, socket_path=socket_path)
+            # The API key is not sent to the helper process
+            assert "my-api-key" not in repr(exp.get_context())
+            exp.export(test_pprof.TEST_EVENTS, 1, 7)
+            assert uploaded.wait(10)
+            exp.close()
+        finally:
+            t.join()
+
+    # The socket is removed once the server is idle
+    assert not os.path.exists(socket_path)
+
+    [(helper_exporter, path, body, headers)] = uploads
+    assert path == "/profiling/v1/input"
+    assert headers["DD-API-KEY"] == b"my-api-key"
+    assert helper_exporter.tags == upload_exporter.tags
+    assert b"service:myservice" in body
+    assert ("runtime-id:%s" % http.runtime.get_runtime_id()).encode() in body
+
+
+def test_bind_stale_socket(socket_path):
+    os.mkdir(os.path.dirname(socket_path), 0o700)
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(socket_path)
+    stale.close()
+
+    server = sidecar.SidecarServer(socket_path)
+    server.bind()
+    try:
+        # Another server cannot listen on the same socket
+        with pytest.raises(socket.error):
+            sidecar.SidecarServer(socket_path).bind()
+    finally:
+        server.close()
+
+
+def test_start_helper(socket_path, monkeypatch):
+    monkeypatch.setenv("DD_PROFILING_SIDECAR_IDLE_TIMEOUT", "1")
+    sidecar.start_helper(socket_path, 10)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    finally:
+        sock.close()
+
+
+def test_export_error(tmp_path):
+    # The helper process cannot create the directory of the socket
+    (tmp_path / "file").write_text(u"")
+    exp = sidecar.SidecarExporter(
+        upload_exporter=http.PprofHTTPExporter(endpoint="http://localhost:8126", container_info=None),
+        socket_path=str(tmp_path / "file" / "sidecar.sock"),
+    )
+    with pytest.raises(exporter.ExportError):
+        exp.export(test_pprof.TEST_EVENTS, 1, 7)
+
+
+def test_main_already_running(socket_path):
+    server = sidecar.SidecarServer(socket_path)
+    server.bind()
+    try:
+        assert sidecar.main([socket_path]) == 0
+    finally:
+        server.close()
+
+
+def test_default_socket_path(monkeypatch, tmp_path):
+    monkeypatch.delenv("XDG_RUNTIME_DIR", raising=False)
+    path = sidecar.default_socket_path()
+    assert os.path.basename(os.path.dirname(path)) == "ddtrace-profiling-%d" % os.getuid()
+    assert "py%d%d" % sys.version_info[:2] in os.path.basename(path)
+
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    assert os.path.dirname(sidecar.default_socket_path()) == str(tmp_path / "ddtrace-profiling")
+
+    # Each API key and endpoint gets its own helper process
+    path = sidecar.default_socket_path("my-api-key", "https://intake.profile.datadoghq.com")
+    assert path == sidecar.default_socket_path("my-api-key", "https://intake.profile.datadoghq.com")
+    assert path != sidecar.default_socket_path("other-api-key", "https://intake.profile.datadoghq.com")
+    assert path != sidecar.default_socket_path("my-api-key", "https://intake.profile.datadoghq.eu")
+    assert path != sidecar.default_socket_path()
+    assert "my-api-key" not in path
+    exp = sidecar.SidecarExporter(
+        upload_exporter=http.PprofHTTPExporter(
+            endpoint="https://intake.profile.datadoghq.com", api_key="my-api-key", container_info=None
+        )
+    )
+    assert exp.socket_path == path
+
+
+def test_socket_directory(socket_path):
+    directory = os.path.dirname(socket_path)
+    with pytest.raises(OSError):
+        sidecar._check_socket_directory(socket_path)
+
+    sidecar._check_socket_directory(socket_path, create=True)
+    assert os.stat(directory).st_mode & 0o777 == 0o700
+    sidecar._check_socket_directory(socket_path)
+
+    # Other users could replace the socket
+    os.chmod(directory, 0o777)
+    with pytest.raises(OSError):
+        sidecar._check_socket_directory(socket_path, create=True)
+    with pytest.raises(OSError):
+        sidecar.SidecarServer(socket_path).bind()
+    exp = sidecar.SidecarExporter(
+        upload_exporter=http.PprofHTTPExporter(endpoint="http://localhost:8126", container_info=None),
+        socket_path=socket_path,
+    )
+    with pytest.raises(OSError):
+        exp._send(b"data")
+
+
+def test_check_peer(socket_path):
+    server = sidecar.SidecarServer(socket_path, idle_timeout=1)
+    server.bind()
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(socket_path)
+            uid = sidecar._peer_uid(sock)
+            assert uid in (None, os.getuid())
+            sidecar._check_peer(sock)
+
+            if uid is not None:
+                with mock.patch("os.getuid", return_value=uid + 1):
+                    with pytest.raises(OSError):
+                        sidecar._check_peer(sock)
+        finally:
+            sock.close()
+    finally:
+        server.close()
+
+
+def test_export_other_user(socket_path):
+    server = sidecar.SidecarServer(socket_path, idle_timeout=1)
+    server.bind()
+    try:
+        exp = sidecar.SidecarExporter(
+            upload_exporter=http.PprofHTTPExporter(endpoint="http://localhost:8126", container_info=None),
+            socket_path=socket_path,
+        )
+        with mock.patch("ddtrace.profiling.exporter.sidecar._peer_uid", return_value=os.getuid() + 1):
+            with pytest.raises(OSError):
+                exp._send(b"data")
+        assert exp._sock is None
+    finally:
+        server.close()
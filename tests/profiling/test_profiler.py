@@ -14,6 +14,7 @@ from ddtrace.profiling import exporter
 from ddtrace.profiling import profiler
 from ddtrace.profiling.collector import stack
 from ddtrace.profiling.exporter import http
+from ddtrace.profiling.exporter import sidecar
 
 
 def test_status():
@@ -221,6 +222,16 @@ def test_env_endpoint_url_no_agent(monkeypatch):
     _check_url(prof, "https://intake.profile.datadoghq.eu", "123", endpoint_path="/v1/input")
 
 
+@pytest.mark.skipif(not sidecar.is_supported(), reason="Unix sockets are not supported")
+def test_env_export_sidecar(monkeypatch):
+    monkeypatch.setenv("DD_PROFILING_EXPORT_SIDECAR", "true")
+    prof = profiler.Profiler(service="foobar")
+    [exp] = prof._profiler._scheduler.exporters
+    assert isinstance(exp, sidecar.SidecarExporter)
+    assert isinstance(exp.upload_exporter, http.PprofHTTPExporter)
+    assert exp.upload_exporter.service == "foobar"
+
+
 def test_copy():
     p = profiler._ProfilerInstance(env="123", version="dwq", service="foobar")
     c = p.copy()
@@ -1,4 +1,7 @@
 # -*- encoding: utf-8 -*-
+import os
+
+import mock
 import pytest
 
 from ddtrace.profiling import event
@@ -49,3 +52,23 @@ def test_limit():
     )
     assert r.events[stack.StackExceptionSampleEvent].maxlen == 12
     assert r.events[stack.StackSampleEvent].maxlen == 24
+
+
+def test_push_samples():
+    r = recorder.Recorder()
+    r.push_samples(stack.StackSampleAggregate, [], 10)
+    r.push_samples(stack.StackSampleAggregate, [("key", 1, 2), ("other", 3, 4)], 10)
+    r.push_samples(stack.StackSampleAggregate, [("key", 5, 6)], 20)
+
+    aggregate = r.reset()[stack.StackSampleAggregate]
+    assert aggregate.samples == {"key": [2, 6, 8], "other": [1, 3, 4]}
+    assert aggregate.nsamples == 3
+    assert aggregate.sampling_period_sum == 40
+    assert r.events[stack.StackSampleAggregate].samples == {}
+
+
+def test_push_samples_forked():
+    r = recorder.Recorder()
+    with mock.patch("os.getpid", return_value=os.getpid() + 1):
+        r.push_samples(stack.StackSampleAggregate, [("key", 1, 2)], 10)
+    assert r.events[stack.StackSampleAggregate].nsamples == 0
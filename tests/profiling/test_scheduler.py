@@ -1,10 +1,13 @@
 # -*- encoding: utf-8 -*-
 import logging
 
+import pytest
+
 from ddtrace.profiling import event
 from ddtrace.profiling import exporter
 from ddtrace.profiling import recorder
 from ddtrace.profiling import scheduler
+from ddtrace.profiling.collector import _traceback
 
 
 class _FailExporter(exporter.Exporter):
@@ -54,3 +57,21 @@ def test_before_flush_failure(caplog):
     assert caplog.record_tuples == [
         (("ddtrace.profiling.scheduler", logging.ERROR, "Scheduler before_flush hook failed"))
     ]
+
+
+def test_flush_stack_table():
+    table = _traceback.StackTable()
+    r = recorder.Recorder()
+    s = scheduler.Scheduler(r, [exporter.NullExporter()], stack_table=table)
+    stack = table.frames_to_stack([("foo.py", 1, "foo")])
+    s.flush()
+
+    # An event recorded while the profile is flushed is exported with the next profile
+    r.push_event(event.StackBasedEvent(stack=stack))
+    s.flush()
+    assert table.stack_to_frames(stack) == [("foo.py", 1, "foo")]
+
+    # The frames unused since the previous flush are dropped
+    s.flush()
+    with pytest.raises(KeyError):
+        table.stack_to_frames(stack)
@@ -1,4 +1,14 @@
+import os
+import socket
+import threading
+
+import mock
+import pytest
+
+from ddtrace.compat import get_connection_response
 from ddtrace.internal import agent
+from ddtrace.vendor.six.moves import BaseHTTPServer
+from ddtrace.vendor.six.moves import socketserver
 
 
 def test_hostname(monkeypatch):
@@ -41,3 +51,134 @@ def test_stats_url(monkeypatch):
 
     monkeypatch.setenv("DD_DOGSTATSD_URL", "udp://mars:1234")
     assert agent.get_stats_url() == "udp://mars:1234"
+
+
+class _KeepAliveRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    @staticmethod
+    def log_message(format, *args):  # noqa: A002
+        pass
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"OK")
+
+
+@pytest.fixture
+def keep_alive_server():
+    server = socketserver.ThreadingTCPServer(("localhost", 0), _KeepAliveRequestHandler)
+    server.daemon_threads = True
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        t.join()
+
+
+class _ClosingRequestHandler(_KeepAliveRequestHandler):
+    def do_PUT(self):
+        _KeepAliveRequestHandler.do_PUT(self)
+        # Close the connection without telling the client
+        self.close_connection = True
+
+
+def _put(pool):
+    with pool.connection() as conn:
+        conn.request("PUT", "/", b"data", {"Content-Length": "4"})
+        resp = get_connection_response(conn)
+        assert resp.read() == b"OK"
+        return conn
+
+
+def test_connection_pool_reuse(keep_alive_server):
+    pool = agent.ConnectionPool("http://localhost:%d" % keep_alive_server.server_address[1])
+    conn = _put(pool)
+    assert _put(pool) is conn
+    sock = conn.sock
+    assert _put(pool).sock is sock
+    pool.close()
+    assert conn.sock is None
+
+
+def test_connection_pool_dropped_connection(keep_alive_server):
+    pool = agent.ConnectionPool("http://localhost:%d" % keep_alive_server.server_address[1])
+    conn = _put(pool)
+    # Simulate the agent closing the idle connection
+    conn.sock.shutdown(socket.SHUT_RD)
+    new_conn = _put(pool)
+    assert new_conn is not conn
+    assert conn.sock is None
+
+
+def test_connection_pool_error_closes_connection():
+    pool = agent.ConnectionPool("http://localhost:2")
+    with pytest.raises((IOError, OSError)):
+        _put(pool)
+    assert pool._idle == []
+
+
+def test_connection_pool_maxsize(keep_alive_server):
+    pool = agent.ConnectionPool("http://localhost:%d" % keep_alive_server.server_address[1], maxsize=1)
+    with pool.connection() as c1:
+        c1.connect()
+        with pool.connection() as c2:
+            c2.connect()
+            assert c1 is not c2
+    assert pool._idle == [c2]
+    assert c1.sock is None
+
+
+def test_connection_pool_fork(keep_alive_server):
+    pool = agent.ConnectionPool("http://localhost:%d" % keep_alive_server.server_address[1])
+    conn = _put(pool)
+
+    pid = os.fork()
+    if pid == 0:
+        # child
+        if pool._idle != [] or conn.sock is not None:
+            os._exit(1)
+        os._exit(12)
+
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 12
+    assert _put(pool) is conn
+
+
+def test_connection_pool_request(keep_alive_server):
+    pool = agent.ConnectionPool("http://localhost:%d" % keep_alive_server.server_address[1])
+    resp, body = pool.request("PUT", "/", b"data", {"Content-Length": "4"})
+    assert (resp.status, body) == (200, b"OK")
+    [conn] = pool._idle
+    resp, body = pool.request("PUT", "/", b"data", {"Content-Length": "4"})
+    assert pool._idle == [conn]
+
+
+def test_connection_pool_request_connection_reset(keep_alive_server):
+    keep_alive_server.RequestHandlerClass = _ClosingRequestHandler
+    pool = agent.ConnectionPool("http://localhost:%d" % keep_alive_server.server_address[1])
+    pool.request("PUT", "/", b"data", {"Content-Length": "4"})
+    [conn] = pool._idle
+
+    # The connection is closed by the agent after it has been checked
+    with mock.patch("ddtrace.internal.agent._is_connection_dropped", return_value=False):
+        resp, body = pool.request("PUT", "/", b"data", {"Content-Length": "4"})
+
+    assert (resp.status, body) == (200, b"OK")
+    assert conn.sock is None
+    assert pool._idle and pool._idle[0] is not conn
+
+
+def test_connection_pool_request_error():
+    pool = agent.ConnectionPool("http://localhost:2")
+    with pytest.raises((IOError, OSError)):
+        pool.request("PUT", "/", b"data")
+    assert pool._idle == []
@@ -1,82 +1,46 @@
-import pytest
-
-from ddtrace.internal.buffer import BufferFull
-from ddtrace.internal.buffer import BufferItemTooLarge
-from ddtrace.internal.buffer import TraceBuffer
-
-
-def test_buffer_put_get():
-    buf = TraceBuffer(max_size=10, max_item_size=3)
-    buf.put([1, 2, 3])
-    assert len(buf) == 1
-    assert buf.size == 3
-
-    buf.put([3, 2])
-    assert len(buf) == 2
-    assert buf.size == 5
-
-    items = buf.get()
-    assert len(buf) == 0
-    assert buf.size == 0
-    assert items == [[1, 2, 3], [3, 2]]
-
-    buf.put("123")
-    buf.put("45")
-    buf.put("67")
-    buf.put("89")
-    buf.put("0")
-    assert buf.size == 10
-    assert len(buf) == 5
-    assert buf.get() == ["123", "45", "67", "89", "0"]
-    assert buf.size == 0
-
-
-def test_buffer_size_limit():
-    buf = TraceBuffer(max_size=10, max_item_size=3)
-    buf.put([3])
-    for i in range(9):
-        buf.put([0])
-
-    with pytest.raises(BufferFull):
-        buf.put([1])
+import threading
 
-    with pytest.raises(BufferFull):
-        buf.put([1])
-
-
-def test_buffer_item_size_limit():
-    buf = TraceBuffer(max_size=10, max_item_size=3)
-
-    with pytest.raises(BufferItemTooLarge):
-        buf.put([i for i in range(10000)])
-
-    with pytest.raises(BufferItemTooLarge):
-        buf.put([1, 2, 3, 4])
-
-    buf.put([1, 2, 3])
-    assert buf.size == 3
-
-
-def test_buffer_many_items():
-    buf = TraceBuffer(max_size=10000, max_item_size=50)
-    for _ in range(10000):
-        buf.put("1")
-    assert buf.size == 10000
-    assert len(buf) == 10000
-
-    items = buf.get()
-    assert len(items) == 10000
-    for i in items:
-        assert i == "1"
-
-    for _ in range(200):
-        buf.put("1" * 50)
-    assert buf.size == 10000
-    assert len(buf) == 200
+import pytest
 
-    with pytest.raises(BufferFull):
-        buf.put("1")
-    items = buf.get()
-    assert len(items) == 200
-    for i in items:
-        assert i == "1" * 50
+from ddtrace.internal.buffer import TraceQueue
+
+
+@pytest.mark.parametrize(
+    "policy,expected",
+    [
+        ("drop-newest", [1, 2]),
+        ("drop-oldest", [2, 3]),
+        ("block", [1, 2]),
+    ],
+)
+def test_queue_policy(policy, expected):
+    queue = TraceQueue(maxsize=2, policy=policy, timeout=0.01)
+    assert queue.put(1) is None
+    assert queue.put(2) is None
+    assert len(queue) == 2
+
+    # The dropped item is returned
+    assert queue.put(3) == (1 if policy == "drop-oldest" else 3)
+    assert queue.get() == expected
+    assert len(queue) == 0
+
+
+def test_queue_block_until_get():
+    queue = TraceQueue(maxsize=1, policy="block", timeout=10)
+    queue.put(1)
+
+    got = []
+    t = threading.Thread(target=lambda: got.append(queue.get()))
+    timer = threading.Timer(0.05, t.start)
+    timer.start()
+    # The put waits for the queue to be emptied by the getter
+    assert queue.put(2) is None
+    timer.join()
+    t.join()
+    assert got == [[1]]
+    assert queue.get() == [2]
+
+
+def test_queue_invalid_policy():
+    with pytest.raises(ValueError):
+        TraceQueue(maxsize=1, policy="drop-everything")
@@ -7,6 +7,7 @@ import pytest
 
 # Project
 from ddtrace.compat import PY3
+from ddtrace.compat import bounded_cache
 from ddtrace.compat import get_connection_response
 from ddtrace.compat import is_integer
 from ddtrace.compat import reraise
@@ -121,3 +122,29 @@ class TestPy2Py3Compat(object):
 )
 def test_is_integer(obj, expected):
     assert is_integer(obj) is expected
+
+
+def test_bounded_cache():
+    calls = []
+
+    @bounded_cache(maxsize=2)
+    def f(a, b):
+        calls.append((a, b))
+        return a + b
+
+    assert f(1, 2) == 3
+    assert f(1, 2) == 3
+    assert calls == [(1, 2)]
+
+    # The cache is cleared once full
+    assert f(2, 3) == 5
+    assert f(3, 4) == 7
+    assert f(1, 2) == 3
+    assert calls == [(1, 2), (2, 3), (3, 4), (1, 2)]
+
+    f.cache_clear()
+    f(1, 2)
+    assert len(calls) == 5
+
+    with pytest.raises(TypeError):
+        f([], [])
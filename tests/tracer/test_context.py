@@ -192,3 +192,103 @@ class TestTracingContext(BaseTestCase):
         assert cloned_ctx.dd_origin == ctx.dd_origin
         assert cloned_ctx._current_span == ctx._current_span
         assert cloned_ctx._trace == []
+
+    @mock.patch.object(Context, "_partial_flush_enabled", True)
+    @mock.patch.object(Context, "_partial_flush_min_spans", 2)
+    def test_partial_flush(self):
+        ctx = Context()
+        root = Span(tracer=None, name="root")
+        ctx.add_span(root)
+        children = []
+        for i in range(5):
+            child = Span(tracer=None, name="child_%d" % i, trace_id=root.trace_id, parent_id=root.span_id)
+            child._parent = root
+            ctx.add_span(child)
+            children.append(child)
+
+        def close(span):
+            span.finished = True
+            return ctx.close_span(span)
+
+        # The finished spans are flushed as soon as there are enough of them
+        assert close(children[3]) == (None, None)
+        assert close(children[1]) == ([children[3], children[1]], True)
+        assert ctx._trace == [root, children[0], children[2], children[4]]
+
+        assert close(children[0]) == (None, None)
+        assert close(children[2]) == ([children[0], children[2]], True)
+        assert close(children[4]) == (None, None)
+
+        # The rest of the trace is flushed when the root span is closed
+        assert close(root) == ([root, children[4]], True)
+        assert ctx._trace == []
+        assert ctx._finished == []
+        assert ctx.get_current_span() is None
+
+    @mock.patch.object(Context, "_partial_flush_enabled", True)
+    @mock.patch.object(Context, "_partial_flush_min_bytes", 5000)
+    def test_partial_flush_bytes(self):
+        ctx = Context()
+        root = Span(tracer=None, name="root")
+        ctx.add_span(root)
+
+        # Small spans are flushed by the number of spans
+        flushed = []
+        for i in range(600):
+            child = Span(tracer=None, name="child", trace_id=root.trace_id, parent_id=root.span_id)
+            ctx.add_span(child)
+            child.finished = True
+            trace, _ = ctx.close_span(child)
+            if trace:
+                flushed.append(len(trace))
+        assert flushed[0] < 500
+        assert ctx._finished_bytes < 5000
+
+        # Large spans are flushed as soon as they exceed the size
+        child = Span(tracer=None, name="child", trace_id=root.trace_id, parent_id=root.span_id)
+        ctx.add_span(child)
+        child.set_tag("large", "x" * 10000)
+        child.finished = True
+        trace, sampled = ctx.close_span(child)
+        assert trace[-1] is child
+        assert ctx._finished_bytes == 0
+
+    @mock.patch.object(Context, "_trace_max_bytes", 5000)
+    def test_trace_max_bytes(self):
+        ctx = Context()
+        root = Span(tracer=None, name="root")
+        ctx.add_span(root)
+
+        for i in range(1000):
+            resource = "SELECT %d" % (i % 2)
+            child = Span(tracer=None, name="query", resource=resource, trace_id=root.trace_id, parent_id=root.span_id)
+            child._parent = root
+            ctx.add_span(child)
+            if i == 10:
+                child.error = 1
+            child.start_ns = root.start_ns + i
+            child.duration_ns = i
+            assert ctx.close_span(child) == (None, None)
+            # The spans beyond the cap are not retained
+            assert len(ctx._trace) < 10
+
+        root.finished = True
+        trace, sampled = ctx.close_span(root)
+        assert sampled is True
+        assert trace[0] is root
+        retained = [s for s in trace if s.get_metric("_dd.summary.span_count") is None]
+        summaries = sorted(
+            (s for s in trace if s.get_metric("_dd.summary.span_count") is not None), key=lambda s: s.resource
+        )
+        assert len(retained) + sum(s.get_metric("_dd.summary.span_count") for s in summaries) == 1001
+        assert [s.resource for s in summaries] == ["SELECT 0", "SELECT 1"]
+        for s in summaries:
+            assert s.name == "query"
+            assert s.trace_id == root.trace_id
+            assert s.parent_id == root.span_id
+        assert summaries[0].get_metric("_dd.summary.error_count") == 1
+        assert summaries[1].get_metric("_dd.summary.error_count") == 0
+        assert summaries[0].get_metric("_dd.summary.max_duration") == 998
+        assert summaries[1].get_metric("_dd.summary.max_duration") == 999
+        assert sum(s.duration_ns for s in trace[1:]) == sum(range(1000))
+        assert ctx._summaries == {}
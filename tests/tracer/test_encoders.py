@@ -3,6 +3,7 @@ import json
 import random
 import string
 import struct
+import threading
 from unittest import TestCase
 
 import msgpack
@@ -14,6 +15,12 @@ from ddtrace.encoding import JSONEncoder
 from ddtrace.encoding import JSONEncoderV2
 from ddtrace.encoding import MsgpackEncoder
 from ddtrace.encoding import _EncoderBase
+from ddtrace.internal._encoding import BufferedEncoder
+from ddtrace.internal._encoding import BufferedEncoderV05
+from ddtrace.internal._encoding import Packer
+from ddtrace.internal._encoding import ShardedEncoder
+from ddtrace.internal.buffer import BufferFull
+from ddtrace.internal.buffer import BufferItemTooLarge
 from ddtrace.span import Span
 from ddtrace.span import SpanTypes
 from ddtrace.tracer import Tracer
@@ -337,6 +344,299 @@ def test_custom_msgpack_join_encoded():
     assert decode(ref) == decode(custom)
 
 
+def test_custom_msgpack_encode_reuse():
+    encoder = MsgpackEncoder()
+    refencoder = RefMsgpackEncoder()
+
+    small = gen_trace(nspans=2, ntags=2)
+    # Large enough for the packer buffer to grow past the size it retains
+    large = gen_trace(nspans=2, ntags=2)
+    large[0].set_tag("large", "x" * (2 << 20))
+
+    for trace in (small, large, small, large):
+        assert decode(encoder.encode_trace(trace)) == decode(refencoder.encode_trace(trace))
+
+    bad_trace = [Span(None, "span_name")]
+    bad_trace[0].meta["key"] = object()
+    with pytest.raises(TypeError):
+        encoder.encode_trace(bad_trace)
+    assert decode(encoder.encode_trace(small)) == decode(refencoder.encode_trace(small))
+
+
+@pytest.mark.parametrize("size", [0, 255, 256, 65535, 65536])
+def test_packer_bytearray(size):
+    data = bytearray(b"x" * size)
+    packed = Packer().pack({"bin": data, "raw": bytes(data)})
+
+    assert msgpack.unpackb(packed, raw=True) == {b"bin": bytes(data), b"raw": bytes(data)}
+    # DEV: bytearray are packed as binary data, which the decoder returns as bytes even when it decodes the strings
+    assert msgpack.unpackb(packed, raw=False)["bin"] == bytes(data)
+
+
+def test_custom_msgpack_encode_threads():
+    encoder = MsgpackEncoder()
+    refencoder = RefMsgpackEncoder()
+    traces = [gen_trace(nspans=10, ntags=5) for _ in range(4)]
+    errors = []
+
+    def encode(trace):
+        expected = decode(refencoder.encode_trace(trace))
+        for _ in range(50):
+            if decode(encoder.encode_trace(trace)) != expected:
+                errors.append(trace)
+
+    threads = [threading.Thread(target=encode, args=(trace,)) for trace in traces]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+
+
+@pytest.mark.parametrize("ntraces", [0, 1, 15, 16, 0xFFFF, 0x10000])
+def test_buffered_encoder(ntraces):
+    encoder = BufferedEncoder(max_size=1 << 30, max_item_size=1 << 20)
+    refencoder = RefMsgpackEncoder()
+
+    trace = [Span(None, "span_name", service="my-svc")]
+    trace[0].finish()
+    for _ in range(ntraces):
+        encoder.put(trace)
+
+    assert len(encoder) == ntraces
+    payload = encoder.encode()
+    assert len(encoder) == 0
+    assert encoder.size == 0
+
+    if ntraces == 0:
+        assert payload is None
+        return
+
+    ref = refencoder.join_encoded([refencoder.encode_trace(trace) for _ in range(ntraces)])
+    assert payload.count == ntraces
+    assert len(payload) == len(ref)
+    assert payload.getvalue() == bytes(memoryview(payload))
+    assert decode(payload) == decode(ref)
+
+
+def test_buffered_encoder_reuse():
+    encoder = BufferedEncoder(max_size=1 << 20, max_item_size=1 << 20)
+    refencoder = RefMsgpackEncoder()
+    trace = gen_trace(nspans=10)
+
+    encoder.put(trace)
+    first = encoder.encode()
+    encoder.put(trace)
+    encoder.put(trace)
+    second = encoder.encode()
+
+    # The first payload must not be affected by the traces encoded afterwards
+    assert decode(first) == decode(refencoder.join_encoded([refencoder.encode_trace(trace)]))
+    assert decode(second) == decode(refencoder.join_encoded([refencoder.encode_trace(trace)] * 2))
+
+
+def test_buffered_encoder_limits():
+    trace = [Span(None, "span_name")]
+    trace[0].finish()
+    item_len = len(MsgpackEncoder().encode_trace(trace))
+
+    encoder = BufferedEncoder(max_size=item_len * 3, max_item_size=item_len)
+    for _ in range(3):
+        encoder.put(trace)
+    assert encoder.size == item_len * 3
+
+    with pytest.raises(BufferFull) as e:
+        encoder.put(trace)
+    assert e.value.args == (item_len,)
+    assert len(encoder) == 3
+    assert encoder.size == item_len * 3
+
+    with pytest.raises(BufferItemTooLarge) as e:
+        encoder.put(trace * 2)
+    assert len(encoder) == 3
+    assert encoder.size == item_len * 3
+
+    assert encoder.encode().count == 3
+    encoder.put(trace)
+    assert encoder.size == item_len
+
+
+def test_buffered_encoder_error():
+    encoder = BufferedEncoder(max_size=1 << 20, max_item_size=1 << 20)
+    trace = [Span(None, "span_name")]
+    trace[0].finish()
+    encoder.put(trace)
+    size = encoder.size
+
+    bad_trace = [Span(None, "span_name")]
+    bad_trace[0].meta["key"] = object()
+    with pytest.raises(TypeError):
+        encoder.put(bad_trace)
+
+    assert len(encoder) == 1
+    assert encoder.size == size
+    assert decode(encoder.encode()) == decode(
+        RefMsgpackEncoder().join_encoded([RefMsgpackEncoder().encode_trace(trace)])
+    )
+
+
+def _put_from_threads(encoder, traces, nthreads):
+    errors = []
+
+    def put():
+        for trace in traces:
+            try:
+                encoder.put(trace)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=put) for _ in range(nthreads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return errors
+
+
+@pytest.mark.parametrize("nthreads", [1, 2, 8, 20])
+def test_sharded_encoder(nthreads):
+    encoder = ShardedEncoder(max_size=1 << 30, max_item_size=1 << 20, shards=8)
+    refencoder = RefMsgpackEncoder()
+    traces = [gen_trace(nspans=3, ntags=2) for _ in range(10)]
+
+    assert _put_from_threads(encoder, traces, nthreads) == []
+    assert len(encoder) == 10 * nthreads
+
+    payload = encoder.encode()
+    assert len(encoder) == 0
+    assert encoder.size == 0
+    assert encoder.encode() is None
+    assert payload.count == 10 * nthreads
+    decoded = decode(payload)
+    assert len(decoded) == 10 * nthreads
+    # Traces are merged shard by shard, so only the traces of each thread keep their order
+    key = lambda trace: trace[0][b"span_id"]  # noqa: E731
+    assert sorted(decoded, key=key) == sorted(decode(refencoder.encode_traces(traces * nthreads)), key=key)
+
+
+def test_sharded_encoder_limits():
+    trace = [Span(None, "span_name")]
+    trace[0].finish()
+    item_len = len(MsgpackEncoder().encode_trace(trace))
+
+    # The shards share the buffer size limit
+    encoder = ShardedEncoder(max_size=item_len * 10, max_item_size=item_len, shards=4)
+    errors = _put_from_threads(encoder, [trace] * 10, 4)
+    assert len(errors) == 30
+    assert all(isinstance(e, BufferFull) and e.args == (item_len,) for e in errors)
+    assert len(encoder) == 10
+    assert encoder.size == item_len * 10
+
+    with pytest.raises(BufferItemTooLarge):
+        encoder.put(trace * 2)
+
+    assert encoder.encode().count == 10
+    assert encoder.size == 0
+    encoder.put(trace)
+    assert encoder.size == item_len
+
+
+def test_sharded_encoder_shards():
+    with pytest.raises(ValueError):
+        ShardedEncoder(max_size=1 << 20, max_item_size=1 << 20, shards=0)
+
+
+def decode_v05(payload):
+    """Decode a v0.5 payload into the list of traces of span dicts of the v0.4 format."""
+    strings, traces = msgpack.unpackb(payload, raw=True, strict_map_key=False)
+
+    def span_dict(span):
+        # v0.5 has no null values: missing values are encoded as zero or the empty string
+        d = {
+            b"service": strings[span[0]] or None,
+            b"name": strings[span[1]] or None,
+            b"resource": strings[span[2]] or None,
+            b"trace_id": span[3],
+            b"span_id": span[4],
+            b"parent_id": span[5] or None,
+            b"start": span[6],
+            b"duration": span[7],
+            b"error": span[8],
+        }
+        if span[9]:
+            d[b"meta"] = {strings[k]: strings[v] for k, v in span[9].items()}
+        if span[10]:
+            d[b"metrics"] = {strings[k]: v for k, v in span[10].items()}
+        if span[11]:
+            d[b"type"] = strings[span[11]]
+        return d
+
+    assert strings[0] == b""
+    assert len(set(strings)) == len(strings)
+    return [[span_dict(span) for span in trace] for trace in traces]
+
+
+def test_buffered_encoder_v05():
+    encoder = BufferedEncoderV05(max_size=1 << 20, max_item_size=1 << 20)
+    refencoder = RefMsgpackEncoder()
+
+    traces = [gen_trace(nspans=10, ntags=5) for _ in range(3)]
+    for trace in traces:
+        encoder.put(trace)
+    assert len(encoder) == 3
+
+    payload = encoder.encode()
+    assert payload.count == 3
+    assert decode_v05(payload) == decode(refencoder.encode_traces(traces))
+    assert len(encoder) == 0
+
+    # The string table is reset between payloads
+    trace = [Span(None, "span_name", service="my-svc", parent_id=1)]
+    trace[0].finish()
+    encoder.put(trace)
+    payload = encoder.encode()
+    strings, _ = msgpack.unpackb(payload, raw=True, strict_map_key=False)
+    assert sorted(strings) == sorted([b"", b"span_name", b"my-svc"])
+    assert decode_v05(payload) == decode(refencoder.encode_traces([trace]))
+
+
+def test_buffered_encoder_v05_size():
+    encoder = BufferedEncoderV05(max_size=1 << 20, max_item_size=1 << 20)
+    trace = gen_trace(nspans=10, ntags=5)
+
+    encoder.put(trace)
+    size = encoder.size
+    # Strings are only encoded once per payload
+    encoder.put(trace)
+    assert encoder.size < 2 * size
+    assert len(encoder.encode()) <= encoder.max_size
+
+
+def test_buffered_encoder_v05_rollback():
+    trace = [Span(None, "span_name")]
+    trace[0].finish()
+
+    encoder = BufferedEncoderV05(max_size=1 << 20, max_item_size=1 << 20)
+    encoder.put(trace)
+    size = encoder.size
+
+    bad_trace = [Span(None, "new_name", resource="new_resource")]
+    bad_trace[0].metrics["key"] = object()
+    with pytest.raises(TypeError):
+        encoder.put(bad_trace)
+    assert encoder.size == size
+
+    with pytest.raises(BufferItemTooLarge):
+        encoder.put([Span(None, "x" * (2 << 20))])
+    assert encoder.size == size
+
+    payload = encoder.encode()
+    strings, _ = msgpack.unpackb(payload, raw=True, strict_map_key=False)
+    assert b"new_name" not in strings
+    assert decode_v05(payload) == decode(RefMsgpackEncoder().encode_traces([trace]))
+
+
 def span_type_span():
     s = Span(None, "span_name")
     s.span_type = SpanTypes.WEB
@@ -396,3 +696,50 @@ def test_span_types(span, tags):
 
     trace = [span]
     assert decode(refencoder.encode_trace(trace)) == decode(encoder.encode_trace(trace))
+
+
+def _ref_json_spans(trace, hex_ids):
+    """Return the span dicts the JSON encoders used to encode with ``Span.to_dict``."""
+    spans = [span.to_dict() for span in trace]
+    if hex_ids:
+        for d in spans:
+            for key in ("trace_id", "parent_id", "span_id"):
+                d[key] = JSONEncoderV2._encode_id_to_hex(d.get(key))
+    return spans
+
+
+def _json_span(meta=None, metrics=None, **kwargs):
+    span = Span(None, kwargs.pop("name", "name"), **kwargs)
+    span.meta.update(meta or {})
+    span.metrics.update(metrics or {})
+    return span
+
+
+@pytest.mark.parametrize("encoder_cls,hex_ids", [(JSONEncoder, False), (JSONEncoderV2, True)])
+@pytest.mark.parametrize(
+    "span",
+    [
+        _json_span(),
+        _json_span(service="my-svc", resource="GET /", span_type="web", parent_id=42),
+        _json_span(name=SubString("name"), resource=u'é"\\\n'),
+        _json_span(resource=u"\x00\x1f\x7f\b\f\t\r\u2028\U0001f610", meta={"surrogate": u"\ud800"}),
+        _json_span(meta={"key": "value", u"\U0001f610": u"\U0001f610", "int": 1, "none": None}),
+        _json_span(meta={SubString("key"): SubString("value")}),
+        _json_span(meta={1: "int key", "str": "value"}),
+        _json_span(metrics={"int": 1, "float": 1.5, "sub": SubFloat(0.1), "subint": SubInt(2), "bool": True}),
+        _json_span(
+            metrics={"nan": float("nan"), "inf": float("inf"), "-inf": float("-inf"), "big": 1 << 70, "neg": -3}
+        ),
+    ],
+)
+@pytest.mark.parametrize("error", [0, 1, True, False])
+def test_json_encoder_span_variations(encoder_cls, hex_ids, span, error):
+    span.error = error
+    span.finish()
+    traces = [[span, span], [span]]
+
+    encoder = encoder_cls()
+    ref_traces = [_ref_json_spans(trace, hex_ids) for trace in traces]
+    # The output is the same as the json.dumps of the span dicts
+    assert encoder.encode_trace(traces[0]) == json.dumps(ref_traces[0])
+    assert encoder.encode_traces(traces) == json.dumps({"traces": ref_traces} if hex_ids else ref_traces)
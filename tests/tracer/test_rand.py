@@ -26,6 +26,35 @@ def test_random():
         m.add(n)
 
 
+def xorshift(state, n):
+    # Reference implementation of the generator, one number at a time
+    numbers = []
+    for _ in range(n):
+        state ^= state >> 21
+        state ^= (state << 35) & 0xFFFFFFFFFFFFFFFF
+        state ^= state >> 4
+        numbers.append((state * 2685821657736338717) & 0xFFFFFFFFFFFFFFFF)
+    return numbers, state
+
+
+def test_batched_sequence():
+    # The buffered numbers are the same as the ones generated one at a time
+    _rand.seed()
+    expected, state = xorshift(_rand._getstate(), 3 * 1024)
+
+    assert [_rand.rand64bits(check_pid=False) for _ in range(3 * 1024)] == expected
+    assert _rand._getstate() == state
+
+
+def test_seed_discards_buffer():
+    _rand.rand64bits()
+    _rand.seed()
+    [expected], _ = xorshift(_rand._getstate(), 1)
+
+    # The next number is generated from the new seed
+    assert _rand.rand64bits() == expected
+
+
 def test_fork_no_pid_check():
     q = MPQueue()
     pid = os.fork()
@@ -38,14 +67,9 @@ def test_fork_no_pid_check():
         rns = {_rand.rand64bits(check_pid=False) for _ in range(100)}
         child_rns = q.get()
 
-        if PYTHON_VERSION_INFO >= (3, 7):
-            # Python 3.7+ have fork hooks which should be used
-            # Hence we should not get any collisions
-            assert rns & child_rns == set()
-        else:
-            # Python < 3.7 we don't have any mechanism (other than the pid
-            # check) to reseed on so we expect there to be collisions.
-            assert rns == child_rns
+        # The fork hooks of forksafe reseed the child process
+        # Hence we should not get any collisions
+        assert rns & child_rns == set()
 
     else:
         # child
@@ -1,5 +1,7 @@
 from __future__ import division
 
+import threading
+
 import mock
 import pytest
 
@@ -103,6 +105,30 @@ def test_rate_limiter_is_allowed_small_gaps():
             assert limiter.is_allowed() is True
 
 
+def test_rate_limiter_is_allowed_threads():
+    limiter = RateLimiter(rate_limit=100)
+    allowed = []
+
+    def check():
+        allowed.extend(limiter.is_allowed() for _ in range(1000))
+
+    now = compat.monotonic()
+    with mock.patch("ddtrace.compat.monotonic") as mock_time:
+        # Keep the same timeframe
+        mock_time.return_value = now
+
+        threads = [threading.Thread(target=check) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    # No more than the limit is allowed, whatever the threads
+    assert allowed.count(True) == 100
+    assert limiter.tokens_total == 8000
+    assert limiter.tokens_allowed == 100
+
+
 def test_rate_liimter_effective_rate_rates():
     limiter = RateLimiter(rate_limit=100)
 
@@ -0,0 +1,101 @@
+import mock
+import pytest
+
+from ddtrace.internal.retry import RetryQueue
+from ddtrace.internal.retry import SpillRing
+
+
+@pytest.fixture
+def ring():
+    ring = SpillRing(capacity=10)
+    try:
+        yield ring
+    finally:
+        ring.close()
+
+
+def test_spill_ring_fifo(ring):
+    assert ring.peek() is None
+    assert ring.put(b"abc", 1) == []
+    assert ring.put(bytearray(b"defg"), 2) == []
+    assert len(ring) == 2
+    assert ring.size == 7
+
+    assert ring.peek() == (b"abc", 1)
+    ring.pop()
+    assert ring.peek() == (b"defg", 2)
+    ring.pop()
+    assert ring.peek() is None
+    assert ring.size == 0
+
+
+def test_spill_ring_wrap_around(ring):
+    ring.put(b"abcd", 1)
+    ring.put(b"efgh", 2)
+    ring.pop()
+    # Does not fit at the end of the file but fits at the beginning
+    assert ring.put(b"ijkl", 3) == []
+    assert ring.size == 8
+    assert ring.peek() == (b"efgh", 2)
+    ring.pop()
+    assert ring.peek() == (b"ijkl", 3)
+
+
+def test_spill_ring_evict(ring):
+    ring.put(b"abcd", 1)
+    ring.put(b"efgh", 2)
+    # The oldest payloads are evicted to make room
+    assert ring.put(b"ijklmn", 3) == [(4, 1), (4, 2)]
+    assert len(ring) == 1
+    assert ring.peek() == (b"ijklmn", 3)
+
+    # Payloads larger than the ring are dropped
+    assert ring.put(b"x" * 11, 4) == [(11, 4)]
+    assert ring.peek() == (b"ijklmn", 3)
+
+
+def test_retry_queue_limit():
+    queue = RetryQueue(max_size=8)
+    assert queue.put(b"abcd", 1) == []
+    assert queue.put(b"efgh", 2) == []
+    assert queue.put(b"ijkl", 3) == [(4, 1)]
+    assert len(queue) == 2
+    assert queue.size == 8
+    assert queue.peek() == (b"efgh", 2)
+
+
+def test_retry_queue_spill(ring):
+    queue = RetryQueue(max_size=4, spill=ring)
+    assert queue.put(b"abcd", 1) == []
+    assert queue.put(b"efgh", 2) == []
+    assert queue.put(b"ijkl", 3) == []
+    assert len(queue) == 3
+    assert queue.size == 12
+    assert ring.size == 8
+
+    # The spilled payloads are the oldest
+    payloads = []
+    while queue.peek() is not None:
+        payloads.append(queue.peek())
+        queue.pop()
+    assert payloads == [(b"abcd", 1), (b"efgh", 2), (b"ijkl", 3)]
+    assert queue.size == 0
+
+
+def test_retry_queue_backoff():
+    queue = RetryQueue(max_size=8, base_delay=1, max_delay=10)
+    assert queue.ready()
+
+    with mock.patch("ddtrace.internal.retry.monotonic", return_value=100.0):
+        delays = []
+        for _ in range(6):
+            queue.failed()
+            delays.append(queue._next_attempt - 100.0)
+        assert not queue.ready()
+
+    # The delays double, with some jitter, up to the maximum delay
+    for delay, expected in zip(delays, [1, 2, 4, 8, 10, 10]):
+        assert expected / 2.0 <= delay <= expected
+
+    queue.succeeded()
+    assert queue.ready()
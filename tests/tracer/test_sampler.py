@@ -1,5 +1,6 @@
 from __future__ import division
 
+import json
 import re
 import unittest
 
@@ -7,6 +8,7 @@ import mock
 import pytest
 
 from ddtrace.compat import iteritems
+from ddtrace.constants import MANUAL_KEEP_KEY
 from ddtrace.constants import SAMPLE_RATE_METRIC_KEY
 from ddtrace.constants import SAMPLING_AGENT_DECISION
 from ddtrace.constants import SAMPLING_LIMIT_DECISION
@@ -14,12 +16,16 @@ from ddtrace.constants import SAMPLING_PRIORITY_KEY
 from ddtrace.constants import SAMPLING_RULE_DECISION
 from ddtrace.ext.priority import AUTO_KEEP
 from ddtrace.ext.priority import AUTO_REJECT
+from ddtrace.ext.priority import USER_KEEP
 from ddtrace.internal.rate_limiter import RateLimiter
+from ddtrace.propagation.http import HTTPPropagator
+from ddtrace.propagation.http import HTTP_HEADER_SAMPLING_PRIORITY
 from ddtrace.sampler import AllSampler
 from ddtrace.sampler import DatadogSampler
 from ddtrace.sampler import RateByServiceSampler
 from ddtrace.sampler import RateSampler
 from ddtrace.sampler import SamplingRule
+from ddtrace.sampler import _literal_prefix
 from ddtrace.span import Span
 
 from .. import DummyTracer
@@ -83,7 +89,7 @@ class RateSamplerTest(unittest.TestCase):
             assert deviation < 0.05, "Deviation too high %f with sample_rate %f" % (deviation, sample_rate)
 
     def test_deterministic_behavior(self):
-        """ Test that for a given trace ID, the result is always the same """
+        """Test that for a given trace ID, the result is always the same"""
         tracer = DummyTracer()
 
         tracer.sampler = RateSampler(0.5)
@@ -382,6 +388,61 @@ def test_sampling_rule_matches(span, rule, expected):
     assert rule.matches(span) is expected, "{} -> {} -> {}".format(rule, span, expected)
 
 
+@pytest.mark.parametrize(
+    "resource,tags,rule,expected",
+    [
+        ("GET /health", {}, SamplingRule(sample_rate=1, resource="GET /health"), True),
+        ("GET /health", {}, SamplingRule(sample_rate=1, resource="GET /users"), False),
+        ("GET /health", {}, SamplingRule(sample_rate=1, resource=re.compile(r"^GET /")), True),
+        ("GET /health", {}, SamplingRule(sample_rate=1, resource=lambda resource: "health" in resource), True),
+        ("GET /health", {"http.route": "/health"}, SamplingRule(sample_rate=1, tags={"http.route": "/health"}), True),
+        ("GET /health", {"http.route": "/health"}, SamplingRule(sample_rate=1, tags={"http.route": "/users"}), False),
+        ("GET /health", {}, SamplingRule(sample_rate=1, tags={"http.route": "/health"}), False),
+        ("GET /health", {}, SamplingRule(sample_rate=1, tags={"http.route": None}), True),
+        (
+            "GET /health",
+            {"http.route": "/health", "component": "flask"},
+            SamplingRule(sample_rate=1, tags={"http.route": re.compile(r"^/h"), "component": "flask"}),
+            True,
+        ),
+        (
+            "GET /health",
+            {"http.route": "/health", "component": "flask"},
+            SamplingRule(sample_rate=1, resource="GET /health", tags={"component": "django"}),
+            False,
+        ),
+    ],
+)
+def test_sampling_rule_matches_resource_and_tags(resource, tags, rule, expected):
+    span = Span(None, "test.span", resource=resource)
+    span.set_tags(tags)
+    assert rule.matches(span) is expected, "{} -> {} -> {}".format(rule, span, expected)
+
+
+@pytest.mark.parametrize(
+    "pattern,prefix",
+    [
+        (r"^/api/v1/", "/api/v1/"),
+        (r"/api/v1/", "/api/v1/"),
+        (r"GET /users/\d+", "GET /users/"),
+        (r"GET \/users\.json", "GET /users.json"),
+        (r"abc?", "ab"),
+        (r"abc*", "ab"),
+        (r"abc{2}", "ab"),
+        (r"abc+", "abc"),
+        (r"ab[cd]", "ab"),
+        (r"ab(c)", "ab"),
+        (r"ab.", "ab"),
+        (r"abc|def", ""),
+        (r"(?i)abc", ""),
+        (r".*abc", ""),
+    ],
+)
+def test_literal_prefix(pattern, prefix):
+    assert _literal_prefix(re.compile(pattern)) == prefix
+    assert _literal_prefix(re.compile(pattern, re.IGNORECASE)) == ""
+
+
 def test_sampling_rule_matches_exception():
     e = Exception("an error occurred")
 
@@ -761,6 +822,96 @@ def test_datadog_sampler_tracer_start_span(dummy_tracer):
     assert spans[0].get_metric(SAMPLING_RULE_DECISION) == 1.0
 
 
+def test_datadog_sampler_tracer_global_tags(dummy_tracer):
+    dummy_tracer.configure(sampler=DatadogSampler(rules=[SamplingRule(sample_rate=0, tags={"team": "x"})]))
+    dummy_tracer.set_tags({"team": "x"})
+
+    with dummy_tracer.trace("test.span"):
+        pass
+
+    [span] = dummy_tracer.pop()
+    assert span.get_metric(SAMPLING_PRIORITY_KEY) is AUTO_REJECT
+    assert span.get_metric(SAMPLING_RULE_DECISION) == 0
+
+
+@pytest.mark.parametrize(
+    "rule",
+    [
+        SamplingRule(sample_rate=0, tags={"http.route": "/health"}),
+        SamplingRule(sample_rate=0, resource="GET /health"),
+        SamplingRule(sample_rate=0, tags={"http.status_code": "200"}),
+        SamplingRule(sample_rate=0, tags={"team_id": 5}),
+    ],
+)
+def test_datadog_sampler_tracer_root_finished(dummy_tracer, rule):
+    dummy_tracer.configure(sampler=DatadogSampler(rules=[rule, SamplingRule(sample_rate=1)]))
+
+    with dummy_tracer.trace("flask.request") as root:
+        with dummy_tracer.trace("flask.handler"):
+            pass
+        # The integrations set the resource and the tags once the request is routed
+        root.resource = "GET /health"
+        root.set_tag("http.route", "/health")
+        root.set_tag("http.status_code", 200)
+        root.set_tag("team_id", 5)
+        assert root.context.sampling_priority is None
+
+    spans = dummy_tracer.pop()
+    assert len(spans) == 2
+    assert spans[0].get_metric(SAMPLING_PRIORITY_KEY) is AUTO_REJECT
+    assert spans[0].get_metric(SAMPLING_RULE_DECISION) == 0
+
+    # The decision does not leak to the next trace
+    with dummy_tracer.trace("flask.request"):
+        pass
+    [span] = dummy_tracer.pop()
+    assert span.get_metric(SAMPLING_PRIORITY_KEY) is AUTO_KEEP
+    assert span.get_metric(SAMPLING_RULE_DECISION) == 1
+
+
+def test_datadog_sampler_tracer_propagated(dummy_tracer):
+    sampler = DatadogSampler(rules=[SamplingRule(sample_rate=0, tags={"http.route": "/health"})])
+    dummy_tracer.configure(sampler=sampler)
+
+    with dummy_tracer.trace("flask.request") as root:
+        headers = {}
+        HTTPPropagator.inject(root.context, headers)
+        # The decision is final once propagated
+        root.set_tag("http.route", "/health")
+
+    [span] = dummy_tracer.pop()
+    assert headers[HTTP_HEADER_SAMPLING_PRIORITY] == str(AUTO_KEEP)
+    assert span.get_metric(SAMPLING_PRIORITY_KEY) is AUTO_KEEP
+
+
+def test_datadog_sampler_tracer_cloned_context(dummy_tracer):
+    sampler = DatadogSampler(rules=[SamplingRule(sample_rate=0, resource="GET /health")], default_sample_rate=1)
+    dummy_tracer.configure(sampler=sampler)
+
+    with dummy_tracer.trace("flask.request", resource="GET /health") as root:
+        # The clone gets the decision of the trace
+        ctx = root.context.clone()
+        with dummy_tracer.start_span("task", child_of=ctx) as task:
+            pass
+
+    assert task.get_metric(SAMPLING_PRIORITY_KEY) is AUTO_REJECT
+    assert root.get_metric(SAMPLING_PRIORITY_KEY) is AUTO_REJECT
+
+
+def test_datadog_sampler_tracer_manual_keep(dummy_tracer):
+    sampler = DatadogSampler(rules=[SamplingRule(sample_rate=0, tags={"http.route": "/health"})])
+    sampler_spy = mock.Mock(spec=sampler, wraps=sampler)
+    dummy_tracer.configure(sampler=sampler_spy)
+
+    with dummy_tracer.trace("flask.request") as root:
+        root.set_tag("http.route", "/health")
+        root.set_tag(MANUAL_KEEP_KEY)
+
+    [span] = dummy_tracer.pop()
+    assert span.get_metric(SAMPLING_PRIORITY_KEY) is USER_KEEP
+    sampler_spy.sample.assert_not_called()
+
+
 def test_datadog_sampler_update_rate_by_service_sample_rates(dummy_tracer):
     cases = [
         {
@@ -797,3 +948,136 @@ def test_datadog_sampler_update_rate_by_service_sample_rates(dummy_tracer):
         for k, v in iteritems(sampler.default_sampler._by_service_samplers):
             rates[k] = v.sample_rate
         assert case == rates, "%s != %s" % (case, rates)
+
+
+def test_datadog_sampler_matching_rules_cache():
+    rules = [
+        SamplingRule(sample_rate=0.1, service="other-service"),
+        SamplingRule(sample_rate=0.2, service=re.compile(r"^my-"), name="test.span"),
+        SamplingRule(sample_rate=0.3),
+    ]
+    sampler = DatadogSampler(rules=rules)
+    span = create_span(name="test.span", service="my-service")
+
+    assert sampler._matching_rules("my-service", "test.span").rules == ((rules[1], None),)
+    assert sampler._matching_rules("my-service", "other.span").rules == ((rules[2], None),)
+
+    with mock.patch.object(SamplingRule, "_matches") as mock_matches:
+        sampler.sample(span)
+        mock_matches.assert_not_called()
+    assert span.get_metric(SAMPLING_RULE_DECISION) == 0.2
+
+    # Assigning new rules resets the cache
+    sampler.rules = rules[:1]
+    assert sampler._matching_rules("my-service", "test.span").rules == ()
+
+
+def test_datadog_sampler_matching_rules_cache_not_cacheable():
+    def service_pattern(service):
+        return service == "my-service"
+
+    rules = [
+        NoMatch(0.1),
+        SamplingRule(sample_rate=0.2, service=service_pattern),
+        SamplingRule(sample_rate=0.3, name="test.span"),
+        SamplingRule(sample_rate=0.4),
+    ]
+    sampler = DatadogSampler(rules=rules)
+
+    # Rules with a function as pattern or overriding `matches` are evaluated for every span
+    assert sampler._matching_rules("my-service", "test.span").rules == (
+        (rules[0], rules[0].matches),
+        (rules[1], rules[1].matches),
+        (rules[2], None),
+    )
+
+    span = create_span(name="test.span", service="my-service")
+    sampler.sample(span)
+    assert span.get_metric(SAMPLING_RULE_DECISION) == 0.2
+
+    span = create_span(name="test.span", service="another-service")
+    sampler.sample(span)
+    assert span.get_metric(SAMPLING_RULE_DECISION) == 0.3
+
+    # Unhashable properties are matched without the cache
+    span = create_span(name="test.span", service="another-service")
+    span.name = ["test.span"]
+    sampler.sample(span)
+    assert span.get_metric(SAMPLING_RULE_DECISION) == 0.4
+
+
+def test_datadog_sampler_matching_rules_index():
+    rules = [
+        SamplingRule(sample_rate=0.1, service="other-service", resource="GET /health"),
+        SamplingRule(sample_rate=0.2, resource="GET /health"),
+        SamplingRule(sample_rate=0.3, resource=re.compile(r"^GET /users/\d+")),
+        SamplingRule(sample_rate=0.4, tags={"http.route": re.compile(r"^/api/")}),
+        SamplingRule(sample_rate=0.5, resource=lambda resource: resource.startswith("POST")),
+        SamplingRule(sample_rate=0.6, resource=re.compile(r"^GET /users")),
+        SamplingRule(sample_rate=0.7),
+    ]
+    sampler = DatadogSampler(rules=rules)
+
+    matching_rules = sampler._matching_rules("my-service", "web.request")
+    # The rules not matching the service are skipped, the list ends with the first rule known to match
+    assert [rule for rule, _ in matching_rules.rules] == rules[1:]
+
+    def candidates(resource, tags=None):
+        span = Span(None, "web.request", service="my-service", resource=resource)
+        span.set_tags(tags or {})
+        return [rule for rule, _ in matching_rules.candidates(span)]
+
+    # Only the rules indexed by a value or prefix of the span are evaluated, in order
+    assert candidates("GET /health") == [rules[1], rules[4], rules[6]]
+    assert candidates("GET /users/42") == [rules[2], rules[4], rules[5], rules[6]]
+    assert candidates("GET /users") == [rules[4], rules[5], rules[6]]
+    assert candidates("GET /", {"http.route": "/api/users"}) == [rules[3], rules[4], rules[6]]
+    assert candidates(42) == [rules[1], rules[4], rules[6]]
+
+    for resource, tags, rate in [
+        ("GET /health", {}, 0.2),
+        ("GET /users/42", {}, 0.3),
+        ("GET /", {"http.route": "/api/users"}, 0.4),
+        ("POST /users", {}, 0.5),
+        ("GET /users", {}, 0.6),
+        ("GET /", {}, 0.7),
+    ]:
+        span = Span(None, "web.request", service="my-service", resource=resource)
+        span.set_tags(tags)
+        sampler.sample(span)
+        assert span.get_metric(SAMPLING_RULE_DECISION) == rate, resource
+
+
+def test_datadog_sampler_rules_from_env():
+    rules = [
+        {"sample_rate": 0, "resource": "GET /health"},
+        {"sample_rate": "0.5", "service": "my-service", "name": "web.request"},
+        {"sample_rate": 0.25, "tags": {"http.route": "/api/*"}},
+        {"service": "no-sample-rate"},
+        {"sample_rate": 2},
+        "not-a-rule",
+    ]
+
+    with override_env(dict(DD_TRACE_SAMPLING_RULES=json.dumps(rules))):
+        with mock.patch("ddtrace.sampler.log") as mock_log:
+            sampler = DatadogSampler()
+        assert mock_log.error.call_count == 3
+
+    assert [repr(rule) for rule in sampler.rules] == [
+        repr(SamplingRule(sample_rate=0.0, resource="GET /health")),
+        repr(SamplingRule(sample_rate=0.5, service="my-service", name="web.request")),
+        repr(SamplingRule(sample_rate=0.25, tags={"http.route": re.compile(re.escape("/api/"))})),
+    ]
+    span = Span(None, "web.request")
+    span.set_tag("http.route", "/api/users")
+    assert sampler.rules[2].matches(span)
+
+    # Rules given in code take precedence
+    with override_env(dict(DD_TRACE_SAMPLING_RULES=json.dumps(rules))):
+        assert DatadogSampler(rules=[]).rules == []
+
+    for value in ("not json", json.dumps({"sample_rate": 1})):
+        with override_env(dict(DD_TRACE_SAMPLING_RULES=value)):
+            with mock.patch("ddtrace.sampler.log") as mock_log:
+                assert DatadogSampler().rules == []
+            mock_log.error.assert_called_once()
@@ -267,7 +267,7 @@ class SpanTestCase(TracerTestCase):
         assert d["error"] == 1
         assert type(d["error"]) == int
 
-    @mock.patch("ddtrace.span.log")
+    @mock.patch("ddtrace.internal._span.log")
     def test_numeric_tags_none(self, span_log):
         s = Span(tracer=None, name="test.span")
         s.set_tag(ANALYTICS_SAMPLE_RATE_KEY, None)
@@ -420,7 +420,7 @@ def test_set_tag_measured_change_value():
     assert_is_measured(s)
 
 
-@mock.patch("ddtrace.span.log")
+@mock.patch("ddtrace.internal._span.log")
 def test_span_key(span_log):
     # Span tag keys must be strings
     s = Span(tracer=None, name="test.span")
@@ -0,0 +1,292 @@
+from google.protobuf import descriptor_pb2
+from google.protobuf import descriptor_pool
+from google.protobuf import message_factory
+import mock
+import msgpack
+import pytest
+
+from ddtrace.constants import SAMPLING_PRIORITY_KEY
+from ddtrace.constants import SPAN_MEASURED_KEY
+from ddtrace.ext import http
+from ddtrace.ext import priority
+from ddtrace.internal.stats import DDSketch
+from ddtrace.internal.stats import StatsConcentrator
+from ddtrace.internal.stats import StatsWriter
+from ddtrace.internal.writer import AgentWriter
+from ddtrace.span import Span
+from ddtrace.tracer import Tracer
+from tests import override_global_config
+
+
+BUCKET_SIZE = 10 * 10 ** 9
+
+
+def ddsketch_class():
+    # The DDSketch protobuf messages, as defined by https://github.com/DataDog/sketches-go
+    f = descriptor_pb2.FileDescriptorProto(name="ddsketch_test.proto", package="ddsketch_test", syntax="proto3")
+
+    mapping = f.message_type.add(name="IndexMapping")
+    mapping.field.add(name="gamma", number=1, type=1, label=1)
+    mapping.field.add(name="indexOffset", number=2, type=1, label=1)
+    mapping.field.add(name="interpolation", number=3, type=5, label=1)
+
+    store = f.message_type.add(name="Store")
+    entry = store.nested_type.add(name="BinCountsEntry")
+    entry.options.map_entry = True
+    entry.field.add(name="key", number=1, type=17, label=1)
+    entry.field.add(name="value", number=2, type=1, label=1)
+    store.field.add(name="binCounts", number=1, type=11, label=3, type_name=".ddsketch_test.Store.BinCountsEntry")
+    store.field.add(name="contiguousBinCounts", number=2, type=1, label=3)
+    store.field.add(name="contiguousBinIndexOffset", number=3, type=17, label=1)
+
+    sketch = f.message_type.add(name="DDSketch")
+    sketch.field.add(name="mapping", number=1, type=11, label=1, type_name=".ddsketch_test.IndexMapping")
+    sketch.field.add(name="positiveValues", number=2, type=11, label=1, type_name=".ddsketch_test.Store")
+    sketch.field.add(name="negativeValues", number=3, type=11, label=1, type_name=".ddsketch_test.Store")
+    sketch.field.add(name="zeroCount", number=4, type=1, label=1)
+
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(f)
+    return message_factory.MessageFactory(pool).GetPrototype(pool.FindMessageTypeByName("ddsketch_test.DDSketch"))
+
+
+def make_span(name="web.request", service="web", resource="GET /", start=BUCKET_SIZE, duration=1000, parent=None):
+    span = Span(None, name, service=service, resource=resource, span_type="web")
+    span.start_ns = start
+    span.duration_ns = duration
+    span._parent = parent
+    return span
+
+
+def test_ddsketch_quantiles():
+    sketch = DDSketch()
+    assert sketch.quantile(0.5) is None
+
+    values = list(range(1, 10001))
+    for value in values:
+        sketch.add(value)
+    sketch.add(0)
+
+    assert sketch.count == 10001
+    assert sketch.zero_count == 1
+    assert sketch.quantile(0) == 0
+    for q in (0.1, 0.5, 0.9, 0.99, 1):
+        expected = values[int(q * (len(values) - 1))]
+        assert abs(sketch.quantile(q) - expected) <= 0.01 * expected + 1
+
+
+def test_ddsketch_to_proto():
+    sketch = DDSketch()
+    for value in (0, 0.5, 1, 2, 1000, 1000, 10 ** 9):
+        sketch.add(value)
+
+    proto = ddsketch_class().FromString(sketch.to_proto())
+
+    assert proto.mapping.gamma == DDSketch._GAMMA
+    assert proto.zeroCount == 1
+    assert dict(proto.positiveValues.binCounts) == dict(sketch._bins)
+    # Negative indexes are zigzag encoded
+    assert min(proto.positiveValues.binCounts) < 0
+    assert sum(proto.positiveValues.binCounts.values()) == 6
+
+
+def test_concentrator():
+    concentrator = StatsConcentrator(BUCKET_SIZE)
+    root = make_span(duration=5000)
+    root.set_tag(http.STATUS_CODE, 200)
+    # Same service, not measured: not aggregated
+    child = make_span(name="function", parent=root)
+    # Another service: top-level
+    db = make_span(name="postgres.query", service="postgres", resource="SELECT", parent=root)
+    db.error = 1
+    # Measured
+    measured = make_span(name="cache", parent=root)
+    measured.set_tag(SPAN_MEASURED_KEY)
+    # Next bucket
+    late = make_span(start=2 * BUCKET_SIZE - 500)
+    late.set_tag(http.STATUS_CODE, 200)
+    # Not finished
+    unfinished = make_span()
+    unfinished.duration_ns = None
+
+    concentrator.add_trace([root, child, db, measured, unfinished])
+    concentrator.add_trace([late])
+
+    # The buckets are flushed when they are over
+    assert concentrator.flush(now_ns=2 * BUCKET_SIZE - 1) == []
+    [bucket] = concentrator.flush(now_ns=2 * BUCKET_SIZE)
+    assert bucket["Start"] == BUCKET_SIZE
+    assert bucket["Duration"] == BUCKET_SIZE
+    stats = {(s["Service"], s["Name"], s["Resource"], s["HTTPStatusCode"]): s for s in bucket["Stats"]}
+    assert sorted(stats) == [
+        ("postgres", "postgres.query", "SELECT", 0),
+        ("web", "cache", "GET /", 0),
+        ("web", "web.request", "GET /", 200),
+    ]
+
+    web = stats[("web", "web.request", "GET /", 200)]
+    assert (web["Hits"], web["TopLevelHits"], web["Errors"], web["Duration"], web["Type"]) == (1, 1, 0, 5000, "web")
+    db_stats = stats[("postgres", "postgres.query", "SELECT", 0)]
+    assert (db_stats["Hits"], db_stats["TopLevelHits"], db_stats["Errors"]) == (1, 1, 1)
+    assert ddsketch_class().FromString(db_stats["ErrorSummary"]).positiveValues.binCounts
+    assert not ddsketch_class().FromString(db_stats["OkSummary"]).positiveValues.binCounts
+    cache = stats[("web", "cache", "GET /", 0)]
+    assert (cache["Hits"], cache["TopLevelHits"]) == (1, 0)
+
+    # The spans are counted in the bucket of their end time
+    [bucket] = concentrator.flush(force=True)
+    assert bucket["Start"] == 2 * BUCKET_SIZE
+    assert [s["Hits"] for s in bucket["Stats"]] == [1]
+    assert concentrator.flush(force=True) == []
+
+
+def test_concentrator_aggregates():
+    concentrator = StatsConcentrator(BUCKET_SIZE)
+    for duration in range(1, 101):
+        concentrator.add_trace([make_span(duration=duration)])
+
+    [bucket] = concentrator.flush(force=True)
+    [stats] = bucket["Stats"]
+    assert stats["Hits"] == stats["TopLevelHits"] == 100
+    assert stats["Duration"] == sum(range(1, 101))
+    assert sum(ddsketch_class().FromString(stats["OkSummary"]).positiveValues.binCounts.values()) == 100
+
+
+def test_stats_writer_flush():
+    writer = StatsWriter("http://localhost:8126")
+    writer._concentrator.add_trace([make_span()])
+
+    with mock.patch.object(writer, "_put", return_value=mock.Mock(status=200)) as put:
+        with override_global_config(dict(env="prod", version="1.2.3")):
+            writer.flush(force=True)
+        writer.flush(force=True)
+
+    put.assert_called_once()
+    payload = msgpack.unpackb(put.call_args[0][0], raw=False)
+    assert payload["Env"] == "prod"
+    assert payload["Version"] == "1.2.3"
+    assert payload["Lang"] == "python"
+    assert payload["Sequence"] == 1
+    [bucket] = payload["Stats"]
+    assert [(s["Service"], s["Name"], s["Hits"]) for s in bucket["Stats"]] == [("web", "web.request", 1)]
+
+
+@pytest.mark.parametrize(
+    "status,enabled,accepted", [(200, True, True), (404, False, False), (415, False, False), (500, True, False)]
+)
+def test_stats_writer_unsupported(status, enabled, accepted):
+    writer = StatsWriter("http://localhost:8126")
+    writer._concentrator.add_trace([make_span()])
+    assert writer.accepted is False
+
+    with mock.patch.object(writer, "_put", return_value=mock.Mock(status=status, reason="reason")):
+        writer.flush(force=True)
+
+    assert writer.enabled is enabled
+    assert writer.accepted is accepted
+
+
+@pytest.mark.parametrize("error", [mock.Mock(status=500, reason="reason"), OSError("connection refused")])
+def test_stats_writer_retry(error):
+    writer = StatsWriter("http://localhost:8126")
+    writer._concentrator.add_trace([make_span()])
+
+    put = mock.Mock(side_effect=error) if isinstance(error, Exception) else mock.Mock(return_value=error)
+    with mock.patch.object(writer, "_put", put):
+        writer.flush(force=True)
+    assert writer.accepted is False
+
+    # The metrics that could not be sent are sent with the next ones
+    writer._concentrator.add_trace([make_span(), make_span(start=2 * BUCKET_SIZE)])
+    with mock.patch.object(writer, "_put", return_value=mock.Mock(status=200)) as put:
+        writer.flush(force=True)
+    payload = msgpack.unpackb(put.call_args[0][0], raw=False)
+    assert [(bucket["Start"], bucket["Stats"][0]["Hits"]) for bucket in payload["Stats"]] == [
+        (BUCKET_SIZE, 2),
+        (2 * BUCKET_SIZE, 1),
+    ]
+    assert writer.accepted is True
+
+
+def test_concentrator_merge():
+    concentrator = StatsConcentrator(BUCKET_SIZE)
+    for start in range(1, 5):
+        concentrator.add_trace([make_span(start=start * BUCKET_SIZE, duration=start)])
+    buckets = concentrator.pop(force=True)
+
+    concentrator.add_trace([make_span(start=4 * BUCKET_SIZE, duration=4)])
+    # The oldest buckets are dropped
+    concentrator.merge(buckets, 2)
+    assert [(bucket["Start"], bucket["Stats"][0]["Hits"]) for bucket in concentrator.flush(force=True)] == [
+        (3 * BUCKET_SIZE, 1),
+        (4 * BUCKET_SIZE, 2),
+    ]
+
+
+def test_tracer_compute_stats():
+    with override_global_config(dict(compute_stats=True)):
+        tracer = Tracer()
+        tracer.configure(writer=AgentWriter("http://localhost:8126"))
+
+    stats_writer = tracer._stats_writer
+    assert isinstance(stats_writer, StatsWriter)
+    assert stats_writer.agent_url == "http://localhost:8126"
+    assert tracer.writer._headers["Datadog-Client-Computed-Stats"] == "yes"
+
+    def trace():
+        for sampling_priority in (
+            priority.USER_KEEP,
+            priority.AUTO_KEEP,
+            priority.AUTO_REJECT,
+            priority.USER_REJECT,
+        ):
+            with tracer.trace("web.request") as root:
+                root.context.sampling_priority = sampling_priority
+                with tracer.trace("function"):
+                    pass
+            assert root.get_metric(SAMPLING_PRIORITY_KEY) == sampling_priority
+
+    # All the traces are sent until the agent accepts the metrics computed by the tracer
+    with mock.patch.object(stats_writer, "write") as stats_write:
+        with mock.patch.object(tracer.writer, "write") as write:
+            trace()
+    assert stats_write.call_count == 4
+    assert write.call_count == 4
+
+    # The metrics of all the traces are computed, only the kept traces are sent to the agent
+    stats_writer.accepted = True
+    with mock.patch.object(stats_writer, "write") as stats_write:
+        with mock.patch.object(tracer.writer, "write") as write:
+            trace()
+    assert stats_write.call_count == 4
+    assert write.call_count == 2
+
+    # The rejected traces are sent when the agent does not support the metrics computed by the tracer, and the agent
+    # computes their metrics again
+    stats_writer.enabled = False
+    with mock.patch.object(tracer.writer, "write") as write:
+        with tracer.trace("web.request") as root:
+            root.context.sampling_priority = priority.AUTO_REJECT
+    write.assert_called_once()
+    assert "Datadog-Client-Computed-Stats" not in tracer.writer._headers
+
+    tracer.configure(writer=AgentWriter("http://localhost:8126"))
+    assert tracer._stats_writer is None
+    assert "Datadog-Client-Computed-Stats" not in tracer.writer._headers
+
+
+def test_tracer_compute_stats_drop_rejected_traces(caplog):
+    with override_global_config(dict(compute_stats=True, drop_rejected_traces=True)):
+        tracer = Tracer()
+        tracer.configure(writer=AgentWriter("http://localhost:8126"))
+        assert "DD_TRACE_DROP_REJECTED_TRACES is ignored" in caplog.text
+
+        with mock.patch.object(tracer._stats_writer, "write") as stats_write:
+            with tracer.trace("web.request") as root:
+                root.context.sampling_priority = priority.AUTO_REJECT
+                with tracer.trace("function") as child:
+                    child.set_tag("component", "web")
+
+    # The metrics of the rejected traces are computed from all their spans
+    assert type(child) is Span
+    stats_write.assert_called_once_with([root, child])
@@ -19,13 +19,21 @@ from ddtrace.constants import MANUAL_DROP_KEY
 from ddtrace.constants import MANUAL_KEEP_KEY
 from ddtrace.constants import ORIGIN_KEY
 from ddtrace.constants import SAMPLING_PRIORITY_KEY
+from ddtrace.constants import SAMPLING_RULE_DECISION
+from ddtrace.constants import SERVICE_KEY
 from ddtrace.constants import VERSION_KEY
 from ddtrace.context import Context
 from ddtrace.ext import priority
 from ddtrace.ext import system
 from ddtrace.internal.writer import AgentWriter
 from ddtrace.internal.writer import LogWriter
+from ddtrace.propagation.http import HTTPPropagator
+from ddtrace.propagation.http import HTTP_HEADER_PARENT_ID
+from ddtrace.propagation.http import HTTP_HEADER_SAMPLING_PRIORITY
+from ddtrace.sampler import DatadogSampler
+from ddtrace.sampler import SamplingRule
 from ddtrace.settings import Config
+from ddtrace.span import _NoopSpan
 from ddtrace.tracer import Tracer
 from ddtrace.vendor import six
 from tests import DummyWriter
@@ -660,11 +668,11 @@ def test_tracer_fork():
             with capture_failures(errors):
                 assert t._pid != original_pid
                 assert t.writer != original_writer
-                assert t.writer._buffer != original_writer._buffer
+                assert t.writer._encoder != original_writer._encoder
 
         # Assert the trace got written into the correct queue
-        assert len(original_writer._buffer) == 0
-        assert len(t.writer._buffer) == 1
+        assert len(original_writer._encoder) == 0
+        assert len(t.writer._encoder) == 1
 
     # Assert tracer in a new process correctly recreates the writer
     errors = multiprocessing.Queue()
@@ -680,11 +688,11 @@ def test_tracer_fork():
     with t.trace("test", service="test"):
         assert t._pid == original_pid
         assert t.writer == original_writer
-        assert t.writer._buffer == original_writer._buffer
+        assert t.writer._encoder == original_writer._encoder
 
     # Assert the trace got written into the correct queue
-    assert len(original_writer._buffer) == 1
-    assert len(t.writer._buffer) == 1
+    assert len(original_writer._encoder) == 1
+    assert len(t.writer._encoder) == 1
 
 
 def test_tracer_trace_across_fork():
@@ -1502,6 +1510,158 @@ def test_service_mapping():
             assert _.service == "fu"
 
 
+def test_child_span_defaults():
+    t = ddtrace.Tracer()
+    t.set_tags({"team": "web", "shard": 3})
+    with override_global_config(dict(env="prod", version="1.2.3", service="web")):
+        with t.trace("root", span_type="web") as root:
+            with t.trace("child") as child:
+                with t.trace("db", service="postgres") as db:
+                    pass
+            ctx = root.context
+            defaults = ctx._span_defaults
+            assert defaults.tracer is t
+            assert defaults.services == {"web": ("web", "1.2.3"), "postgres": ("postgres", None)}
+
+        # The decisions are made once per trace
+        assert ctx._span_defaults is None
+
+        for span in (root, child, db):
+            assert span.get_tag(ENV_KEY) == "prod"
+            assert span.get_tag("team") == "web"
+            assert span.get_metric("shard") == 3
+        assert root.get_tag(VERSION_KEY) == child.get_tag(VERSION_KEY) == "1.2.3"
+        assert db.get_tag(VERSION_KEY) is None
+        assert child.service == "web"
+        assert db.service == "postgres"
+        assert child.parent_id == root.span_id
+        assert db.parent_id == child.span_id
+
+        t.set_tags({"team": "api"})
+        with t.trace("root"):
+            with t.trace("child") as child:
+                pass
+        assert child.get_tag("team") == "api"
+
+
+def test_child_span_defaults_side_effect_tags():
+    t = ddtrace.Tracer()
+    t.set_tags({SERVICE_KEY: "tags.service"})
+    with t.trace("root", service="web") as root:
+        with t.trace("child") as child:
+            assert root.context._span_defaults is None
+    assert root.service == child.service == "tags.service"
+
+
+@pytest.mark.parametrize("drop_rejected_traces", [False, True])
+def test_drop_rejected_traces(drop_rejected_traces):
+    t = ddtrace.Tracer()
+    t.configure(sampler=DatadogSampler(default_sample_rate=0))
+    t.writer = DummyWriter()
+
+    with override_global_config(dict(drop_rejected_traces=drop_rejected_traces)):
+        with t.trace("root") as root:
+            with t.trace("child") as child:
+                child.set_tag("component", "web")
+                child.set_metric("count", 1)
+                assert t.current_span() is child
+                with t.trace("grandchild") as grandchild:
+                    headers = {}
+                    HTTPPropagator().inject(grandchild.context, headers)
+
+    # The trace is still propagated
+    assert child.trace_id == grandchild.trace_id == root.trace_id
+    assert child.parent_id == root.span_id
+    assert grandchild.parent_id == child.span_id
+    assert headers[HTTP_HEADER_PARENT_ID] == str(grandchild.span_id)
+    assert headers[HTTP_HEADER_SAMPLING_PRIORITY] == str(priority.AUTO_REJECT)
+
+    if drop_rejected_traces:
+        assert type(child) is type(grandchild) is _NoopSpan
+        assert child.meta == {}
+        assert child.metrics == {}
+        assert t.writer.pop() == []
+    else:
+        assert type(child) is type(grandchild) is ddtrace.Span
+        assert child.get_tag("component") == "web"
+        assert t.writer.pop() == [root, child, grandchild]
+        assert root.get_metric(SAMPLING_PRIORITY_KEY) == priority.AUTO_REJECT
+
+
+def test_drop_rejected_traces_kept():
+    t = ddtrace.Tracer()
+    t.configure(sampler=DatadogSampler(default_sample_rate=1))
+    t.writer = DummyWriter()
+
+    with override_global_config(dict(drop_rejected_traces=True)):
+        with t.trace("root") as root:
+            with t.trace("child") as child:
+                child.set_tag("component", "web")
+
+    assert type(child) is ddtrace.Span
+    assert child.get_tag("component") == "web"
+    assert t.writer.pop() == [root, child]
+
+
+def test_drop_rejected_traces_distributed():
+    t = ddtrace.Tracer()
+    t.writer = DummyWriter()
+
+    with override_global_config(dict(drop_rejected_traces=True)):
+        for sampling_priority, dropped in [(priority.USER_REJECT, True), (priority.AUTO_KEEP, False)]:
+            t.context_provider.activate(Context(trace_id=1, span_id=2, sampling_priority=sampling_priority))
+            with t.trace("remote.child") as span:
+                with t.trace("child") as child:
+                    pass
+
+            assert isinstance(child, _NoopSpan) is dropped
+            assert t.writer.pop() == ([] if dropped else [span, child])
+
+
+@pytest.mark.parametrize("tag", [MANUAL_KEEP_KEY, MANUAL_DROP_KEY])
+def test_drop_rejected_traces_manual_tag(tag):
+    t = ddtrace.Tracer()
+    t.configure(sampler=DatadogSampler(default_sample_rate=0 if tag == MANUAL_KEEP_KEY else 1))
+    t.writer = DummyWriter()
+
+    with override_global_config(dict(drop_rejected_traces=True)):
+        with t.trace("root") as root:
+            with t.trace("child") as child:
+                # The span of a rejected trace does not record tags but still changes the decision
+                child.set_tag(tag)
+                with t.trace("grandchild") as grandchild:
+                    grandchild.set_tag("component", "web")
+
+    if tag == MANUAL_KEEP_KEY:
+        assert type(child) is _NoopSpan
+        # The spans started once the trace is kept are recorded
+        assert type(grandchild) is ddtrace.Span
+        assert grandchild.get_tag("component") == "web"
+        assert t.writer.pop() == [root, child, grandchild]
+        assert root.get_metric(SAMPLING_PRIORITY_KEY) == priority.USER_KEEP
+    else:
+        assert type(child) is ddtrace.Span
+        assert type(grandchild) is _NoopSpan
+        assert t.writer.pop() == []
+
+
+def test_drop_rejected_traces_deferred_rule():
+    t = ddtrace.Tracer()
+    t.configure(sampler=DatadogSampler(rules=[SamplingRule(sample_rate=0, tags={"http.route": "/health"})]))
+    t.writer = DummyWriter()
+
+    with override_global_config(dict(drop_rejected_traces=True)):
+        with t.trace("root") as root:
+            with t.trace("child") as child:
+                pass
+            root.set_tag("http.route", "/health")
+
+    # The spans are recorded until the decision is made, the trace is dropped once it is
+    assert type(child) is ddtrace.Span
+    assert root.get_metric(SAMPLING_RULE_DECISION) == 0
+    assert t.writer.pop() == []
+
+
 def test_configure_url_partial():
     tracer = ddtrace.Tracer()
     tracer.configure(hostname="abc")
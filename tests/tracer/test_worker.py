@@ -69,3 +69,22 @@ def test_atexit_not_started():
     w = _worker.PeriodicWorkerThread(exit_timeout=1)
     assert not w.started
     w._atexit()
+
+
+def test_wake():
+    results = []
+
+    class MyWorker(_worker.PeriodicWorkerThread):
+        @staticmethod
+        def run_periodic():
+            results.append(object())
+
+    w = MyWorker(interval=3600)
+    w.start()
+    w.wake()
+    # The worker should run really quickly, but just in case the thread is a snail, wait
+    while not results:
+        pass
+    w.stop()
+    w.join()
+    assert len(results) == 1
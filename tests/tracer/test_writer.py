@@ -1,3 +1,5 @@
+import gzip
+import io
 import os
 import socket
 import tempfile
@@ -12,6 +14,9 @@ from ddtrace.compat import PY3
 from ddtrace.compat import get_connection_response
 from ddtrace.compat import httplib
 from ddtrace.constants import KEEP_SPANS_RATE_KEY
+from ddtrace.internal._encoding import BufferedEncoderV05
+from ddtrace.internal._encoding import MsgpackEncoder
+from ddtrace.internal._encoding import ShardedEncoder
 from ddtrace.internal.uds import UDSHTTPConnection
 from ddtrace.internal.writer import AgentWriter
 from ddtrace.internal.writer import LogWriter
@@ -179,6 +184,8 @@ class AgentWriterTests(BaseTestCase):
         writer_metrics_reset = mock.Mock()
         writer = AgentWriter(agent_url="http://asdf:1234", buffer_size=5300, dogstatsd=statsd, report_metrics=False)
         writer._metrics_reset = writer_metrics_reset
+        # Only flush on shutdown
+        writer.wake = mock.Mock()
         for i in range(10):
             writer.write(
                 [Span(tracer=None, name="name", trace_id=i, span_id=j, parent_id=j - 1 or None) for j in range(5)]
@@ -196,7 +203,8 @@ class AgentWriterTests(BaseTestCase):
         statsd = mock.Mock()
         writer_encoder = mock.Mock()
         writer_metrics_reset = mock.Mock()
-        writer_encoder.encode_trace.side_effect = Exception
+        writer_encoder.put.side_effect = Exception
+        writer_encoder.encode.return_value = None
         writer = AgentWriter(agent_url="http://asdf:1234", dogstatsd=statsd, report_metrics=False)
         writer._encoder = writer_encoder
         writer._metrics_reset = writer_metrics_reset
@@ -324,6 +332,8 @@ class _BaseHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
 class _APIEndpointRequestHandlerTest(_BaseHTTPRequestHandler):
     def do_PUT(self):
+        # Read the body before replying, the client could otherwise fail to send it
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
         self.send_error(200, "OK")
 
 
@@ -467,7 +477,7 @@ def test_racing_start():
     for t in ts:
         t.join()
 
-    assert len(writer._buffer) == 100
+    assert len(writer._encoder) == 100
 
 
 def test_double_stop():
@@ -481,3 +491,369 @@ def test_double_stop():
     writer.stop()
     assert writer.started
     assert not writer.is_alive()
+
+
+@pytest.mark.parametrize(
+    "api_version,priority_sampler,endpoint",
+    [
+        (None, None, "/v0.3/traces"),
+        (None, mock.Mock(), "/v0.4/traces"),
+        ("v0.4", None, "/v0.4/traces"),
+        ("v0.5", mock.Mock(), "/v0.5/traces"),
+    ],
+)
+def test_api_version(api_version, priority_sampler, endpoint):
+    writer = AgentWriter(agent_url="http://dne:1234", api_version=api_version, priority_sampler=priority_sampler)
+    assert writer._endpoint == endpoint
+    assert writer.recreate()._endpoint == endpoint
+
+
+def test_api_version_env(monkeypatch):
+    monkeypatch.setenv("DD_TRACE_API_VERSION", "v0.5")
+    writer = AgentWriter(agent_url="http://dne:1234")
+    assert writer._endpoint == "/v0.5/traces"
+    assert isinstance(writer._encoder, BufferedEncoderV05)
+
+    monkeypatch.setenv("DD_TRACE_API_VERSION", "v0.6")
+    with pytest.raises(ValueError):
+        AgentWriter(agent_url="http://dne:1234")
+
+
+def test_downgrade_v05():
+    writer = AgentWriter(agent_url="http://dne:1234", api_version="v0.5")
+    writer.run_periodic = mock.Mock()
+    writer._put = mock.Mock(side_effect=[Response(status=404), Response(status=200)])
+
+    writer.write([Span(None, "name")])
+    writer.flush_queue()
+
+    # The v0.5 payload cannot be sent to the v0.4 endpoint: it is dropped
+    writer._put.assert_called_once()
+    assert writer._endpoint == "/v0.4/traces"
+    assert type(writer._encoder) is ShardedEncoder
+    assert writer._drop_sma.get() == 1.0
+
+    writer.write([Span(None, "name"), Span(None, "name")])
+    writer.flush_queue()
+
+    assert writer._put.call_count == 2
+    payload = msgpack.unpackb(writer._put.call_args.args[0])
+    assert len(payload) == 1
+    assert len(payload[0]) == 2
+    assert writer._endpoint == "/v0.4/traces"
+    assert writer.recreate()._endpoint == "/v0.4/traces"
+
+
+def test_flush_threshold():
+    writer = AgentWriter(agent_url="http://dne:1234", processing_interval=3600, flush_threshold=1000)
+    flushed = threading.Event()
+    writer._put = mock.Mock(side_effect=lambda *args: flushed.set() or Response(status=200))
+
+    trace = [Span(None, "name", trace_id=1, span_id=j) for j in range(2)]
+    writer.write(trace)
+    assert not flushed.wait(0.1)
+
+    while writer._encoder.size < 1000:
+        writer.write(trace)
+    assert flushed.wait(5)
+    writer.stop()
+    writer.join()
+
+
+def test_flush_threshold_wake_once():
+    writer = AgentWriter(agent_url="http://dne:1234", processing_interval=3600, flush_threshold=1000)
+    writer._put = mock.Mock(return_value=Response(status=200))
+    writer.wake = mock.Mock()
+
+    trace = [Span(None, "name", trace_id=1, span_id=j) for j in range(2)]
+    while writer._encoder.size < 1000:
+        writer.write(trace)
+    writer.wake.assert_called_once_with()
+
+    # The writer is not woken up again until the buffer is flushed
+    writer.write(trace)
+    writer.write(trace)
+    writer.wake.assert_called_once_with()
+
+    writer.flush_queue()
+    while writer._encoder.size < 1000:
+        writer.write(trace)
+    assert writer.wake.call_count == 2
+
+
+def test_flush_threshold_bursts():
+    # Measure the proportion of traces dropped because the buffer is full when traces are written in bursts larger
+    # than the buffer. The periodic flush alone is too slow to empty the buffer between bursts.
+    trace = [Span(None, "name", trace_id=1, span_id=j) for j in range(10)]
+    trace_size = len(MsgpackEncoder().encode_trace(trace))
+    writer = AgentWriter(agent_url="http://dne:1234", processing_interval=3600, buffer_size=trace_size * 100)
+    writer._put = mock.Mock(return_value=Response(status=200))
+    writer._metrics_dist = mock.Mock(wraps=writer._metrics_dist)
+
+    n_threads, n_bursts, burst_size = 4, 10, 50
+
+    def produce():
+        for _ in range(n_bursts):
+            for _ in range(burst_size):
+                writer.write(trace)
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=produce) for _ in range(n_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    writer.stop()
+    writer.join()
+
+    dropped = sum(c.args[1] for c in writer._metrics_dist.call_args_list if c.args[:1] == ("buffer.dropped.traces",))
+    drop_rate = float(dropped) / (n_threads * n_bursts * burst_size)
+    # Each burst writes twice as many traces as the buffer can hold
+    assert drop_rate < 0.25
+
+
+def test_encode_queue():
+    writer = AgentWriter(agent_url="http://dne:1234", processing_interval=3600, encode_queue_size=10)
+    writer._put = mock.Mock(return_value=Response(status=200))
+    writer.wake = mock.Mock()
+
+    for i in range(1, 5):
+        writer.write([Span(None, "name", trace_id=i)])
+    # Traces are encoded by the writer thread, not the thread writing them
+    assert len(writer._queue) == 4
+    assert len(writer._encoder) == 0
+    writer.wake.assert_not_called()
+
+    writer.write([Span(None, "name", trace_id=5)])
+    writer.wake.assert_called_once_with()
+
+    # The writer is not woken up again until the queue is emptied
+    writer.write([Span(None, "name", trace_id=6)])
+    writer.wake.assert_called_once_with()
+
+    writer.flush_queue()
+    assert len(writer._queue) == 0
+    payload = msgpack.unpackb(writer._put.call_args.args[0])
+    assert [trace[0]["trace_id"] for trace in payload] == list(range(1, 7))
+    assert writer.recreate()._queue.maxsize == 10
+    writer.stop()
+
+
+@pytest.mark.parametrize(
+    "policy,sent",
+    [
+        ("drop-newest", [1, 2]),
+        ("drop-oldest", [2, 3]),
+        ("block", [1, 2]),
+    ],
+)
+def test_encode_queue_policy(policy, sent):
+    writer = AgentWriter(
+        agent_url="http://dne:1234",
+        processing_interval=3600,
+        encode_queue_size=2,
+        encode_queue_policy=policy,
+        encode_queue_timeout=0.01,
+    )
+    writer._put = mock.Mock(return_value=Response(status=200))
+    writer.wake = mock.Mock()
+    writer._metrics_dist = mock.Mock(wraps=writer._metrics_dist)
+
+    for i in range(1, 4):
+        writer.write([Span(None, "name", trace_id=i)])
+    writer._metrics_dist.assert_any_call("buffer.dropped.traces", 1, tags=["reason:queue_full"])
+
+    writer.flush_queue()
+    payload = msgpack.unpackb(writer._put.call_args.args[0])
+    assert [trace[0]["trace_id"] for trace in payload] == sent
+    writer.stop()
+
+
+def test_encode_queue_env(monkeypatch):
+    assert AgentWriter(agent_url="http://dne:1234")._queue is None
+
+    monkeypatch.setenv("DD_TRACE_ENCODE_QUEUE_SIZE", "100")
+    monkeypatch.setenv("DD_TRACE_ENCODE_QUEUE_POLICY", "block")
+    monkeypatch.setenv("DD_TRACE_ENCODE_QUEUE_TIMEOUT", "0.5")
+    writer = AgentWriter(agent_url="http://dne:1234")
+    assert writer._queue.maxsize == 100
+    assert writer._queue.policy == "block"
+    assert writer._queue.timeout == 0.5
+
+    monkeypatch.setenv("DD_TRACE_ENCODE_QUEUE_POLICY", "drop-everything")
+    with pytest.raises(ValueError):
+        AgentWriter(agent_url="http://dne:1234")
+
+
+class _FakeAgentRequestHandler(_BaseHTTPRequestHandler):
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.server.status >= 500:
+            self.send_error(self.server.status)
+            return
+        self.server.traces.extend(trace[0]["trace_id"] for trace in msgpack.unpackb(body))
+        self.send_error(200, "OK")
+
+
+class FakeAgent(object):
+    """An agent recording the ids of the traces it receives, that can be stopped and restarted."""
+
+    def __init__(self, port):
+        self.port = port
+        self.traces = []
+        self.status = 200
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        self._server, self._thread = _make_server(self.port, _FakeAgentRequestHandler)
+        self._server.traces = self.traces
+        self._server.status = self.status
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def set_status(self, status):
+        self.status = self._server.status = status
+
+
+@pytest.fixture
+def fake_agent():
+    agent = FakeAgent(_RESET_PORT + 1)
+    agent.start()
+    try:
+        yield agent
+    finally:
+        agent.stop()
+
+
+def _retry_writer(**kwargs):
+    writer = AgentWriter(agent_url="http://localhost:%d" % (_RESET_PORT + 1), processing_interval=3600, **kwargs)
+    writer.wake = mock.Mock()
+    writer._metrics_dist = mock.Mock(wraps=writer._metrics_dist)
+    # Retry on every flush
+    writer._retry_queue.base_delay = 0
+    return writer
+
+
+def _dropped_traces(writer):
+    return sum(c.args[1] for c in writer._metrics_dist.call_args_list if c.args[:1] == ("http.dropped.traces",))
+
+
+@pytest.mark.parametrize("spill_size", [0, 1 << 20])
+def test_retry_agent_down(fake_agent, spill_size):
+    # Spill all the payloads to disk when enabled
+    writer = _retry_writer(retry_queue_size=1 if spill_size else 1 << 20, spill_size=spill_size)
+
+    writer.write([Span(None, "name", trace_id=1)])
+    writer.flush_queue()
+    assert fake_agent.traces == [1]
+
+    fake_agent.stop()
+    writer.write([Span(None, "name", trace_id=2)])
+    writer.flush_queue()
+    writer.write([Span(None, "name", trace_id=3)])
+    writer.flush_queue()
+    assert len(writer._retry_queue) == 2
+
+    fake_agent.start()
+    fake_agent.set_status(503)
+    writer.write([Span(None, "name", trace_id=4)])
+    writer.flush_queue()
+    assert len(writer._retry_queue) == 3
+
+    fake_agent.set_status(200)
+    writer.write([Span(None, "name", trace_id=5)])
+    writer.flush_queue()
+    assert len(writer._retry_queue) == 0
+    # The traces are sent in order once the agent is back
+    assert fake_agent.traces == [1, 2, 3, 4, 5]
+    assert _dropped_traces(writer) == 0
+    writer.stop()
+
+
+def test_retry_backoff(fake_agent):
+    writer = _retry_writer(retry_queue_size=1 << 20)
+    writer._retry_queue.base_delay = 3600
+    fake_agent.set_status(503)
+
+    writer.write([Span(None, "name", trace_id=1)])
+    writer.flush_queue()
+    fake_agent.set_status(200)
+    writer.write([Span(None, "name", trace_id=2)])
+    writer.flush_queue()
+    # Nothing is sent until the backoff delay has elapsed
+    assert fake_agent.traces == []
+
+    writer.stop()
+    writer.join()
+    # Pending payloads are sent on shutdown
+    assert fake_agent.traces == [1, 2]
+
+
+def test_retry_queue_full(fake_agent):
+    writer = _retry_writer(retry_queue_size=1 << 20)
+    fake_agent.stop()
+
+    for i in range(1, 5):
+        writer.write([Span(None, "name", trace_id=i)])
+        writer.flush_queue()
+        if i == 1:
+            # Room for two payloads, whose sizes vary slightly with their random span ids
+            writer._retry_queue.max_size = writer._retry_queue.size * 5 // 2
+
+    # The oldest payloads are dropped
+    assert _dropped_traces(writer) == 2
+    fake_agent.start()
+    writer.flush_queue()
+    assert fake_agent.traces == [3, 4]
+    writer.stop()
+
+
+def test_retry_disabled(fake_agent):
+    writer = AgentWriter(agent_url="http://localhost:%d" % (_RESET_PORT + 1))
+    assert writer._retry_queue is None
+    writer._metrics_dist = mock.Mock(wraps=writer._metrics_dist)
+    fake_agent.set_status(503)
+
+    writer.write([Span(None, "name", trace_id=1)])
+    writer.flush_queue()
+    assert _dropped_traces(writer) == 1
+    writer.stop()
+
+
+@pytest.mark.parametrize("ntraces,compressed", [(1, False), (100, True)])
+def test_compression(ntraces, compressed):
+    writer = AgentWriter(agent_url="http://dne:1234", compression="gzip", compression_threshold=1000)
+    writer._put = mock.Mock(return_value=Response(status=200))
+
+    for i in range(1, ntraces + 1):
+        writer.write([Span(None, "name", trace_id=i)])
+    writer.flush_queue()
+
+    data, headers = writer._put.call_args.args
+    if compressed:
+        # Payloads larger than the threshold are compressed
+        assert headers["Content-Encoding"] == "gzip"
+        data = gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+    else:
+        assert "Content-Encoding" not in headers
+    assert [trace[0]["trace_id"] for trace in msgpack.unpackb(data)] == list(range(1, ntraces + 1))
+    assert writer.recreate()._compression == "gzip"
+    writer.stop()
+
+
+def test_compression_env(monkeypatch):
+    assert AgentWriter(agent_url="http://dne:1234")._compression is None
+
+    monkeypatch.setenv("DD_TRACE_COMPRESSION", "gzip")
+    monkeypatch.setenv("DD_TRACE_COMPRESSION_THRESHOLD", "0")
+    writer = AgentWriter(agent_url="http://dne:1234")
+    assert writer._compression == "gzip"
+    assert writer._compression_threshold == 0
+
+    monkeypatch.setenv("DD_TRACE_COMPRESSION", "lzma")
+    with pytest.raises(ValueError):
+        AgentWriter(agent_url="http://dne:1234")